@@ -1,14 +1,21 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Friendship
+from .models import CustomUser, Friendship, UserKeys
+
+class UserKeysInline(admin.StackedInline):
+    model = UserKeys
+    can_delete = False
+    readonly_fields = ['public_key_pem', 'updated_at']
+    fields = ['public_key_pem', 'updated_at']
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
-    list_display = ['username', 'email', 'is_online', 'created_at']
+    inlines = [UserKeysInline]
+    list_display = ['username', 'email', 'is_online', 'last_seen', 'created_at']
     list_filter = ['is_online', 'is_staff', 'created_at']
     
     fieldsets = UserAdmin.fieldsets + (
-        ('Additional Info', {'fields': ('is_online',)}),
+        ('Additional Info', {'fields': ('is_online', 'last_seen')}),
     )
 
 @admin.register(Friendship)
@@ -0,0 +1,163 @@
+# accounts/keypool.py - Pre-generated RSA key pairs for registration
+import atexit
+import base64
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def generate_key_pair():
+    """Generate a 2048-bit RSA key pair as (public_pem, private_pem)"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    ).decode('utf-8')
+    return public_pem, private_pem
+
+
+def generate_user_keys(user_id):
+    """Fresh key material for one user, encoded as UserKeys stores it (bulk rotation job)"""
+    public_pem, private_pem = generate_key_pair()
+    return (
+        user_id,
+        public_pem,
+        base64.urlsafe_b64encode(private_pem.encode()).decode(),
+        base64.urlsafe_b64encode(Fernet.generate_key()).decode(),
+    )
+
+
+def key_process_pool(workers):
+    """Process pool for key generation; spawn, not fork, since callers may run threads"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class KeyPairPool:
+    """
+    Ready-made key pairs, refilled by a background process pool.
+
+    take() pops a pair in constant time. Whenever the number of ready plus
+    in-flight pairs drops to the low watermark, enough generation jobs are
+    submitted to reach the high watermark. Every pair is handed out once.
+    """
+
+    def __init__(self, low=8, high=32, workers=2):
+        self.low = low
+        self.high = high
+        self.workers = workers
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._inflight = 0
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+
+    def take(self):
+        """Return a ready (public_pem, private_pem) pair, or None when the pool is empty"""
+        with self._lock:
+            if self._ready:
+                pair = self._ready.popleft()
+                self.hits += 1
+            else:
+                pair = None
+                self.misses += 1
+        self.refill()
+        return pair
+
+    def refill(self):
+        """Top the pool up to the high watermark if it is at or below the low one"""
+        with self._lock:
+            if self.high <= 0 or len(self._ready) + self._inflight > self.low:
+                return
+            wanted = self.high - len(self._ready) - self._inflight
+            if self._executor is None:
+                self._executor = key_process_pool(self.workers)
+            executor = self._executor
+            self._inflight += wanted
+
+        for submitted in range(wanted):
+            try:
+                executor.submit(generate_key_pair).add_done_callback(self._collect)
+            except Exception as e:
+                logger.error(f"Error submitting key generation jobs: {e}")
+                with self._lock:
+                    self._inflight -= wanted - submitted
+                    self.failures += 1
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+                return
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            takes = self.hits + self.misses
+            return {
+                'ready': len(self._ready),
+                'inflight': self._inflight,
+                'low': self.low,
+                'high': self.high,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / takes, 4) if takes else 0.0,
+                'generated': self.generated,
+                'failures': self.failures,
+            }
+
+    def _collect(self, future):
+        with self._lock:
+            self._inflight -= 1
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None:
+                self._ready.append(future.result())
+                self.generated += 1
+            else:
+                self.failures += 1
+        if error is not None:
+            logger.error(f"Error generating pooled RSA keys: {error}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool():
+    """Return the process-wide key pair pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = KeyPairPool(
+                low=getattr(settings, 'USER_KEY_POOL_LOW', 8),
+                high=getattr(settings, 'USER_KEY_POOL_HIGH', 32),
+                workers=getattr(settings, 'USER_KEY_POOL_WORKERS', 2),
+            )
+        return _pool
+
+
+@atexit.register
+def _shutdown_pool_on_exit():
+    if _pool is not None:
+        _pool.shutdown()
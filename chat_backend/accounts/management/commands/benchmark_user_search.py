@@ -0,0 +1,122 @@
+# accounts/management/commands/benchmark_user_search.py
+
+import random
+import string
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from accounts.search import rebuild_index, search_users
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare icontains user search with the search index on synthetic users (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100000,
+            help='Synthetic users to create, e.g. 1000000 for the full-size comparison',
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=200,
+            help='Search queries to time per method',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.run(rng, options['users'], options['queries'])
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Synthetic users rolled back")
+
+    def run(self, rng, user_count, query_count):
+        self.stdout.write(f"=== User search: {user_count} users, {query_count} queries ===")
+
+        start = time.perf_counter()
+        names = self.create_users(rng, user_count)
+        created = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rebuild_index(User.objects.filter(username__startswith='bench_'), batch_size=5000)
+        indexed = time.perf_counter() - start
+        self.stdout.write(f"Created users in {created:.1f}s, built index in {indexed:.1f}s")
+
+        queries = self.make_queries(rng, names, query_count)
+
+        def icontains(query):
+            return list(User.objects.filter(
+                Q(username__icontains=query) | Q(email__icontains=query)
+            )[:10])
+
+        def indexed_uncached(query):
+            cache.clear()
+            return search_users(query)
+
+        self.stdout.write(f"{'method':>18} {'mean ms':>9} {'p95 ms':>9}")
+        for label, search, warm in (
+            ('icontains', icontains, False),
+            ('index (no cache)', indexed_uncached, False),
+            ('index (cached)', search_users, True),
+        ):
+            if warm:
+                for query in queries:
+                    search(query)
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                search(query)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            mean = sum(timings) / len(timings)
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(f"{label:>18} {mean * 1000:>9.2f} {p95 * 1000:>9.2f}")
+
+    def create_users(self, rng, count, batch_size=5000):
+        """Insert users with bulk_create, skipping key generation in CustomUser.save()"""
+        names = []
+        batch = []
+        for i in range(count):
+            name = 'bench_' + ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12))) + str(i)
+            names.append(name)
+            batch.append(User(username=name, email=f'{name}@example.com', password='!'))
+            if len(batch) >= batch_size:
+                User.objects.bulk_create(batch)
+                batch = []
+        User.objects.bulk_create(batch)
+        return names
+
+    def make_queries(self, rng, names, count):
+        """A mix of whole names, prefixes and inner substrings, as typed in the friend search box"""
+        queries = []
+        for _ in range(count):
+            name = rng.choice(names)
+            kind = rng.random()
+            if kind < 0.2:
+                queries.append(name)
+            elif kind < 0.7:
+                queries.append(name[:rng.randint(8, len(name))])
+            else:
+                start = rng.randint(6, len(name) - 3)
+                queries.append(name[start:start + 3])
+        return queries
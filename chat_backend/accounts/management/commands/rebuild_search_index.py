@@ -0,0 +1,21 @@
+# accounts/management/commands/rebuild_search_index.py
+
+from django.core.management.base import BaseCommand
+
+from accounts.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user search index from usernames and emails'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per INSERT',
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} users"))
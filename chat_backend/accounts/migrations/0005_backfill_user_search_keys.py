@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:53
+
+import unicodedata
+
+from django.db import migrations
+
+KEY_LENGTH = 64
+MIN_QUERY_LENGTH = 2
+PREFIX = 0
+INNER = 1
+
+
+def normalize(value):
+    return unicodedata.normalize('NFKC', value or '').casefold().strip()
+
+
+def backfill_search_keys(apps, schema_editor):
+    """Index existing users the same way accounts.search.search_keys does"""
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    UserSearchKey = apps.get_model('accounts', 'UserSearchKey')
+
+    rows = []
+    for user_id, username, email in CustomUser.objects.values_list('id', 'username', 'email').iterator():
+        keys = {}
+        for field in (normalize(username), normalize(email)):
+            for start in range(len(field) - MIN_QUERY_LENGTH + 1):
+                key = field[start:start + KEY_LENGTH]
+                kind = PREFIX if start == 0 else INNER
+                keys[key] = min(kind, keys.get(key, kind))
+        rows.extend(UserSearchKey(user_id=user_id, key=key, kind=kind) for key, kind in keys.items())
+        if len(rows) >= 1000:
+            UserSearchKey.objects.bulk_create(rows)
+            rows = []
+    UserSearchKey.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_usersearchkey'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+    ]
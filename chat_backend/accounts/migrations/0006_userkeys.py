@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_backfill_user_search_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserKeys',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='keys', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('public_key_pem', models.TextField(blank=True, null=True)),
+                ('private_key_encrypted', models.TextField(blank=True, null=True)),
+                ('symmetric_key', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:09
+
+from django.db import migrations
+
+KEY_FIELDS = ('public_key_pem', 'private_key_encrypted', 'symmetric_key')
+
+
+def move_keys(apps, schema_editor):
+    """Copy key material from the user rows into UserKeys"""
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    UserKeys = apps.get_model('accounts', 'UserKeys')
+
+    rows = []
+    for user_id, *keys in CustomUser.objects.values_list('id', *KEY_FIELDS).iterator(chunk_size=1000):
+        rows.append(UserKeys(user_id=user_id, **dict(zip(KEY_FIELDS, keys))))
+        if len(rows) >= 1000:
+            UserKeys.objects.bulk_create(rows)
+            rows = []
+    UserKeys.objects.bulk_create(rows)
+
+
+def restore_keys(apps, schema_editor):
+    """Copy key material back onto the user rows and empty UserKeys"""
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    UserKeys = apps.get_model('accounts', 'UserKeys')
+
+    users = []
+    for user_id, *keys in UserKeys.objects.values_list('user_id', *KEY_FIELDS).iterator(chunk_size=1000):
+        users.append(CustomUser(id=user_id, **dict(zip(KEY_FIELDS, keys))))
+        if len(users) >= 1000:
+            CustomUser.objects.bulk_update(users, KEY_FIELDS)
+            users = []
+    CustomUser.objects.bulk_update(users, KEY_FIELDS)
+    UserKeys.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_userkeys'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_keys, restore_keys),
+    ]
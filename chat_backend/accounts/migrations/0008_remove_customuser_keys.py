@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:09
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_move_user_keys'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customuser',
+            name='private_key_encrypted',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='public_key_pem',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='symmetric_key',
+        ),
+    ]
@@ -5,120 +5,120 @@ from cryptography.fernet import Fernet
 import base64
 import logging
 
+from .keypool import generate_key_pair, get_key_pool
+
 logger = logging.getLogger(__name__)
 
 def generate_demo_rsa_keys():
     """Generate demo RSA key pair for educational display"""
     try:
-        from cryptography.hazmat.primitives.asymmetric import rsa
-        from cryptography.hazmat.primitives import serialization
-        
-        # Generate RSA key pair for educational display
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048
-        )
-        
-        # Get public key
-        public_key = private_key.public_key()
-        
-        # Serialize public key for display
-        public_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        ).decode('utf-8')
-        
-        # Serialize private key 
-        private_pem = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption()
-        ).decode('utf-8')
-        
-        return public_pem, private_pem
-        
-    except ImportError as e:
-        logger.error(f"Cryptography library not available: {e}")
-        return None, None
+        return generate_key_pair()
     except Exception as e:
         logger.error(f"Error generating RSA keys: {e}")
         return None, None
 
-class CustomUser(AbstractUser):
-    email = models.EmailField(unique=True)
-    public_key_pem = models.TextField(blank=True, null=True)  # Store PEM format for display
-    private_key_encrypted = models.TextField(blank=True, null=True)  # Store encrypted private key
-    symmetric_key = models.TextField(blank=True, null=True)  # For message encryption
-    created_at = models.DateTimeField(auto_now_add=True)
-    is_online = models.BooleanField(default=False)
+def take_rsa_keys():
+    """A pre-generated key pair from the pool, or one generated inline when it is empty"""
+    pair = get_key_pool().take()
+    if pair is None:
+        logger.info("RSA key pool empty, generating keys inline")
+        return generate_demo_rsa_keys()
+    return pair
+
+def new_key_material(username):
+    """Fresh symmetric and RSA keys for a user, as stored on UserKeys"""
+    try:
+        symmetric_key = base64.urlsafe_b64encode(Fernet.generate_key()).decode()
+        logger.info(f"Generated symmetric key for user {username}")
+    except Exception as e:
+        logger.error(f"Error generating symmetric key: {e}")
+        # Create a basic key if Fernet fails
+        import secrets
+        basic_key = secrets.token_urlsafe(32)
+        symmetric_key = base64.urlsafe_b64encode(basic_key.encode()).decode()
     
-    USERNAME_FIELD = 'email'
-    REQUIRED_FIELDS = ['username']
+    # Unique RSA keys for each user, pre-generated when the pool has some
+    public_pem, private_pem = take_rsa_keys()
     
-    def save(self, *args, **kwargs):
-        # Only generate keys for new users or users with missing keys
-        is_new_user = not self.pk
-        needs_keys = not self.public_key_pem or not self.private_key_encrypted or not self.symmetric_key
+    if public_pem and private_pem:
+        private_key_encrypted = base64.urlsafe_b64encode(private_pem.encode()).decode()
+        logger.info(f"Generated unique RSA keys for user {username}")
+    else:
+        # Fallback to unique demo keys with user-specific data
+        import time
+        import random
+        unique_id = f"{username}_{int(time.time())}_{random.randint(1000, 9999)}"
         
-        if is_new_user or needs_keys:
-            # Always generate new unique keys for each user
-            try:
-                symmetric_key = Fernet.generate_key()
-                self.symmetric_key = base64.urlsafe_b64encode(symmetric_key).decode()
-                logger.info(f"Generated symmetric key for user {self.username}")
-            except Exception as e:
-                logger.error(f"Error generating symmetric key: {e}")
-                # Create a basic key if Fernet fails
-                import secrets
-                basic_key = secrets.token_urlsafe(32)
-                self.symmetric_key = base64.urlsafe_b64encode(basic_key.encode()).decode()
-            
-            # Generate unique RSA keys for each user
-            public_pem, private_pem = generate_demo_rsa_keys()
-            
-            if public_pem and private_pem:
-                self.public_key_pem = public_pem
-                self.private_key_encrypted = base64.urlsafe_b64encode(private_pem.encode()).decode()
-                logger.info(f"Generated unique RSA keys for user {self.username}")
-            else:
-                # Fallback to unique demo keys with user-specific data
-                import time
-                import random
-                unique_id = f"{self.username}_{int(time.time())}_{random.randint(1000, 9999)}"
-                
-                self.public_key_pem = f"""-----BEGIN PUBLIC KEY-----
+        public_pem = f"""-----BEGIN PUBLIC KEY-----
 MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA{unique_id[:64].ljust(64, 'A')}
 {unique_id[64:128].ljust(64, 'B')}GHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz
 1234567890ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuv
 wxyz1234567890ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnop
 qrstuvwxyz1234567890ABCDEFGHIJKLMNOPQRSTUVWXYZ{unique_id[-16:]}
 -----END PUBLIC KEY-----"""
-                self.private_key_encrypted = base64.urlsafe_b64encode(f"demo_private_key_{unique_id}".encode()).decode()
-                logger.info(f"Generated fallback unique keys for user {self.username}")
-            
-        super().save(*args, **kwargs)
+        private_key_encrypted = base64.urlsafe_b64encode(f"demo_private_key_{unique_id}".encode()).decode()
+        logger.info(f"Generated fallback unique keys for user {username}")
+    
+    return {
+        'public_key_pem': public_pem,
+        'private_key_encrypted': private_key_encrypted,
+        'symmetric_key': symmetric_key,
+    }
+
+class CustomUser(AbstractUser):
+    email = models.EmailField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    is_online = models.BooleanField(default=False)
+    last_seen = models.DateTimeField(blank=True, null=True)  # Written by the presence flush
+    
+    USERNAME_FIELD = 'email'
+    REQUIRED_FIELDS = ['username']
+    
+    def get_keys(self):
+        """Key material row (loaded on first access), or None if the user has none yet"""
+        try:
+            return self.keys
+        except UserKeys.DoesNotExist:
+            return None
+    
+    def issue_keys(self):
+        """Generate and store new key material, replacing any existing keys"""
+        keys, _ = UserKeys.objects.update_or_create(user=self, defaults=new_key_material(self.username))
+        self.keys = keys
+        return keys
     
     def get_display_public_key(self):
         """Return public key for display in frontend"""
-        return self.public_key_pem or "No public key available"
+        keys = self.get_keys()
+        return (keys and keys.public_key_pem) or "No public key available"
     
     def get_symmetric_key(self):
         """Return symmetric key for message encryption"""
         try:
-            if self.symmetric_key:
-                return base64.urlsafe_b64decode(self.symmetric_key.encode())
+            keys = self.get_keys()
+            if keys and keys.symmetric_key:
+                return base64.urlsafe_b64decode(keys.symmetric_key.encode())
             else:
-                # Generate a new key if none exists
-                new_key = Fernet.generate_key()
-                self.symmetric_key = base64.urlsafe_b64encode(new_key).decode()
-                self.save(update_fields=['symmetric_key'])
-                return new_key
+                # Generate new keys if none exist
+                keys = self.issue_keys()
+                return base64.urlsafe_b64decode(keys.symmetric_key.encode())
         except Exception as e:
             logger.error(f"Error getting symmetric key: {e}")
             # Fallback: return a basic key
             import secrets
             return secrets.token_bytes(32)
 
+class UserKeys(models.Model):
+    """A user's key material, kept off the user row so auth and presence loads stay small"""
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='keys')
+    public_key_pem = models.TextField(blank=True, null=True)  # Store PEM format for display
+    private_key_encrypted = models.TextField(blank=True, null=True)  # Store encrypted private key
+    symmetric_key = models.TextField(blank=True, null=True)  # For message encryption
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Keys for {self.user_id}"
+
 class Friendship(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='friendships')
     friend = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='friend_of')
@@ -128,4 +128,29 @@ class Friendship(models.Model):
         unique_together = ('user', 'friend')
         
     def __str__(self):
-        return f"{self.user.username} -> {self.friend.username}"
\ No newline at end of file
+        return f"{self.user.username} -> {self.friend.username}"
+
+
+class UserSearchKey(models.Model):
+    """
+    One normalized suffix of a user's username or email.
+
+    Substring search becomes an index range scan over these keys; PREFIX
+    rows start at the beginning of the field.
+    """
+    PREFIX = 0
+    INNER = 1
+    KIND_CHOICES = [(PREFIX, 'Prefix'), (INNER, 'Inner suffix')]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='search_keys')
+    key = models.CharField(max_length=64)
+    # An integer rather than a boolean so every backend can use it in the index
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'key'], name='accounts_search_key_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} -> {self.user_id}"
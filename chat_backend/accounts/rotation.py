@@ -0,0 +1,136 @@
+# accounts/rotation.py - Bulk key rotation across a process pool
+import json
+import os
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chat.versions import PROFILE, bump
+
+from .keypool import generate_user_keys, key_process_pool
+from .models import CustomUser, UserKeys
+
+KEY_FIELDS = ['public_key_pem', 'private_key_encrypted', 'symmetric_key', 'updated_at']
+
+
+def load_checkpoint(path):
+    """Progress saved by an interrupted run, or a fresh state"""
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'last_id': 0, 'rotated': 0}
+
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically so a crash never leaves it half-written"""
+    if not path:
+        return
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
+def user_id_chunks(after_id, chunk_size):
+    """User ids above after_id in ascending chunks, one keyset query per chunk"""
+    while True:
+        ids = list(
+            CustomUser.objects.filter(id__gt=after_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def upsert_keys(keys, batch_size):
+    """
+    Insert or replace UserKeys rows in as few statements as the backend allows.
+
+    MySQL upserts with ON DUPLICATE KEY UPDATE and rejects a conflict
+    target, so unique_fields is only passed where it is supported. Backends
+    without upserts update the existing rows and insert the missing ones.
+    """
+    now = timezone.now()
+    for key in keys:
+        key.updated_at = now  # bulk_update doesn't apply auto_now
+    features = connection.features
+    if features.supports_update_conflicts_with_target:
+        UserKeys.objects.bulk_create(
+            keys, batch_size=batch_size,
+            update_conflicts=True, unique_fields=['user'], update_fields=KEY_FIELDS,
+        )
+    elif features.supports_update_conflicts:
+        # The user is UserKeys' primary key and only unique column, so it is the conflict
+        UserKeys.objects.bulk_create(keys, batch_size=batch_size, update_conflicts=True, update_fields=KEY_FIELDS)
+    else:
+        existing = set(
+            UserKeys.objects.filter(user_id__in=[key.user_id for key in keys]).values_list('user_id', flat=True)
+        )
+        UserKeys.objects.bulk_update([key for key in keys if key.user_id in existing], KEY_FIELDS, batch_size=batch_size)
+        UserKeys.objects.bulk_create([key for key in keys if key.user_id not in existing], batch_size=batch_size)
+
+
+def generation_chunksize(count, workers):
+    # A few tasks per worker keeps IPC overhead low without idling workers on the tail
+    return max(1, count // (workers * 4))
+
+
+def rotate_all_keys(chunk_size=500, workers=None, checkpoint=None, progress=None):
+    """
+    Give every user new RSA and symmetric keys.
+
+    Users are read in id order and keys for each chunk are generated
+    across a process pool, then upserted into UserKeys (users without a
+    keys row get one; see upsert_keys). After each committed chunk the
+    checkpoint (if given) records the last id, so a rerun continues from
+    there. progress(state, total, elapsed) is called after every chunk.
+    Returns the final state.
+    """
+    workers = workers or os.cpu_count() or 1
+    state = load_checkpoint(checkpoint)
+    total = state['rotated'] + CustomUser.objects.filter(id__gt=state['last_id']).count()
+    started = time.monotonic()
+
+    with key_process_pool(workers) as executor:
+        for ids in user_id_chunks(state['last_id'], chunk_size):
+            keys = [
+                UserKeys(user_id=user_id, public_key_pem=public_pem,
+                         private_key_encrypted=private_key, symmetric_key=symmetric_key)
+                for user_id, public_pem, private_key, symmetric_key in executor.map(
+                    generate_user_keys, ids, chunksize=generation_chunksize(len(ids), workers)
+                )
+            ]
+            with transaction.atomic():
+                upsert_keys(keys, chunk_size)
+                # bulk_create skips post_save, so invalidate cached profiles here
+                transaction.on_commit(lambda ids=ids: bump(PROFILE, ids))
+
+            state = {'last_id': ids[-1], 'rotated': state['rotated'] + len(ids)}
+            save_checkpoint(checkpoint, state)
+            if progress:
+                progress(state, total, time.monotonic() - started)
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return state
+
+
+def estimate_throughput(sample_size, workers=None):
+    """
+    Generate sample_size key sets without writing anything.
+
+    Returns (keys per second, workers). Rotation is bound by key
+    generation, so this rate predicts a full run closely.
+    """
+    workers = workers or os.cpu_count() or 1
+    with key_process_pool(workers) as executor:
+        # Warm the workers up so process start-up isn't counted
+        list(executor.map(generate_user_keys, range(workers)))
+        started = time.monotonic()
+        list(executor.map(
+            generate_user_keys, range(sample_size), chunksize=generation_chunksize(sample_size, workers)
+        ))
+        elapsed = time.monotonic() - started
+    return sample_size / elapsed if elapsed else 0.0, workers
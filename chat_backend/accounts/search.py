@@ -0,0 +1,134 @@
+# accounts/search.py - Indexed user search (exact > prefix > substring)
+import unicodedata
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import UserSearchKey
+
+User = get_user_model()
+
+KEY_LENGTH = UserSearchKey._meta.get_field('key').max_length
+
+EXACT = 0
+PREFIX = 1
+SUBSTRING = 2
+
+
+def normalize(value):
+    return unicodedata.normalize('NFKC', value or '').casefold().strip()
+
+
+def min_query_length():
+    return getattr(settings, 'USER_SEARCH_MIN_LENGTH', 2)
+
+
+def search_keys(user):
+    """Index rows for a user: every suffix of username and email long enough to be searched"""
+    shortest = min_query_length()
+    keys = {}
+    for field in (normalize(user.username), normalize(user.email)):
+        for start in range(len(field) - shortest + 1):
+            key = field[start:start + KEY_LENGTH]
+            kind = UserSearchKey.PREFIX if start == 0 else UserSearchKey.INNER
+            keys[key] = min(kind, keys.get(key, kind))
+    return [UserSearchKey(user_id=user.pk, key=key, kind=kind) for key, kind in keys.items()]
+
+
+def index_user(user):
+    """Replace a user's index rows after their username or email changed"""
+    with transaction.atomic():
+        UserSearchKey.objects.filter(user_id=user.pk).delete()
+        UserSearchKey.objects.bulk_create(search_keys(user))
+
+
+def rebuild_index(users=None, batch_size=1000):
+    """Index every user (or the given queryset) from scratch"""
+    if users is None:
+        users = User.objects.all()
+        UserSearchKey.objects.all().delete()
+    else:
+        UserSearchKey.objects.filter(user__in=users).delete()
+
+    count = 0
+    rows = []
+    for user in users.only('id', 'username', 'email').iterator(chunk_size=batch_size):
+        rows.extend(search_keys(user))
+        count += 1
+        if len(rows) >= batch_size:
+            UserSearchKey.objects.bulk_create(rows, batch_size=batch_size)
+            rows = []
+    UserSearchKey.objects.bulk_create(rows, batch_size=batch_size)
+    return count
+
+
+def _key_range(key):
+    """Bounds that select every key starting with `key` as an index range scan"""
+    return key, key[:-1] + chr(ord(key[-1]) + 1)
+
+
+def ranked_user_ids(query, limit):
+    """
+    Up to `limit` (rank, user_id) pairs for a normalized query, best first.
+
+    Prefix rows are read before substring rows, each as a LIMITed range
+    scan ordered by key, so exact matches (the shortest keys in range)
+    come out first. Popular queries are cached for USER_SEARCH_CACHE_TTL.
+    """
+    cache_key = f'usersearch:{query}:{limit}'
+    ranked = cache.get(cache_key)
+    if ranked is not None:
+        return ranked
+
+    key = query[:KEY_LENGTH]
+    low, high = _key_range(key)
+    ranked = []
+    seen = set()
+    for kind in (UserSearchKey.PREFIX, UserSearchKey.INNER):
+        rows = UserSearchKey.objects.filter(
+            kind=kind, key__gte=low, key__lt=high
+        ).order_by('key').values_list('user_id', 'key')[:limit * 4]
+        for user_id, matched in rows:
+            if user_id in seen:
+                continue
+            seen.add(user_id)
+            if kind == UserSearchKey.INNER:
+                rank = SUBSTRING
+            elif matched == query:
+                rank = EXACT
+            else:
+                rank = PREFIX
+            ranked.append((rank, user_id))
+        if len(ranked) >= limit:
+            break
+
+    ranked.sort(key=lambda item: item[0])
+    ranked = ranked[:limit]
+    cache.set(cache_key, ranked, getattr(settings, 'USER_SEARCH_CACHE_TTL', 30))
+    return ranked
+
+
+def search_users(query, exclude_user_id=None, limit=None):
+    """Users whose username or email contains the query, ranked exact > prefix > substring"""
+    query = normalize(query)
+    if len(query) < min_query_length():
+        return []
+    if limit is None:
+        limit = getattr(settings, 'USER_SEARCH_RESULTS', 10)
+
+    # One extra in case the requesting user is among the matches
+    ranked = ranked_user_ids(query, limit + 1)
+    users = User.objects.in_bulk([user_id for _, user_id in ranked])
+
+    results = []
+    for _, user_id in ranked:
+        user = users.get(user_id)
+        if user is None or user_id == exclude_user_id:
+            continue
+        # The index can lag a rename, and keys are truncated; confirm the match
+        if query not in normalize(user.username) and query not in normalize(user.email):
+            continue
+        results.append(user)
+    return results[:limit]
@@ -43,12 +43,19 @@ class UserLoginSerializer(serializers.Serializer):
         return attrs
 
 class UserSerializer(serializers.ModelSerializer):
-    public_key = serializers.SerializerMethodField()
+    """Hot user fields embedded in rooms, messages, friends and search results"""
     
     class Meta:
         model = CustomUser
-        fields = ('id', 'username', 'email', 'is_online', 'created_at', 'public_key')
-        read_only_fields = ('id', 'created_at')
+        fields = ('id', 'username', 'email', 'is_online', 'last_seen', 'created_at')
+        read_only_fields = ('id', 'last_seen', 'created_at')
+
+class ProfileSerializer(UserSerializer):
+    """A user's own account, with the public key (loads the UserKeys row)"""
+    public_key = serializers.SerializerMethodField()
+    
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ('public_key',)
     
     def get_public_key(self, obj):
         """Return public key for educational display"""
@@ -0,0 +1,23 @@
+# accounts/signals.py - Keep the user search index and key material in sync
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import CustomUser
+from .search import index_user
+
+SEARCHABLE_FIELDS = {'username', 'email'}
+
+
+@receiver(post_save, sender=CustomUser)
+def issue_user_keys(sender, instance, created, raw=False, **kwargs):
+    """New users get key material once; later saves never look at keys"""
+    if created and not raw:
+        instance.issue_keys()
+
+
+@receiver(post_save, sender=CustomUser)
+def reindex_user(sender, instance, created, update_fields=None, **kwargs):
+    """Rebuild a user's search keys unless the save provably left username/email alone"""
+    if update_fields is not None and not SEARCHABLE_FIELDS.intersection(update_fields):
+        return
+    index_user(instance)
@@ -1,3 +1,230 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .keypool import KeyPairPool
+from .models import CustomUser, UserKeys, UserSearchKey
+from .rotation import rotate_all_keys, save_checkpoint, upsert_keys
+from .search import search_users
+
+
+class UserSearchTests(TestCase):
+    """Indexed search keeps icontains semantics and ranks exact > prefix > substring"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.exact = CustomUser.objects.create_user(email='sam@example.com', username='sam', password='pw')
+        cls.prefix = CustomUser.objects.create_user(email='sammy@example.com', username='sammy', password='pw')
+        cls.substring = CustomUser.objects.create_user(email='osama@example.com', username='osama', password='pw')
+        cls.other = CustomUser.objects.create_user(email='alex@example.com', username='alex', password='pw')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ranking(self):
+        self.assertEqual(search_users('Sam'), [self.exact, self.prefix, self.substring])
+
+    def test_matches_email_and_excludes_requester(self):
+        self.assertEqual(search_users('alex@exa', exclude_user_id=self.exact.id), [self.other])
+        self.assertNotIn(self.exact, search_users('sam', exclude_user_id=self.exact.id))
+
+    def test_short_queries_return_nothing(self):
+        self.assertEqual(search_users('s'), [])
+
+    def test_rename_reindexes(self):
+        self.other.username = 'zed'
+        self.other.save()
+        self.assertEqual(search_users('zed'), [self.other])
+        self.assertFalse(UserSearchKey.objects.filter(user=self.other, key='alex').exists())
+        self.assertEqual(search_users('ale'), [self.other])  # still found through the email
+
+
+class KeyPairPoolTests(TestCase):
+    """The key pool refills in the background and hands each pair out once"""
+
+    def test_refills_to_high_watermark(self):
+        pool = KeyPairPool(low=1, high=3, workers=1)
+        self.addCleanup(pool.shutdown)
+        self.assertIsNone(pool.take())
+
+        deadline = time.monotonic() + 60
+        while pool.stats()['ready'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        pairs = [pool.take() for _ in range(3)]
+
+        self.assertEqual(len({public for public, _ in pairs}), 3)
+        self.assertTrue(pairs[0][0].startswith('-----BEGIN PUBLIC KEY-----'))
+        stats = pool.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['generated']), (3, 1, 3))
+
+
+class UserKeysTests(TestCase):
+    """Key material lives in UserKeys and is only loaded where it is shown"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='keys@example.com', username='keys', password='pw')
+        cls.other = CustomUser.objects.create_user(email='peer@example.com', username='peer', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_new_users_get_keys_and_later_saves_skip_them(self):
+        keys = UserKeys.objects.get(user=self.user)
+        self.assertTrue(keys.public_key_pem.startswith('-----BEGIN PUBLIC KEY-----'))
+        self.assertTrue(keys.private_key_encrypted and keys.symmetric_key)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.user.is_online = True
+            self.user.save(update_fields=['is_online'])
+        self.assertFalse([q for q in queries if 'accounts_userkeys' in q['sql']])
+
+    def test_public_key_only_on_profile_and_key_endpoint(self):
+        profile = self.client.get('/api/auth/profile/').json()
+        self.assertEqual(profile['public_key'], self.user.keys.public_key_pem)
+
+        results = self.client.get('/api/auth/search/', {'q': 'peer'}).json()['results']
+        self.assertEqual([r['id'] for r in results], [self.other.id])
+        self.assertNotIn('public_key', results[0])
+
+        response = self.client.get(f'/api/auth/users/{self.other.id}/public-key/')
+        self.assertEqual(response.json()['public_key'], self.other.keys.public_key_pem)
+
+    @override_settings(CHAT_ETAGS_WITH_LOCAL_CACHE=True)
+    def test_public_key_etag_only_for_existing_users(self):
+        response = self.client.get(f'/api/auth/users/{self.other.id}/public-key/')
+        etag = response['ETag']
+        self.assertEqual(
+            self.client.get(f'/api/auth/users/{self.other.id}/public-key/', HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+
+        missing = self.other.id + 1000
+        response = self.client.get(f'/api/auth/users/{missing}/public-key/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+        self.assertIsNone(cache.get(f'version:profile:{missing}'))
+
+
+def fake_user_keys(user_id):
+    """Stands in for RSA generation so rotation tests stay fast"""
+    return user_id, f'public-{user_id}', f'private-{user_id}', f'symmetric-{user_id}'
+
+
+@mock.patch('accounts.rotation.key_process_pool', lambda workers: ThreadPoolExecutor(workers))
+@mock.patch('accounts.rotation.generate_user_keys', fake_user_keys)
+class KeyRotationTests(TestCase):
+    """Rotation walks users in id-ordered chunks and resumes from its checkpoint"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create_user(email=f'rotate{i}@example.com', username=f'rotate{i}', password='pw')
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'rotation.json')
+
+    def public_keys(self):
+        return dict(UserKeys.objects.values_list('user_id', 'public_key_pem'))
+
+    def test_rotates_every_user_in_chunks(self):
+        seen = []
+        state = rotate_all_keys(
+            chunk_size=2, workers=2, checkpoint=self.checkpoint,
+            progress=lambda state, total, elapsed: seen.append((state['last_id'], state['rotated'], total)),
+        )
+        ids = [user.id for user in self.users]
+        self.assertEqual(seen, [(ids[1], 2, 5), (ids[3], 4, 5), (ids[4], 5, 5)])
+        self.assertEqual(state, {'last_id': ids[4], 'rotated': 5})
+        self.assertEqual(self.public_keys(), {user_id: f'public-{user_id}' for user_id in ids})
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resumes_after_checkpoint(self):
+        save_checkpoint(self.checkpoint, {'last_id': self.users[2].id, 'rotated': 3})
+        before = self.public_keys()
+        state = rotate_all_keys(chunk_size=2, workers=1, checkpoint=self.checkpoint)
+
+        self.assertEqual(state['rotated'], 5)
+        after = self.public_keys()
+        for user in self.users[:3]:
+            self.assertEqual(after[user.id], before[user.id])
+        for user in self.users[3:]:
+            self.assertEqual(after[user.id], f'public-{user.id}')
+
+    def test_failed_chunk_keeps_checkpoint_and_earlier_chunks(self):
+        failing_id = self.users[3].id
+        before = self.public_keys()
+
+        def flaky_user_keys(user_id):
+            if user_id == failing_id:
+                raise RuntimeError('generation failed')
+            return fake_user_keys(user_id)
+
+        with mock.patch('accounts.rotation.generate_user_keys', flaky_user_keys):
+            with self.assertRaises(RuntimeError):
+                rotate_all_keys(chunk_size=2, workers=1, checkpoint=self.checkpoint)
+
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {'last_id': self.users[1].id, 'rotated': 2})
+        after = self.public_keys()
+        self.assertEqual(after[self.users[0].id], f'public-{self.users[0].id}')
+        self.assertEqual(after[self.users[2].id], before[self.users[2].id])  # failed chunk wrote nothing
+
+        state = rotate_all_keys(chunk_size=2, workers=1, checkpoint=self.checkpoint)
+        self.assertEqual(state['rotated'], 5)
+        self.assertEqual(self.public_keys()[failing_id], f'public-{failing_id}')
+
+    def rotate_command(self, *args):
+        out = StringIO()
+        call_command('reset_user_keys', '--all', '--workers', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_command_resumes_over_several_chunks(self):
+        save_checkpoint(self.checkpoint, {'last_id': self.users[0].id, 'rotated': 1})
+        output = self.rotate_command('--chunk-size', '2', '--checkpoint', self.checkpoint)
+
+        self.assertIn(f'Resuming after user id {self.users[0].id}', output)
+        self.assertIn(f'3/5 users, last id {self.users[2].id}', output)
+        self.assertIn(f'5/5 users, last id {self.users[4].id}', output)
+        self.assertIn('Rotated keys for 5 users', output)
+        keys = self.public_keys()
+        self.assertNotEqual(keys[self.users[0].id], f'public-{self.users[0].id}')
+        self.assertEqual(keys[self.users[4].id], f'public-{self.users[4].id}')
+
+    def test_dry_run_writes_nothing(self):
+        before = self.public_keys()
+        output = self.rotate_command('--dry-run', '--sample', '4')
+        self.assertIn('Generated 4 key sets on 1 workers', output)
+        self.assertIn('Estimated time for 5 users', output)
+        self.assertEqual(self.public_keys(), before)
+
+    def test_upsert_without_backend_upserts(self):
+        # Backends without ON CONFLICT / ON DUPLICATE KEY take the update-then-insert path
+        self.users[4].keys.delete()
+        keys = [
+            UserKeys(user_id=user_id, public_key_pem=public, private_key_encrypted=private, symmetric_key=symmetric)
+            for user_id, public, private, symmetric in map(fake_user_keys, (self.users[3].id, self.users[4].id))
+        ]
+        with mock.patch.multiple(
+            connection.features, supports_update_conflicts=False, supports_update_conflicts_with_target=False,
+        ):
+            upsert_keys(keys, batch_size=10)
+        keys = self.public_keys()
+        self.assertEqual(keys[self.users[3].id], f'public-{self.users[3].id}')
+        self.assertEqual(keys[self.users[4].id], f'public-{self.users[4].id}')
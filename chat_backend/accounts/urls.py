@@ -6,6 +6,7 @@ urlpatterns = [
     path('login/', views.login, name='login'),
     path('logout/', views.logout, name='logout'),
     path('profile/', views.profile, name='profile'),
+    path('users/<int:user_id>/public-key/', views.public_key, name='public_key'),
     path('search/', views.search_users, name='search_users'),
     path('add-friend/', views.add_friend, name='add_friend'),
     path('friends/', views.friends_list, name='friends_list'),
@@ -1,13 +1,18 @@
 from rest_framework import status, generics, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from chat.presence import get_presence_service
+from chat.revocation import revoke_token
+from chat.versions import FRIENDS, PROFILE, conditional_get, get_versions, make_etag, user_etag
+from . import search as user_search
 from .models import Friendship
 from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, 
-    UserSerializer, FriendshipSerializer
+    UserSerializer, ProfileSerializer, FriendshipSerializer
 )
 
 User = get_user_model()
@@ -20,7 +25,7 @@ def register(request):
         user = serializer.save()
         refresh = RefreshToken.for_user(user)
         return Response({
-            'user': UserSerializer(user).data,
+            'user': ProfileSerializer(user).data,
             'access': str(refresh.access_token),
             'refresh': str(refresh),
         }, status=status.HTTP_201_CREATED)
@@ -32,12 +37,12 @@ def login(request):
     serializer = UserLoginSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.validated_data['user']
-        user.is_online = True
-        user.save()
+        # Presence writes go through the presence service (batched while sockets are open)
+        get_presence_service().note_login(user)
         
         refresh = RefreshToken.for_user(user)
         return Response({
-            'user': UserSerializer(user).data,
+            'user': ProfileSerializer(user).data,
             'access': str(refresh.access_token),
             'refresh': str(refresh),
         })
@@ -45,23 +50,46 @@ def login(request):
 
 @api_view(['POST'])
 def logout(request):
-    request.user.is_online = False
-    request.user.save()
+    get_presence_service().note_logout(request.user)
+    
+    # Revoke the access token used for this request and, if sent, its refresh token
+    if request.auth is not None:
+        revoke_token(request.auth, request.user)
+    refresh = request.data.get('refresh')
+    if refresh:
+        try:
+            refresh = RefreshToken(refresh)
+            if str(refresh[api_settings.USER_ID_CLAIM]) == str(request.user.id):
+                revoke_token(refresh, request.user)
+        except TokenError:
+            pass
     return Response({'message': 'Successfully logged out'})
 
 @api_view(['GET'])
+@conditional_get(user_etag(PROFILE))
 def profile(request):
-    return Response(UserSerializer(request.user).data)
+    return Response(ProfileSerializer(request.user).data)
+
+def public_key_etag(request, user_id):
+    # Unknown ids fall through to the 404 without creating a counter
+    if not User.objects.filter(id=user_id).exists():
+        return None
+    return make_etag(PROFILE, user_id, get_versions(PROFILE, [user_id])[user_id])
+
+@api_view(['GET'])
+@conditional_get(public_key_etag)
+def public_key(request, user_id):
+    """Another user's public key, for clients that display or verify it"""
+    try:
+        user = User.objects.select_related('keys').get(id=user_id)
+    except User.DoesNotExist:
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'user_id': user.id, 'public_key': user.get_display_public_key()})
 
 @api_view(['GET'])
 def search_users(request):
     query = request.GET.get('q', '')
-    if len(query) < 2:
-        return Response({'results': []})
-    
-    users = User.objects.filter(
-        Q(username__icontains=query) | Q(email__icontains=query)
-    ).exclude(id=request.user.id)[:10]
+    users = user_search.search_users(query, exclude_user_id=request.user.id)
     
     return Response({
         'results': UserSerializer(users, many=True).data
@@ -92,6 +120,7 @@ def add_friend(request):
                       status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
+@conditional_get(user_etag(FRIENDS))
 def friends_list(request):
     friendships = Friendship.objects.filter(user=request.user)
     return Response(FriendshipSerializer(friendships, many=True).data)
\ No newline at end of file
@@ -1,6 +1,6 @@
 # chat/admin.py - Admin for Client-Side Encryption
 from django.contrib import admin
-from .models import ChatRoom, Message
+from .models import ChatRoom, InboxSummary, Message, RoomReadState
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
@@ -52,4 +52,15 @@ class MessageAdmin(admin.ModelAdmin):
             'fields': ('encrypted_content', 'get_content_preview', 'get_encryption_info'),
             'description': 'Content is encrypted client-side using AES-256-GCM'
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(RoomReadState)
+class RoomReadStateAdmin(admin.ModelAdmin):
+    list_display = ['room', 'user', 'last_read_message_id', 'updated_at']
+    search_fields = ['user__username', 'user__email']
+    readonly_fields = ['updated_at']
+
+@admin.register(InboxSummary)
+class InboxSummaryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'room', 'last_message_id', 'last_activity_at', 'unread_count']
+    search_fields = ['user__username', 'user__email']
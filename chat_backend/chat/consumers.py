@@ -1,19 +1,37 @@
 # chat/consumers.py - WebSocket Consumer for Client-Side Encryption
+import asyncio
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message
+from .fanout import binary_protocol_enabled, wire_event
+from .membership import is_room_member
+from .models import Message
+from .outbound import DROPPABLE_EVENTS, BoundedSendMixin
+from .persistence import BATCHED, get_message_buffer, persist_messages, persistence_mode
+from .presence import get_presence_service
+from .protocol import BINARY_SUBPROTOCOL, ProtocolError, parse_client_frame
+from .read_state import get_read_coalescer
+from .recent import message_fields, recent_messages
+from .typing_indicators import get_typing_tracker
 import logging
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+def room_group_name(room_id):
+    """Channel layer group that carries events for a chat room"""
+    return f'chat_{room_id}'
+
+class ChatConsumer(BoundedSendMixin, AsyncWebsocketConsumer):
+    binary = False  # True when the client negotiated the binary protocol
+
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'chat_{self.room_id}'
         self.user = self.scope["user"]
+        self.replayed_ids = set()
 
         if self.user.is_anonymous:
             logger.warning(f"Anonymous user attempted to connect to room {self.room_id}")
@@ -21,50 +39,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
 
         # Check if user is participant in the room
-        is_participant = await self.check_room_participation()
+        is_participant = await self.check_room_participation(self.room_id)
         if not is_participant:
             logger.warning(f"User {self.user.username} attempted to access unauthorized room {self.room_id}")
             await self.close()
             return
 
+        self.room_id = int(self.room_id)
+        self.room_group_name = room_group_name(self.room_id)
+
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept(self.negotiate_subprotocol())
         logger.info(f"User {self.user.username} connected to room {self.room_id}")
 
-        # Set user as online
-        await self.set_user_online_status(True)
+        # Count the connection; the presence flush notifies the room if the user came online
+        await get_presence_service().connect(self.user, [self.room_id])
 
-        # Notify others that user came online
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_status_update',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_online': True
-            }
-        )
+        # Reconnecting clients pass ?since=<last message id> to catch up
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        since = self.parse_since(query.get('since', [None])[0])
+        if since is not None:
+            await self.replay_missed(self.room_id, since)
 
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
-            # Set user as offline
-            await self.set_user_online_status(False)
-
-            # Notify others that user went offline
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_status_update',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                    'is_online': False
-                }
-            )
+            # The presence flush notifies the room once the user's last connection closes
+            await get_presence_service().disconnect(self.user, [self.room_id])
+            await self.clear_typing(self.room_id)
 
             # Leave room group
             await self.channel_layer.group_discard(
@@ -74,24 +80,47 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             logger.info(f"User {self.user.username} disconnected from room {self.room_id}")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            text_data_json = json.loads(text_data)
-            message_type = text_data_json.get('type', 'chat_message')
-
-            if message_type == 'chat_message':
-                await self.handle_chat_message(text_data_json)
-            elif message_type == 'typing':
-                await self.handle_typing(text_data_json)
-            elif message_type == 'read_message':
-                await self.handle_read_message(text_data_json)
-
+            data = self.decode_frame(text_data, bytes_data)
+            if data.get('type') == 'ack':
+                self.handle_ack(data)
+                return
+            if bytes_data is not None and data['room_id'] != self.room_id:
+                logger.warning(f"Binary frame for room {data['room_id']} received on room {self.room_id}")
+                return
+            await self.dispatch_frame(data, self.room_id)
         except json.JSONDecodeError:
             logger.error("Invalid JSON received in WebSocket")
+        except ProtocolError as e:
+            logger.warning(f"Invalid binary frame from {self.user.username}: {e}")
         except Exception as e:
             logger.error(f"Error handling WebSocket message: {e}")
 
-    async def handle_chat_message(self, data):
+    def negotiate_subprotocol(self):
+        """Pick the binary protocol when the client offers it and it is enabled"""
+        self.binary = binary_protocol_enabled() and BINARY_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        return BINARY_SUBPROTOCOL if self.binary else None
+
+    def decode_frame(self, text_data, bytes_data):
+        if bytes_data is not None:
+            if not self.binary:
+                raise ProtocolError("Binary frame without the binary subprotocol")
+            return parse_client_frame(bytes_data)
+        return json.loads(text_data)
+
+    async def dispatch_frame(self, data, room_id):
+        """Route a client frame for a room the connection is joined to"""
+        message_type = data.get('type', 'chat_message')
+
+        if message_type == 'chat_message':
+            await self.handle_chat_message(data, room_id)
+        elif message_type == 'typing':
+            await self.handle_typing(data, room_id)
+        elif message_type == 'read_message':
+            await self.handle_read_message(data, room_id)
+
+    async def handle_chat_message(self, data, room_id):
         encrypted_content = data.get('content', '').strip()
         if not encrypted_content:
             logger.warning(f"Empty message received from {self.user.username}")
@@ -103,126 +132,297 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
 
         # Save ENCRYPTED message to database (no server-side decryption)
-        message = await self.save_encrypted_message(encrypted_content)
+        message = await self.store_encrypted_message(room_id, encrypted_content)
         if not message:
             logger.error(f"Failed to save encrypted message from {self.user.username}")
             return
 
-        logger.info(f"Encrypted message saved: Room {self.room_id}, User {self.user.username}, Length {len(encrypted_content)}")
+        logger.info(f"Encrypted message saved: Room {room_id}, User {self.user.username}, Length {len(encrypted_content)}")
 
         # Send ENCRYPTED content to all room participants via WebSocket
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message_id': message.id,
-                'content': encrypted_content,  # ← ENCRYPTED CONTENT in WebSocket packet!
-                'sender_id': self.user.id,
-                'sender_username': self.user.username,
-                'timestamp': message.timestamp.isoformat(),
-            }
+        event = wire_event('chat_message', **message_fields(message))
+        event['message_id'] = message.id  # lets reconnecting consumers skip replayed messages
+        await self.channel_layer.group_send(room_group_name(room_id), event)
+
+    async def handle_typing(self, data, room_id):
+        is_typing = bool(data.get('is_typing', False))
+        tracker = get_typing_tracker()
+        key = (self.user.id, room_id)
+
+        # Only start/stop transitions go out; keystroke repeats are dropped here
+        if is_typing:
+            should_send = tracker.start(key, self.channel_name, self.typing_idle_callback(room_id))
+        else:
+            should_send = tracker.stop(key, self.channel_name)
+
+        if should_send:
+            await self.broadcast_typing(room_id, is_typing, self.channel_name)
+
+    async def broadcast_typing(self, room_id, is_typing, sender_channel):
+        """
+        Send a typing event to the room group; the sending connection drops its copy.
+
+        Channel layers have no public "everyone but one" send, and a group's
+        members can't be listed on Redis, so the sender is excluded on
+        receipt: typing_indicator compares sender_channel before anything is
+        queued for the socket. The echo costs one channel-layer message to
+        the sender, never a WebSocket frame.
+        """
+        event = wire_event(
+            'typing_indicator',
+            room_id=room_id,
+            user_id=self.user.id,
+            username=self.user.username,
+            is_typing=is_typing,
         )
+        event['sender_channel'] = sender_channel
+        await self.channel_layer.group_send(room_group_name(room_id), event)
 
-    async def handle_typing(self, data):
-        is_typing = data.get('is_typing', False)
-        
-        # Send typing indicator to room group (except sender)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_typing': is_typing,
-                'sender_channel': self.channel_name,  # To exclude sender
-            }
-        )
+    def typing_idle_callback(self, room_id):
+        """Broadcast an automatic stop when the user goes quiet"""
+        def on_idle(sender_channel):
+            asyncio.ensure_future(self.broadcast_typing(room_id, False, sender_channel))
+        return on_idle
 
-    async def handle_read_message(self, data):
-        message_id = data.get('message_id')
-        if message_id:
-            await self.mark_message_as_read(message_id)
+    async def clear_typing(self, room_id):
+        if get_typing_tracker().clear((self.user.id, room_id), self.channel_name):
+            await self.broadcast_typing(room_id, False, self.channel_name)
+
+    async def handle_read_message(self, data, room_id):
+        # "Read up to message_id" - coalesced into one watermark update per flush
+        try:
+            message_id = int(data.get('message_id') or 0)
+        except (TypeError, ValueError):
+            return
+        if message_id > 0:
+            await get_read_coalescer().report(room_id, self.user.id, message_id)
+
+    def handle_ack(self, data):
+        # Delivery acks feed the slow-reader backlog (see BoundedSendMixin)
+        try:
+            message_id = int(data.get('message_id'))
+        except (TypeError, ValueError):
+            return
+        self.record_ack(message_id)
+
+    async def replay_missed(self, room_id, since):
+        """
+        Send the messages after `since` that the client missed, then a replay_complete frame.
+
+        The consumer has already joined the room group, and live events are
+        only dispatched once this handler returns, so anything committed
+        from here on arrives live. Messages that show up in both are sent
+        once: their ids are remembered and the live copy is skipped, until
+        a newer live message shows they can no longer arrive.
+        """
+        limit = getattr(settings, 'CHAT_REPLAY_MAX_MESSAGES', 100)
+        missed = recent_messages.since(room_id, since, limit + 1)
+        if missed is None:
+            missed = await self.load_missed_messages(room_id, since, limit + 1)
+
+        truncated = len(missed) > limit
+        missed = missed[:limit]
+        for fields in missed:
+            self.replayed_ids.add(fields['message_id'])
+            event = wire_event('chat_message', **fields)
+            event['message_id'] = fields['message_id']
+            await self.send_event(event)
 
-    # WebSocket message handlers
-    async def chat_message(self, event):
-        """Send encrypted message to WebSocket client"""
         await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message_id': event['message_id'],
-            'content': event['content'],  # ← This is encrypted content
-            'sender_id': event['sender_id'],
-            'sender_username': event['sender_username'],
-            'timestamp': event['timestamp'],
+            'type': 'replay_complete',
+            'room_id': room_id,
+            'last_message_id': missed[-1]['message_id'] if missed else since,
+            'truncated': truncated,  # older history must be fetched from room_messages
         }))
+        logger.info(f"Replayed {len(missed)} messages in room {room_id} to {self.user.username}")
+
+    @staticmethod
+    def parse_since(value):
+        try:
+            since = int(value)
+        except (TypeError, ValueError):
+            return None
+        return since if since >= 0 else None
+
+    # WebSocket message handlers - frames are pre-encoded by the publisher (see wire_event)
+    async def chat_message(self, event):
+        """Send encrypted message to WebSocket client"""
+        message_id = event.get('message_id')
+        if self.replayed_ids and message_id is not None:
+            duplicate = message_id in self.replayed_ids
+            # Replayed messages up to the newest live one won't arrive live any more
+            self.replayed_ids = {replayed for replayed in self.replayed_ids if replayed > message_id}
+            if duplicate:
+                return
+        await self.send_event(event)
 
     async def typing_indicator(self, event):
-        # Don't send typing indicator back to sender
-        if event.get('sender_channel') != self.channel_name:
-            await self.send(text_data=json.dumps({
-                'type': 'typing_indicator',
-                'user_id': event['user_id'],
-                'username': event['username'],
-                'is_typing': event['is_typing'],
-            }))
+        # Don't send typing indicator back to the connection that typed
+        if event['sender_channel'] != self.channel_name:
+            await self.send_event(event)
 
     async def user_status_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_status_update',
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'is_online': event['is_online'],
-        }))
+        await self.send_event(event)
+
+    async def read_receipt(self, event):
+        await self.send_event(event)
+
+    async def send_event(self, event):
+        """Queue a pre-encoded frame in the connection's protocol"""
+        droppable = event['type'] in DROPPABLE_EVENTS
+        message_id = event.get('message_id')  # chat frames count towards the unacked backlog
+        if self.binary and 'bytes' in event:
+            await self.enqueue_frame(bytes_data=event['bytes'], droppable=droppable, message_id=message_id)
+        else:
+            await self.enqueue_frame(text_data=event['text'], droppable=droppable, message_id=message_id)
 
     # Database operations
     @database_sync_to_async
-    def check_room_participation(self):
+    def check_room_participation(self, room_id):
         """Check if user is participant in the room"""
-        try:
-            room = ChatRoom.objects.get(id=self.room_id)
-            return room.participants.filter(id=self.user.id).exists()
-        except ChatRoom.DoesNotExist:
-            return False
+        return is_room_member(room_id, self.user.id)
+
+    @database_sync_to_async
+    def load_missed_messages(self, room_id, since, limit):
+        """Range scan for messages the recent-message buffer can't cover"""
+        messages = Message.objects.filter(
+            room_id=room_id, id__gt=since
+        ).select_related('sender').order_by('id')[:limit]
+        return [message_fields(message) for message in messages]
+
+    async def store_encrypted_message(self, room_id, encrypted_content):
+        """Persist a message using the configured commit mode"""
+        if persistence_mode() == BATCHED:
+            return await get_message_buffer().submit(room_id, self.user, encrypted_content)
+        return await self.save_encrypted_message(room_id, encrypted_content)
 
     @database_sync_to_async
-    def save_encrypted_message(self, encrypted_content):
+    def save_encrypted_message(self, room_id, encrypted_content):
         """Save client-encrypted message directly to database"""
         try:
-            room = ChatRoom.objects.get(id=self.room_id)
-            message = Message.objects.create(
-                room=room,
-                sender=self.user,
-                encrypted_content=encrypted_content  # Store encrypted content as-is
-            )
-            
-            # Update room timestamp for sorting
-            room.save()
+            # Store encrypted content as-is and bump the room timestamp for sorting
+            message, = persist_messages([(room_id, self.user, encrypted_content)])
             return message
         except Exception as e:
             logger.error(f"Error saving encrypted message: {e}")
             return None
 
-    @database_sync_to_async
-    def set_user_online_status(self, is_online):
-        """Update user online status"""
+
+class MultiplexChatConsumer(ChatConsumer):
+    """
+    Carries many rooms over one authenticated connection.
+
+    Clients send {"type": "subscribe", "room_id": N, "since": M} / {"type":
+    "unsubscribe", "room_id": N}, where the optional since replays messages
+    after id M as on ChatConsumer; chat, typing and read frames name their room_id and are
+    handled by the ChatConsumer handlers. Outgoing events carry room_id too.
+    Delivery acks ({"type": "ack", "message_id": M}) need no room_id.
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        self.subscriptions = set()
+        self.replayed_ids = set()
+
+        if self.user.is_anonymous:
+            logger.warning("Anonymous user attempted to open a multiplexed connection")
+            await self.close()
+            return
+
+        await self.accept(self.negotiate_subprotocol())
+        logger.info(f"User {self.user.username} opened a multiplexed connection")
+
+        await get_presence_service().connect(self.user)
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'subscriptions') or self.user.is_anonymous:
+            return
+
+        rooms = list(self.subscriptions)
+        await get_presence_service().disconnect(self.user, rooms)
+
+        for room_id in rooms:
+            await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+            await self.clear_typing(room_id)
+        self.subscriptions.clear()
+
+        logger.info(f"User {self.user.username} closed a multiplexed connection")
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            self.user.is_online = is_online
-            self.user.save(update_fields=['is_online'])
+            data = self.decode_frame(text_data, bytes_data)
+            message_type = data.get('type', 'chat_message')
+            room_id = self.parse_room_id(data.get('room_id'))
+
+            if message_type == 'ack':
+                self.handle_ack(data)
+            elif room_id is None:
+                await self.send_error(data.get('room_id'), 'A valid room_id is required')
+            elif message_type == 'subscribe':
+                await self.subscribe(room_id, self.parse_since(data.get('since')))
+            elif message_type == 'unsubscribe':
+                await self.unsubscribe(room_id)
+            elif room_id not in self.subscriptions:
+                await self.send_error(room_id, 'Not subscribed to this room')
+            else:
+                await self.dispatch_frame(data, room_id)
+
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON received in multiplexed WebSocket")
+        except ProtocolError as e:
+            logger.warning(f"Invalid binary frame from {self.user.username}: {e}")
         except Exception as e:
-            logger.error(f"Error updating user status: {e}")
+            logger.error(f"Error handling multiplexed WebSocket message: {e}")
 
-    @database_sync_to_async
-    def mark_message_as_read(self, message_id):
-        """Mark message as read"""
+    async def subscribe(self, room_id, since=None):
+        if room_id in self.subscriptions:
+            await self.send_ack('subscribed', room_id)
+            return
+
+        max_rooms = getattr(settings, 'CHAT_MULTIPLEX_MAX_ROOMS', 200)
+        if len(self.subscriptions) >= max_rooms:
+            await self.send_error(room_id, f'Subscription limit of {max_rooms} rooms reached')
+            return
+
+        if not await self.check_room_participation(room_id):
+            logger.warning(f"User {self.user.username} attempted to subscribe to unauthorized room {room_id}")
+            await self.send_error(room_id, 'Chat room not found or access denied')
+            return
+
+        await self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+        self.subscriptions.add(room_id)
+        await get_presence_service().join_room(self.user, room_id)
+        await self.send_ack('subscribed', room_id)
+
+        if since is not None:
+            await self.replay_missed(room_id, since)
+
+    async def unsubscribe(self, room_id):
+        if room_id in self.subscriptions:
+            await self.leave_room(room_id)
+        await self.send_ack('unsubscribed', room_id)
+
+    async def leave_room(self, room_id):
+        self.subscriptions.discard(room_id)
+        await get_presence_service().leave_room(self.user, room_id)
+        await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+        await self.clear_typing(room_id)
+
+    @staticmethod
+    def parse_room_id(value):
         try:
-            Message.objects.filter(
-                id=message_id,
-                room_id=self.room_id
-            ).exclude(sender=self.user).update(is_read=True)
-        except Exception as e:
-            logger.error(f"Error marking message as read: {e}")
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    async def send_ack(self, ack_type, room_id):
+        await self.send(text_data=json.dumps({'type': ack_type, 'room_id': room_id}))
 
+    async def send_error(self, room_id, error):
+        await self.send(text_data=json.dumps({'type': 'error', 'room_id': room_id, 'error': error}))
 
-class UserStatusConsumer(AsyncWebsocketConsumer):
+
+class UserStatusConsumer(BoundedSendMixin, AsyncWebsocketConsumer):
     """Consumer for global user status updates"""
     
     async def connect(self):
@@ -243,12 +443,15 @@ class UserStatusConsumer(AsyncWebsocketConsumer):
         await self.accept()
         logger.info(f"User {self.user.username} connected to status updates")
 
+        await get_presence_service().connect(self.user)
+
     async def disconnect(self, close_code):
         if hasattr(self, 'user_group_name'):
             await self.channel_layer.group_discard(
                 self.user_group_name,
                 self.channel_name
             )
+            await get_presence_service().disconnect(self.user)
             logger.info(f"User {self.user.username} disconnected from status updates")
 
     async def receive(self, text_data):
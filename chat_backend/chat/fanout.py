@@ -0,0 +1,31 @@
+# chat/fanout.py - Channel layer fan-out helpers
+import json
+
+from django.conf import settings
+
+from .protocol import encode_server_frame
+
+
+def binary_protocol_enabled():
+    return getattr(settings, 'CHAT_BINARY_PROTOCOL', False)
+
+
+def wire_event(event_type, **fields):
+    """
+    Build a group event carrying its wire frame, JSON-encoded once.
+
+    Recipient handlers forward event['text'] as-is instead of rebuilding and
+    re-encoding the payload in every consumer of the group. When the binary
+    protocol is enabled (CHAT_BINARY_PROTOCOL, off by default) the event
+    also carries the binary frame in 'bytes'.
+    """
+    event = {
+        'type': event_type,
+        'text': json.dumps({'type': event_type, **fields}),
+    }
+    if binary_protocol_enabled():
+        frame = encode_server_frame(event_type, fields)
+        if frame is not None:
+            event['bytes'] = frame
+    return event
+
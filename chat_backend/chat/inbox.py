@@ -0,0 +1,149 @@
+# chat/inbox.py - Per-participant inbox summaries
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ChatRoom, InboxSummary, Message, RoomReadState
+from .versions import INBOX, ROOM, bump, bump_rooms
+
+Participant = ChatRoom.participants.through
+ROOM_FIELD = ChatRoom.participants.field.m2m_field_name()
+USER_FIELD = ChatRoom.participants.field.m2m_reverse_field_name()
+
+
+def record_messages(messages):
+    """
+    Fold newly saved messages into the participants' inbox summaries.
+
+    Must run in the transaction that saved the messages. Costs one UPDATE
+    per (room, sender) pair in the batch, one per room, and one that moves
+    updated_at (ChatRoom's default ordering) for every room in the batch.
+    """
+    latest = {}
+    per_sender = Counter()
+    for message in messages:
+        current = latest.get(message.room_id)
+        if current is None or message.id > current.id:
+            latest[message.room_id] = message
+        per_sender[(message.room_id, message.sender_id)] += 1
+
+    for (room_id, sender_id), count in per_sender.items():
+        InboxSummary.objects.filter(room_id=room_id).exclude(user_id=sender_id).update(
+            unread_count=F('unread_count') + count
+        )
+    for room_id, message in latest.items():
+        InboxSummary.objects.filter(room_id=room_id).filter(
+            Q(last_message_id__isnull=True) | Q(last_message_id__lt=message.id)
+        ).update(last_message_id=message.id, last_activity_at=message.timestamp)
+    ChatRoom.objects.filter(id__in=list(latest)).update(updated_at=timezone.now())
+
+    # After commit, so a validator never pairs with a body that predates it
+    transaction.on_commit(lambda: bump_rooms(latest))
+
+
+def record_read(room_id, user_id, watermark):
+    """
+    Recount a participant's unread messages after their watermark moved.
+
+    Must run in a transaction. The summary row is locked before counting,
+    so a message committed meanwhile either is in the count or has its
+    increment applied after the write, never lost under the recount.
+    """
+    list(InboxSummary.objects.select_for_update().filter(room_id=room_id, user_id=user_id).values_list('pk'))
+    unread = Message.objects.filter(
+        room_id=room_id, id__gt=watermark
+    ).exclude(sender_id=user_id).count()
+    InboxSummary.objects.filter(room_id=room_id, user_id=user_id).update(unread_count=unread)
+
+    def invalidate():
+        bump(ROOM, [room_id])    # is_read flags on the room's pages
+        bump(INBOX, [user_id])
+    transaction.on_commit(invalidate)
+
+
+def expected_summaries(participants=None):
+    """
+    Compute summaries from raw rows for participant links (default: all).
+
+    Yields unsaved InboxSummary objects; used when users join a room and by
+    the rebuild_inbox command.
+    """
+    if participants is None:
+        participants = Participant.objects.all()
+    room = OuterRef(f'{ROOM_FIELD}_id')
+    user = OuterRef(f'{USER_FIELD}_id')
+
+    latest = Message.objects.filter(room_id=room).order_by('-id')
+    watermark = RoomReadState.objects.filter(room_id=room, user_id=user).values('last_read_message_id')[:1]
+    unread = Message.objects.filter(
+        room_id=room, id__gt=OuterRef('watermark')
+    ).exclude(sender_id=user).order_by().values('room').annotate(total=Count('pk')).values('total')
+
+    rows = participants.annotate(
+        watermark=Coalesce(Subquery(watermark), 0),
+    ).annotate(
+        latest_id=Subquery(latest.values('id')[:1]),
+        latest_at=Subquery(latest.values('timestamp')[:1]),
+        unread=Coalesce(Subquery(unread, output_field=IntegerField()), 0),
+        room_updated_at=F(f'{ROOM_FIELD}__updated_at'),
+    ).values_list(f'{ROOM_FIELD}_id', f'{USER_FIELD}_id', 'latest_id', 'latest_at', 'unread', 'room_updated_at')
+
+    for room_id, user_id, latest_id, latest_at, unread_count, room_updated_at in rows.iterator():
+        yield InboxSummary(
+            room_id=room_id,
+            user_id=user_id,
+            last_message_id=latest_id,
+            last_activity_at=latest_at or room_updated_at,
+            unread_count=unread_count,
+        )
+
+
+def add_participants(room_id, user_ids):
+    """Create summary rows for users who just joined a room"""
+    links = Participant.objects.filter(**{f'{ROOM_FIELD}_id': room_id, f'{USER_FIELD}_id__in': user_ids})
+    InboxSummary.objects.bulk_create(expected_summaries(links), ignore_conflicts=True)
+
+
+def add_rooms(user_id, room_ids):
+    """Create summary rows when rooms are added from the user's side"""
+    links = Participant.objects.filter(**{f'{USER_FIELD}_id': user_id, f'{ROOM_FIELD}_id__in': room_ids})
+    InboxSummary.objects.bulk_create(expected_summaries(links), ignore_conflicts=True)
+
+
+def rebuild_summaries(batch_size=1000):
+    """Replace every summary with one recomputed from messages and watermarks"""
+    with transaction.atomic():
+        InboxSummary.objects.all().delete()
+        summaries = list(expected_summaries())
+        InboxSummary.objects.bulk_create(summaries, batch_size=batch_size)
+    return len(summaries)
+
+
+def verify_summaries():
+    """
+    Compare stored summaries with recomputed ones.
+
+    Returns a list of (room_id, user_id, problem) tuples; empty when the
+    summaries match.
+    """
+    stored = {
+        (summary.room_id, summary.user_id): summary
+        for summary in InboxSummary.objects.all().iterator()
+    }
+    problems = []
+    for expected in expected_summaries():
+        key = (expected.room_id, expected.user_id)
+        summary = stored.pop(key, None)
+        if summary is None:
+            problems.append(key + ('missing',))
+            continue
+        if summary.last_message_id != expected.last_message_id:
+            problems.append(key + (f'last_message_id {summary.last_message_id} != {expected.last_message_id}',))
+        if summary.unread_count != expected.unread_count:
+            problems.append(key + (f'unread_count {summary.unread_count} != {expected.unread_count}',))
+    for key in stored:
+        problems.append(key + ('not a participant',))
+    return problems
@@ -0,0 +1,21 @@
+# chat/lifespan.py - ASGI lifespan events for servers that send them (e.g. uvicorn)
+import logging
+
+from .presence import get_presence_service
+
+logger = logging.getLogger(__name__)
+
+
+async def lifespan_app(scope, receive, send):
+    """Persist in-memory presence on shutdown, while the database is still reachable"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            try:
+                await get_presence_service().shutdown()
+            except Exception as e:
+                logger.error(f"Error flushing presence on shutdown: {e}")
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,89 @@
+# chat/management/commands/benchmark_fanout.py
+
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.fanout import wire_event
+
+
+class Command(BaseCommand):
+    help = 'Compare per-recipient JSON encoding with serialize-once fan-out for chat events'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=str,
+            default='2,10,100,500,1000',
+            help='Comma-separated room sizes (recipients per event)',
+        )
+        parser.add_argument(
+            '--events',
+            type=int,
+            default=200,
+            help='Events to fan out per room size',
+        )
+        parser.add_argument(
+            '--content-bytes',
+            type=int,
+            default=512,
+            help='Size of the base64 ciphertext in each message',
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        events = options['events']
+        content = ('QUJD' * (options['content_bytes'] // 4 + 1))[:options['content_bytes']]
+
+        self.stdout.write(f"=== Fan-out encoding: {events} events, {len(content)}-byte ciphertext ===")
+        self.stdout.write(f"{'recipients':>10} {'per-recipient ms':>17} {'serialize-once ms':>18} {'saved us/event':>15} {'speedup':>8}")
+
+        for size in sizes:
+            per_recipient = self.time_per_recipient(size, events, content)
+            once = self.time_serialize_once(size, events, content)
+            saved_us = (per_recipient - once) / events * 1e6
+            speedup = per_recipient / once if once else float('inf')
+            self.stdout.write(
+                f"{size:>10} {per_recipient * 1000:>17.2f} {once * 1000:>18.2f} {saved_us:>15.1f} {speedup:>7.1f}x"
+            )
+
+    def make_fields(self, i, content):
+        return {
+            'room_id': 1,
+            'message_id': i,
+            'content': content,
+            'sender_id': 7,
+            'sender_username': 'alice',
+            'timestamp': '2025-01-01T12:00:00.000000+00:00',
+        }
+
+    def time_per_recipient(self, size, events, content):
+        """Old path: every recipient rebuilds the dict and calls json.dumps"""
+        sink = []
+        start = time.perf_counter()
+        for i in range(events):
+            event = {'type': 'chat_message', **self.make_fields(i, content)}
+            for _ in range(size):
+                sink.append(json.dumps({
+                    'type': 'chat_message',
+                    'room_id': event['room_id'],
+                    'message_id': event['message_id'],
+                    'content': event['content'],
+                    'sender_id': event['sender_id'],
+                    'sender_username': event['sender_username'],
+                    'timestamp': event['timestamp'],
+                }))
+            sink.clear()
+        return time.perf_counter() - start
+
+    def time_serialize_once(self, size, events, content):
+        """New path: the publisher encodes once, recipients forward the text"""
+        sink = []
+        start = time.perf_counter()
+        for i in range(events):
+            event = wire_event('chat_message', **self.make_fields(i, content))
+            for _ in range(size):
+                sink.append(event['text'])
+            sink.clear()
+        return time.perf_counter() - start
@@ -0,0 +1,106 @@
+# chat/management/commands/benchmark_message_payload.py
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from chat.models import Message
+from chat.serializers import CompactMessageSerializer, MessageSerializer, users_table
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare nested-sender message pages with compact pages plus a users table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=str,
+            default='50,200,500',
+            help='Comma-separated page sizes (messages per page)',
+        )
+        parser.add_argument(
+            '--senders',
+            type=int,
+            default=2,
+            help='Distinct senders in the page',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Times each page is rendered',
+        )
+        parser.add_argument(
+            '--content-bytes',
+            type=int,
+            default=256,
+            help='Size of the base64 ciphertext in each message',
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        repeat = options['repeat']
+        content = ('QUJD' * (options['content_bytes'] // 4 + 1))[:options['content_bytes']]
+        users = self.make_users(options['senders'])
+        renderer = JSONRenderer()
+
+        self.stdout.write(f"=== Message page payload: {len(users)} senders, {len(content)}-byte ciphertext ===")
+        self.stdout.write(
+            f"{'messages':>8} {'nested KB':>10} {'compact KB':>11} {'saved':>6} {'nested ms':>10} {'compact ms':>11}"
+        )
+
+        for size in sizes:
+            messages = self.make_messages(size, users, content)
+            context = {'read_watermarks': {}}
+
+            def nested():
+                return renderer.render({
+                    'messages': MessageSerializer(messages, many=True, context=context).data,
+                })
+
+            def compact():
+                return renderer.render({
+                    'messages': CompactMessageSerializer(messages, many=True, context=context).data,
+                    'users': users_table(messages),
+                })
+
+            nested_bytes, nested_time = self.measure(nested, repeat)
+            compact_bytes, compact_time = self.measure(compact, repeat)
+            saved = 1 - compact_bytes / nested_bytes
+            self.stdout.write(
+                f"{size:>8} {nested_bytes / 1024:>10.1f} {compact_bytes / 1024:>11.1f} {saved:>6.0%} "
+                f"{nested_time * 1000:>10.2f} {compact_time * 1000:>11.2f}"
+            )
+
+    def make_users(self, count):
+        """Unsaved users; nothing touches the database"""
+        users = []
+        for i in range(count):
+            users.append(User(
+                id=i + 1,
+                username=f'user{i}',
+                email=f'user{i}@example.com',
+                created_at=timezone.now(),
+                last_seen=timezone.now(),
+            ))
+        return users
+
+    def make_messages(self, size, users, content):
+        now = timezone.now()
+        return [
+            Message(id=i + 1, room_id=1, sender=users[i % len(users)], encrypted_content=content, timestamp=now)
+            for i in range(size)
+        ]
+
+    def measure(self, render, repeat):
+        """Payload size and mean render time per page"""
+        payload = render()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            render()
+        return len(payload), (time.perf_counter() - start) / repeat
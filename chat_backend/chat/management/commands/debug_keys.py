@@ -1,7 +1,7 @@
 # Create: accounts/management/commands/debug_keys.py
 
 from django.core.management.base import BaseCommand
-from accounts.models import CustomUser
+from accounts.models import CustomUser, UserKeys
 
 class Command(BaseCommand):
     help = 'Debug user encryption keys'
@@ -9,7 +9,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write("=== User Keys Debug ===")
         
-        users = CustomUser.objects.all()
+        users = CustomUser.objects.select_related('keys')
         self.stdout.write(f"Total users: {users.count()}")
         
         for user in users:
@@ -18,9 +18,10 @@ class Command(BaseCommand):
             self.stdout.write(f"   Created: {user.date_joined}")
             
             # Check if keys exist
-            has_public = bool(user.public_key_pem)
-            has_private = bool(user.private_key_encrypted) 
-            has_symmetric = bool(user.symmetric_key)
+            keys = user.get_keys() or UserKeys()
+            has_public = bool(keys.public_key_pem)
+            has_private = bool(keys.private_key_encrypted) 
+            has_symmetric = bool(keys.symmetric_key)
             
             self.stdout.write(f"   Has Public Key: {has_public}")
             self.stdout.write(f"   Has Private Key: {has_private}")
@@ -28,15 +29,15 @@ class Command(BaseCommand):
             
             if has_public:
                 # Show first and last parts of key to check uniqueness
-                key_start = user.public_key_pem[:100] if user.public_key_pem else "None"
-                key_end = user.public_key_pem[-100:] if user.public_key_pem else "None"
+                key_start = keys.public_key_pem[:100] if keys.public_key_pem else "None"
+                key_end = keys.public_key_pem[-100:] if keys.public_key_pem else "None"
                 self.stdout.write(f"   Key Start: {key_start}")
                 self.stdout.write(f"   Key End: {key_end}")
                 
                 # Check if it's a fallback key
-                if "1234567890ABCDEF" in user.public_key_pem:
+                if "1234567890ABCDEF" in keys.public_key_pem:
                     self.stdout.write("   ⚠️  This looks like a fallback key!")
-                elif "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8A" in user.public_key_pem:
+                elif "MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8A" in keys.public_key_pem:
                     self.stdout.write("   ✅ This looks like a real RSA key")
                 else:
                     self.stdout.write("   ❓ Unknown key format")
@@ -46,8 +47,9 @@ class Command(BaseCommand):
         
         public_keys = {}
         for user in users:
-            if user.public_key_pem:
-                key_hash = user.public_key_pem[:200]  # Compare first 200 chars
+            keys = user.get_keys() or UserKeys()
+            if keys.public_key_pem:
+                key_hash = keys.public_key_pem[:200]  # Compare first 200 chars
                 if key_hash in public_keys:
                     self.stdout.write(f"🔴 DUPLICATE KEY FOUND!")
                     self.stdout.write(f"   Users: {public_keys[key_hash]} and {user.username}")
@@ -14,11 +14,12 @@ class Command(BaseCommand):
         self.stdout.write("=== SecureChat Message Debug ===")
         
         # Show all users and their keys
-        users = CustomUser.objects.all()
+        users = CustomUser.objects.select_related('keys')
         self.stdout.write(f"Total users: {users.count()}")
         
         for user in users:
-            key_preview = user.public_key_pem[:50] if user.public_key_pem else "No key"
+            keys = user.get_keys()
+            key_preview = keys.public_key_pem[:50] if keys and keys.public_key_pem else "No key"
             self.stdout.write(f"  - {user.username}: {key_preview}...")
         
         # Show all chat rooms and messages
@@ -0,0 +1,57 @@
+# chat/management/commands/export_room.py
+
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import export_room, parse_since
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Stream a room's encrypted message history as NDJSON (optionally gzip-compressed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_id', type=int, help='Room to export')
+        parser.add_argument(
+            '--output', '-o',
+            help='File to write (default: stdout)',
+        )
+        parser.add_argument('--since-id', help='Only messages with a larger id')
+        parser.add_argument('--since', help='Only messages after this ISO 8601 timestamp')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=getattr(settings, 'CHAT_EXPORT_CHUNK_SIZE', 2000),
+            help='Rows fetched per query',
+        )
+
+    def handle(self, *args, **options):
+        room_id = options['room_id']
+        if not ChatRoom.objects.filter(id=room_id).exists():
+            raise CommandError(f"Chat room {room_id} does not exist")
+        try:
+            since_id, since = parse_since(options['since_id'], options['since'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = export_room(
+            room_id, since_id, since,
+            compress=options['gzip'], chunk_size=options['chunk_size'],
+        )
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Exported room {room_id} to {options['output']} ({written} bytes)"))
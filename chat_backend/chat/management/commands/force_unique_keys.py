@@ -1,12 +1,14 @@
 # Create: accounts/management/commands/force_unique_keys.py
 
 from django.core.management.base import BaseCommand
-from accounts.models import CustomUser
+from accounts.models import CustomUser, UserKeys
 import base64
 import time
 import random
 import hashlib
 
+from .reset_user_keys import add_rotation_arguments, run_bulk_rotation
+
 class Command(BaseCommand):
     help = 'Force generate truly unique keys for all users'
     
@@ -16,6 +18,7 @@ class Command(BaseCommand):
             type=str,
             help='Fix keys for specific user (by username)',
         )
+        add_rotation_arguments(parser)
     
     def handle(self, *args, **options):
         if options['user']:
@@ -30,17 +33,8 @@ class Command(BaseCommand):
                     self.style.ERROR(f"❌ User '{options['user']}' not found")
                 )
         else:
-            # Fix all users
-            users = CustomUser.objects.all()
-            self.stdout.write(f"Generating unique keys for {users.count()} users...")
-            
-            for user in users:
-                self.force_unique_keys(user)
-                self.stdout.write(f"✅ {user.username}: New unique key generated")
-            
-            self.stdout.write(
-                self.style.SUCCESS(f"✅ All {users.count()} users now have unique keys!")
-            )
+            # Fix all users in parallel, id-ordered chunks
+            run_bulk_rotation(self, options)
     
     def force_unique_keys(self, user):
         """Generate truly unique keys for a user"""
@@ -50,6 +44,7 @@ class Command(BaseCommand):
         hash_seed = hashlib.sha256(unique_seed.encode()).hexdigest()
         
         self.stdout.write(f"  Generating keys for {user.username} with seed: {hash_seed[:16]}...")
+        keys = UserKeys(user=user)
         
         # Try to generate real RSA keys first
         try:
@@ -78,8 +73,8 @@ class Command(BaseCommand):
                 encryption_algorithm=serialization.NoEncryption()
             ).decode('utf-8')
             
-            user.public_key_pem = public_pem
-            user.private_key_encrypted = base64.urlsafe_b64encode(private_pem.encode()).decode()
+            keys.public_key_pem = public_pem
+            keys.private_key_encrypted = base64.urlsafe_b64encode(private_pem.encode()).decode()
             
             self.stdout.write(f"    ✅ Real RSA keys generated")
             
@@ -87,7 +82,7 @@ class Command(BaseCommand):
             self.stdout.write(f"    ⚠️  RSA generation failed: {e}")
             
             # Fallback: Create unique demo keys using the hash
-            user.public_key_pem = f"""-----BEGIN PUBLIC KEY-----
+            keys.public_key_pem = f"""-----BEGIN PUBLIC KEY-----
 MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA{hash_seed[:64]}
 {hash_seed[64:128]}{user.username.ljust(32, 'X')[:32]}YZabcdefghijklmnopqrstuvwxyz
 1234567890ABCDEFGHIJ{hash_seed[128:160]}opqrstuvwxyz1234567890ABCDEF
@@ -96,7 +91,7 @@ GHIJKLMNOPQRSTUVWXYZ{hash_seed[160:192]}fghijklmnopqrstuvwxyz12345678
 0ABCDEFGHIJKLMNOPQRSTUVWXYZ{hash_seed[224:256]}TUVWXYZ{user.id:06d}
 -----END PUBLIC KEY-----"""
             
-            user.private_key_encrypted = base64.urlsafe_b64encode(f"private_key_{hash_seed}_{user.username}".encode()).decode()
+            keys.private_key_encrypted = base64.urlsafe_b64encode(f"private_key_{hash_seed}_{user.username}".encode()).decode()
             
             self.stdout.write(f"    ✅ Unique demo keys generated")
         
@@ -104,24 +99,17 @@ GHIJKLMNOPQRSTUVWXYZ{hash_seed[160:192]}fghijklmnopqrstuvwxyz12345678
         from cryptography.fernet import Fernet
         try:
             symmetric_key = Fernet.generate_key()
-            user.symmetric_key = base64.urlsafe_b64encode(symmetric_key).decode()
+            keys.symmetric_key = base64.urlsafe_b64encode(symmetric_key).decode()
             self.stdout.write(f"    ✅ Symmetric key generated")
         except Exception as e:
             self.stdout.write(f"    ⚠️  Fernet failed, using hash: {e}")
             # Fallback: use hash-based key
             symmetric_key = hash_seed[:32].encode().ljust(32, b'0')[:32]
-            user.symmetric_key = base64.urlsafe_b64encode(symmetric_key).decode()
-        
-        # Save the user (bypass the save() method to avoid recursion)
-        CustomUser.objects.filter(id=user.id).update(
-            public_key_pem=user.public_key_pem,
-            private_key_encrypted=user.private_key_encrypted,
-            symmetric_key=user.symmetric_key
-        )
+            keys.symmetric_key = base64.urlsafe_b64encode(symmetric_key).decode()
         
-        # Refresh from database
-        user.refresh_from_db()
+        # Replace the user's keys row (created if missing)
+        keys.save()
         
         # Show preview
-        key_preview = user.public_key_pem[:100] if user.public_key_pem else "None"
+        key_preview = keys.public_key_pem[:100] if keys.public_key_pem else "None"
         self.stdout.write(f"    Key preview: {key_preview}...")
\ No newline at end of file
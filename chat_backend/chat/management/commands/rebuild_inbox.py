@@ -0,0 +1,36 @@
+# chat/management/commands/rebuild_inbox.py
+
+from django.core.management.base import BaseCommand
+
+from chat.inbox import rebuild_summaries, verify_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild inbox summaries from messages and read watermarks, or verify them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare stored summaries with recomputed ones; change nothing',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows per INSERT when rebuilding',
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            problems = verify_summaries()
+            for room_id, user_id, problem in problems[:50]:
+                self.stdout.write(f"  room {room_id}, user {user_id}: {problem}")
+            if problems:
+                self.stdout.write(self.style.ERROR(f"{len(problems)} inbox summaries are out of date"))
+                return
+            self.stdout.write(self.style.SUCCESS("Inbox summaries match messages and read watermarks"))
+            return
+
+        count = rebuild_summaries(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} inbox summaries"))
@@ -4,6 +4,74 @@
 
 from django.core.management.base import BaseCommand
 from accounts.models import CustomUser
+from accounts.rotation import estimate_throughput, load_checkpoint, rotate_all_keys
+
+
+def add_rotation_arguments(parser):
+    """Options shared by the bulk key rotation commands"""
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=500,
+        help='Users per chunk (one keyset read and one key upsert each)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Key generation processes (default: CPU count)',
+    )
+    parser.add_argument(
+        '--checkpoint',
+        type=str,
+        help='File recording progress after each chunk; an existing one is resumed',
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Generate a sample of keys without writing and estimate the run time',
+    )
+    parser.add_argument(
+        '--sample',
+        type=int,
+        default=200,
+        help='Key sets generated by --dry-run',
+    )
+
+
+def run_bulk_rotation(command, options):
+    """Rotate every user's keys (or estimate it with --dry-run), reporting progress"""
+    state = load_checkpoint(options['checkpoint'])
+    remaining = CustomUser.objects.filter(id__gt=state['last_id']).count()
+
+    if options['dry_run']:
+        rate, workers = estimate_throughput(options['sample'], options['workers'])
+        command.stdout.write(f"Generated {options['sample']} key sets on {workers} workers: {rate:.1f} users/s")
+        command.stdout.write(
+            f"Estimated time for {remaining} users: {remaining / rate / 60:.1f} min" if rate else "No throughput measured"
+        )
+        return
+
+    if state['last_id']:
+        command.stdout.write(f"Resuming after user id {state['last_id']} ({state['rotated']} already rotated)")
+    command.stdout.write(f"Rotating keys for {remaining} users...")
+
+    resumed_from = state['rotated']
+
+    def progress(state, total, elapsed):
+        rate = (state['rotated'] - resumed_from) / elapsed if elapsed else 0.0
+        eta = (total - state['rotated']) / rate if rate else 0.0
+        command.stdout.write(
+            f"  {state['rotated']}/{total} users, last id {state['last_id']} "
+            f"({rate:.1f} users/s, ~{eta / 60:.1f} min left)"
+        )
+
+    state = rotate_all_keys(
+        chunk_size=options['chunk_size'], workers=options['workers'],
+        checkpoint=options['checkpoint'], progress=progress,
+    )
+    command.stdout.write(command.style.SUCCESS(f"✅ Rotated keys for {state['rotated']} users"))
+
 
 class Command(BaseCommand):
     help = 'Reset all user encryption keys to generate unique keys for each user'
@@ -19,6 +87,7 @@ class Command(BaseCommand):
             action='store_true',
             help='Reset keys for all users',
         )
+        add_rotation_arguments(parser)
     
     def handle(self, *args, **options):
         if options['user']:
@@ -35,17 +104,8 @@ class Command(BaseCommand):
                 )
                 
         elif options['all']:
-            # Reset keys for all users
-            users = CustomUser.objects.all()
-            self.stdout.write(f"Resetting keys for {users.count()} users...")
-            
-            for user in users:
-                self.reset_user_keys(user)
-                self.stdout.write(f"✅ Reset keys for: {user.username}")
-            
-            self.stdout.write(
-                self.style.SUCCESS(f"✅ Successfully reset keys for all {users.count()} users")
-            )
+            # Reset keys for all users in parallel, id-ordered chunks
+            run_bulk_rotation(self, options)
         else:
             self.stdout.write(
                 self.style.WARNING("Please specify --user <username> or --all")
@@ -54,18 +114,13 @@ class Command(BaseCommand):
     
     def reset_user_keys(self, user):
         """Reset encryption keys for a single user"""
-        # Clear existing keys to force regeneration
-        user.public_key_pem = None
-        user.private_key_encrypted = None
-        user.symmetric_key = None
-        
-        # Save will trigger key generation with unique values
-        user.save()
+        # Replace the user's keys with new unique values
+        keys = user.issue_keys()
         
         # Verify keys were generated
-        if user.public_key_pem and user.private_key_encrypted and user.symmetric_key:
+        if keys.public_key_pem and keys.private_key_encrypted and keys.symmetric_key:
             self.stdout.write(f"  - Generated new keys for {user.username}")
-            self.stdout.write(f"  - Public key preview: {user.public_key_pem[:50]}...")
+            self.stdout.write(f"  - Public key preview: {keys.public_key_pem[:50]}...")
         else:
             self.stdout.write(
                 self.style.WARNING(f"  - Warning: Key generation may have failed for {user.username}")
@@ -40,12 +40,13 @@ class Command(BaseCommand):
                 self.stdout.write(f"Created user: {user2.username}")
 
             # Check keys
-            self.stdout.write(f"User1: {user1.username} - Has Key: {bool(user1.public_key_pem)}")
-            self.stdout.write(f"User2: {user2.username} - Has Key: {bool(user2.public_key_pem)}")
+            keys1, keys2 = user1.get_keys(), user2.get_keys()
+            self.stdout.write(f"User1: {user1.username} - Has Key: {bool(keys1 and keys1.public_key_pem)}")
+            self.stdout.write(f"User2: {user2.username} - Has Key: {bool(keys2 and keys2.public_key_pem)}")
             
             # Show key preview (avoid Unicode issues)
-            if user1.public_key_pem:
-                key_preview = user1.public_key_pem[:100].replace('\n', '\\n')
+            if keys1 and keys1.public_key_pem:
+                key_preview = keys1.public_key_pem[:100].replace('\n', '\\n')
                 self.stdout.write(f"User1 Key Preview: {key_preview}...")
 
             # Create chat room
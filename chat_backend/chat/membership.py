@@ -0,0 +1,111 @@
+# chat/membership.py - Cached room membership checks
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import ChatRoom
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipCache:
+    """
+    LRU cache of (room_id, user_id) -> is_member answers with a TTL.
+
+    Shared by the WebSocket consumers and the REST views. Entries are
+    invalidated from m2m_changed on ChatRoom.participants (see chat/signals.py).
+    """
+
+    def __init__(self, max_entries=50000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, room_id, user_id):
+        """Return the cached answer, or None when unknown or expired"""
+        key = (room_id, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            is_member, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return is_member
+
+    def set(self, room_id, user_id, is_member):
+        key = (room_id, user_id)
+        with self._lock:
+            self._entries[key] = (is_member, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, room_id, user_id):
+        with self._lock:
+            self._entries.pop((room_id, user_id), None)
+
+    def invalidate_room(self, room_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == room_id]:
+                del self._entries[key]
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+membership_cache = MembershipCache(
+    max_entries=getattr(settings, 'CHAT_MEMBERSHIP_CACHE_SIZE', 50000),
+    ttl=getattr(settings, 'CHAT_MEMBERSHIP_CACHE_TTL', 60),
+)
+
+
+def is_room_member(room_id, user_id):
+    """Check whether a user participates in a room, using the shared cache"""
+    try:
+        room_id = int(room_id)
+    except (TypeError, ValueError):
+        return False
+
+    is_member = membership_cache.get(room_id, user_id)
+    if is_member is None:
+        is_member = ChatRoom.objects.filter(id=room_id, participants=user_id).exists()
+        membership_cache.set(room_id, user_id, is_member)
+    return is_member
+
+
+def get_member_room(room_id, user):
+    """Return a room the user participates in, or raise ChatRoom.DoesNotExist"""
+    if not is_room_member(room_id, user.id):
+        raise ChatRoom.DoesNotExist(f"Room {room_id} not found or access denied")
+    return ChatRoom.objects.get(id=room_id)
@@ -1,48 +1,259 @@
+# chat/middleware.py - JWT authentication for WebSocket connections
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from jwt import decode as jwt_decode
 from django.conf import settings
-import jwt
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+from rest_framework_simplejwt.exceptions import TokenError
 
+from .revocation import get_revocation_index
+
+logger = logging.getLogger(__name__)
 User = get_user_model()
 
+
+class VerifiedTokenCache:
+    """
+    LRU of tokens whose signature and claims have already been verified.
+
+    Keyed by the signature segment; the full token is kept and compared on
+    lookup, so a reused signature with a different payload never hits.
+    Entries expire with the token's own exp claim.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        """Return the verified payload, or None when unknown or expired"""
+        key = token.rpartition('.')[2]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != token:
+                self.misses += 1
+                return None
+            _, payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, token, payload):
+        expires_at = payload.get('exp')
+        if self.max_entries <= 0 or expires_at is None:
+            return
+        key = token.rpartition('.')[2]
+        with self._lock:
+            self._entries[key] = (token, payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class UserSnapshotCache:
+    """
+    LRU of user rows loaded for WebSocket handshakes, with a TTL.
+
+    Invalidated on User save and delete (see chat/signals.py); the TTL
+    bounds staleness for saves made in other processes. Each connection
+    gets its own copy of the cached instance. Ids are keyed as strings,
+    since the user_id claim may be serialized either way.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.copy(user)
+
+    def set(self, user):
+        if self.max_entries <= 0:
+            return
+        key = str(user.pk)
+        with self._lock:
+            self._entries[key] = (copy.copy(user), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class HandshakeTimer:
+    """Latency of the authentication step of WebSocket handshakes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms):
+        with self._lock:
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'handshakes': self.count,
+                'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+                'max_ms': round(self.max_ms, 3),
+            }
+
+
+token_cache = VerifiedTokenCache(
+    max_entries=getattr(settings, 'CHAT_WS_TOKEN_CACHE_SIZE', 10000),
+)
+user_cache = UserSnapshotCache(
+    max_entries=getattr(settings, 'CHAT_WS_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'CHAT_WS_USER_CACHE_TTL', 60),
+)
+handshake_timer = HandshakeTimer()
+
+
+def verify_token(token):
+    """Validated claims of a token, decoding it at most once while cached"""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = dict(UntypedToken(token).payload)
+        token_cache.set(token, payload)
+    return payload
+
+
 @database_sync_to_async
-def get_user(validated_token):
+def load_user(user_id):
     try:
-        user_id = validated_token['user_id']
-        user = User.objects.get(id=user_id)
-        return user
+        return User.objects.get(pk=user_id)
     except User.DoesNotExist:
-        return AnonymousUser()
+        return None
+
+
+async def get_user(user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await load_user(user_id)
+        if user is None:
+            return AnonymousUser()
+        user_cache.set(user)
+    return user
+
+
+def auth_stats():
+    return {
+        'token_cache': token_cache.stats(),
+        'user_cache': user_cache.stats(),
+        'handshake': handshake_timer.stats(),
+        'revocation': get_revocation_index().stats(),
+    }
+
 
 class JwtAuthMiddleware(BaseMiddleware):
     def __init__(self, inner):
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
-        # Extract token from query string or headers
-        token = None
-        if "query_string" in scope:
-            query_string = scope["query_string"].decode()
-            query_params = dict(qp.split("=") for qp in query_string.split("&") if "=" in qp)
-            token = query_params.get("token")
-
-        if token:
-            try:
-                # Validate token
-                UntypedToken(token)
-                # Decode token to get user
-                decoded_data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-                scope["user"] = await get_user(decoded_data)
-            except (InvalidToken, TokenError, jwt.DecodeError):
-                scope["user"] = AnonymousUser()
-        else:
-            scope["user"] = AnonymousUser()
-
+        started = time.perf_counter()
+        scope["user"] = await self.authenticate(scope)
+        handshake_timer.record((time.perf_counter() - started) * 1000)
         return await self.inner(scope, receive, send)
 
-JwtAuthMiddlewareStack = lambda inner: JwtAuthMiddleware(inner)
\ No newline at end of file
+    async def authenticate(self, scope):
+        # Extract token from the query string (?token=...)
+        query_params = parse_qs(scope.get("query_string", b"").decode())
+        token = query_params.get("token", [None])[0]
+        if not token:
+            return AnonymousUser()
+
+        try:
+            payload = verify_token(token)
+        except TokenError as e:
+            logger.debug(f"Rejected WebSocket token: {e}")
+            return AnonymousUser()
+
+        # Revocation is checked on every handshake, cached token or not
+        revocation = get_revocation_index()
+        if not revocation.loaded:
+            # Only when the startup load in asgi.py didn't run or failed
+            await database_sync_to_async(revocation.sync)()
+        if revocation.is_revoked(payload.get(api_settings.JTI_CLAIM, '')):
+            logger.info(f"Rejected revoked WebSocket token for user {payload.get(api_settings.USER_ID_CLAIM)}")
+            return AnonymousUser()
+
+        user_id = payload.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return AnonymousUser()
+        return await get_user(user_id)
+
+JwtAuthMiddlewareStack = lambda inner: JwtAuthMiddleware(inner)
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:40
+
+from django.db import migrations
+from django.db.models import Max
+
+
+def backfill_read_watermarks(apps, schema_editor):
+    """Derive each participant's watermark from the legacy Message.is_read flags"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    RoomReadState = apps.get_model('chat', 'RoomReadState')
+
+    participants = ChatRoom._meta.get_field('participants')
+    pairs = ChatRoom.participants.through.objects.values_list(
+        participants.m2m_column_name(), participants.m2m_reverse_name()
+    )
+
+    states = []
+    for room_id, user_id in pairs.iterator():
+        watermark = Message.objects.filter(
+            room_id=room_id, is_read=True
+        ).exclude(sender_id=user_id).aggregate(last=Max('id'))['last']
+        if watermark:
+            states.append(RoomReadState(room_id=room_id, user_id=user_id, last_read_message_id=watermark))
+        if len(states) >= 1000:
+            RoomReadState.objects.bulk_create(states, ignore_conflicts=True)
+            states = []
+    RoomReadState.objects.bulk_create(states, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_roomreadstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_read_watermarks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:47
+
+from django.db import migrations
+
+
+def backfill_inbox_summaries(apps, schema_editor):
+    """Build a summary row for every existing room participant"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    RoomReadState = apps.get_model('chat', 'RoomReadState')
+    InboxSummary = apps.get_model('chat', 'InboxSummary')
+
+    participants = ChatRoom._meta.get_field('participants')
+    pairs = ChatRoom.participants.through.objects.values_list(
+        participants.m2m_column_name(), participants.m2m_reverse_name()
+    )
+    watermarks = {
+        (room_id, user_id): watermark
+        for room_id, user_id, watermark in RoomReadState.objects.values_list(
+            'room_id', 'user_id', 'last_read_message_id'
+        ).iterator()
+    }
+    room_updated = dict(ChatRoom.objects.values_list('id', 'updated_at'))
+
+    summaries = []
+    for room_id, user_id in pairs.iterator():
+        latest = Message.objects.filter(room_id=room_id).order_by('-id').values('id', 'timestamp').first()
+        unread = Message.objects.filter(
+            room_id=room_id, id__gt=watermarks.get((room_id, user_id), 0)
+        ).exclude(sender_id=user_id).count()
+        summaries.append(InboxSummary(
+            room_id=room_id,
+            user_id=user_id,
+            last_message_id=latest['id'] if latest else None,
+            last_activity_at=latest['timestamp'] if latest else room_updated[room_id],
+            unread_count=unread,
+        ))
+        if len(summaries) >= 1000:
+            InboxSummary.objects.bulk_create(summaries, ignore_conflicts=True)
+            summaries = []
+    InboxSummary.objects.bulk_create(summaries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_inboxsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_inbox_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_backfill_inbox_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='direct_user_high',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='direct_user_low',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='chatroom',
+            unique_together={('direct_user_low', 'direct_user_high')},
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:51
+
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def backfill_direct_pairs(apps, schema_editor):
+    """Give every existing two-participant room its canonical pair key"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+
+    participants = ChatRoom._meta.get_field('participants')
+    links = ChatRoom.participants.through.objects.values_list(
+        participants.m2m_column_name(), participants.m2m_reverse_name()
+    )
+    members = defaultdict(list)
+    for room_id, user_id in links.iterator():
+        members[room_id].append(user_id)
+
+    pairs = defaultdict(list)
+    for room_id, user_ids in members.items():
+        if len(user_ids) == 2:
+            pairs[tuple(sorted(user_ids))].append(room_id)
+
+    # When a pair already has several rooms, the most recently active one
+    # keeps the key, as create_or_get_room used to return that one
+    updated = dict(ChatRoom.objects.values_list('id', 'updated_at'))
+    for (low, high), room_ids in pairs.items():
+        room_id = max(room_ids, key=lambda pk: (updated[pk], pk))
+        ChatRoom.objects.filter(id=room_id).update(direct_user_low=low, direct_user_high=high)
+
+
+def clear_direct_pairs(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatRoom.objects.update(direct_user_low=None, direct_user_high=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_chatroom_direct_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_direct_pairs, clear_direct_pairs),
+    ]
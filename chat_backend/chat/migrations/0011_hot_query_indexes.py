@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_backfill_direct_pairs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp'], name='chat_message_room_ts_idx'),
+        ),
+    ]
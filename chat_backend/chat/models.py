@@ -10,22 +10,34 @@ class ChatRoom(models.Model):
     participants = models.ManyToManyField(User, related_name='chat_rooms')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Canonical pair key for 1:1 rooms (lower user id first); NULL for other rooms
+    direct_user_low = models.BigIntegerField(null=True, blank=True)
+    direct_user_high = models.BigIntegerField(null=True, blank=True)
     
     def __str__(self):
         return f"Room {self.id}"
     
     class Meta:
         ordering = ['-updated_at']
+        # No index on updated_at: it is rewritten on every message, and the room
+        # list is ordered by InboxSummary.last_activity_at (chat_inbox_user_activity_idx)
+        unique_together = ('direct_user_low', 'direct_user_high')
 
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     encrypted_content = models.TextField()  # Store client-encrypted content directly
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    is_read = models.BooleanField(default=False)  # Deprecated: read state lives in RoomReadState
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination and replay scan a room's messages by id
+            models.Index(fields=['room', 'id'], name='chat_message_room_id_idx'),
+            # Default ordering within a room and export's since= filter
+            models.Index(fields=['room', 'timestamp'], name='chat_message_room_ts_idx'),
+        ]
     
     def __str__(self):
         return f"Encrypted message from {self.sender.username} at {self.timestamp}"
@@ -35,4 +47,35 @@ class Message(models.Model):
         if self.encrypted_content:
             preview = self.encrypted_content[:50]
             return f"{preview}... (AES-encrypted, {len(self.encrypted_content)} chars)"
-        return "No content"
\ No newline at end of file
+        return "No content"
+
+class RoomReadState(models.Model):
+    """Per-participant read watermark: every message up to last_read_message_id is read"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='room_read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('room', 'user')
+    
+    def __str__(self):
+        return f"{self.user.username} read room {self.room_id} up to {self.last_read_message_id}"
+
+class InboxSummary(models.Model):
+    """Denormalized inbox row per participant: what the room list shows, kept current on write"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_summaries')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='inbox_summaries')
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_activity_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('user', 'room')
+        indexes = [
+            # The room list is one scan of a user's rows, newest activity first
+            models.Index(fields=['user', '-last_activity_at'], name='chat_inbox_user_activity_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Inbox of {self.user.username} for room {self.room_id} ({self.unread_count} unread)"
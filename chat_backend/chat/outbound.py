@@ -0,0 +1,171 @@
+# chat/outbound.py - Bounded per-connection send queues
+import asyncio
+import logging
+import weakref
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Close code sent to clients that can't keep up with their backlog
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Events that are safe to drop under backpressure; the next one supersedes them
+DROPPABLE_EVENTS = frozenset({'typing_indicator', 'user_status_update'})
+
+_CLOSE = object()
+_connections = weakref.WeakSet()
+
+
+class BoundedSendMixin:
+    """
+    Routes every outgoing frame through a bounded queue drained by a writer task.
+
+    Group handlers only append to the queue, so one stalled reader can't hold
+    up the worker. The ASGI server buffers writes without blocking, so the
+    queue alone never shows a slow reader: clients that acknowledge chat
+    frames ({"type": "ack", "message_id": M} after receiving message M) are
+    also charged for every chat frame written but not yet acknowledged.
+    Once that backlog reaches CHAT_SEND_QUEUE_DROP_THRESHOLD, droppable
+    frames (typing, presence) are discarded. If it still reaches
+    CHAT_SEND_QUEUE_MAX, the connection is closed with
+    SLOW_CONSUMER_CLOSE_CODE. Clients that never ack are only bounded by
+    the queue.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._outbox = deque()
+        self._outbox_ready = asyncio.Event()
+        self._writer = None
+        self._unacked = deque()   # ids of chat frames written but not acknowledged
+        self.acks_delivery = False
+        self.send_queue_max = getattr(settings, 'CHAT_SEND_QUEUE_MAX', 256)
+        self.send_queue_drop_threshold = getattr(settings, 'CHAT_SEND_QUEUE_DROP_THRESHOLD', 64)
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.max_depth = 0
+        self.evicted = False
+        _connections.add(self)
+
+    @property
+    def send_queue_depth(self):
+        return len(self._outbox)
+
+    @property
+    def send_backlog(self):
+        """Frames queued here plus chat frames the client hasn't acknowledged"""
+        return len(self._outbox) + len(self._unacked)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        await self.enqueue_frame(text_data, bytes_data)
+        if close:
+            self._push((_CLOSE, close))
+
+    async def enqueue_frame(self, text_data=None, bytes_data=None, droppable=False, message_id=None):
+        """Queue a frame for the writer task, applying the backpressure policy"""
+        if self.evicted:
+            return
+        if text_data is None and bytes_data is None:
+            raise ValueError("You must pass one of bytes_data or text_data")
+
+        if droppable and self.send_backlog >= self.send_queue_drop_threshold:
+            self.frames_dropped += 1
+            return
+
+        if self.send_backlog >= self.send_queue_max:
+            self._drop_droppable()
+            if self.send_backlog >= self.send_queue_max:
+                await self.evict_slow_consumer()
+                return
+
+        self._push((text_data, bytes_data, droppable, message_id))
+
+    def record_ack(self, message_id):
+        """The client received every chat frame up to and including message_id"""
+        self.acks_delivery = True
+        if message_id in self._unacked:
+            while self._unacked.popleft() != message_id:
+                pass
+
+    async def evict_slow_consumer(self):
+        user = getattr(self, 'user', None)
+        logger.warning(
+            f"Closing slow connection {self.channel_name} for {getattr(user, 'username', 'unknown')}: "
+            f"{len(self._outbox)} frames queued, {len(self._unacked)} unacknowledged"
+        )
+        self.evicted = True
+        self.frames_dropped += len(self._outbox)
+        self._outbox.clear()
+        self._unacked.clear()
+        self._stop_writer()
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        self._stop_writer()
+        await super().websocket_disconnect(message)
+
+    def send_queue_stats(self):
+        user = getattr(self, 'user', None)
+        return {
+            'channel': self.channel_name,
+            'user_id': getattr(user, 'id', None),
+            'consumer': type(self).__name__,
+            'depth': len(self._outbox),
+            'unacked': len(self._unacked),
+            'max_depth': self.max_depth,
+            'sent': self.frames_sent,
+            'dropped': self.frames_dropped,
+        }
+
+    def _push(self, item):
+        self._outbox.append(item)
+        self.max_depth = max(self.max_depth, self.send_backlog)
+        self._outbox_ready.set()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._drain())
+
+    def _drop_droppable(self):
+        kept = deque(item for item in self._outbox if item[0] is _CLOSE or not item[2])
+        self.frames_dropped += len(self._outbox) - len(kept)
+        self._outbox = kept
+
+    def _stop_writer(self):
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+        self._writer = None
+
+    async def _drain(self):
+        while True:
+            if not self._outbox:
+                self._outbox_ready.clear()
+                await self._outbox_ready.wait()
+                continue
+
+            item = self._outbox.popleft()
+            if item[0] is _CLOSE:
+                await self.close(item[1])
+                continue
+
+            text_data, bytes_data, _, message_id = item
+            try:
+                await super().send(text_data=text_data, bytes_data=bytes_data)
+                self.frames_sent += 1
+                if message_id is not None and self.acks_delivery:
+                    self._unacked.append(message_id)
+            except Exception as e:
+                logger.error(f"Error writing to WebSocket {self.channel_name}: {e}")
+
+
+def send_queue_stats(top=20):
+    """Queue depth totals plus the deepest connections in this process"""
+    connections = [connection.send_queue_stats() for connection in list(_connections)]
+    connections.sort(key=lambda stats: stats['depth'] + stats['unacked'], reverse=True)
+    return {
+        'connections': len(connections),
+        'queued_frames': sum(stats['depth'] for stats in connections),
+        'unacked_frames': sum(stats['unacked'] for stats in connections),
+        'dropped_frames': sum(stats['dropped'] for stats in connections),
+        'deepest': connections[:top],
+    }
@@ -0,0 +1,81 @@
+# chat/pagination.py - Keyset pagination over a room's message history
+import base64
+import binascii
+
+from django.conf import settings
+
+from .models import Message
+
+
+class InvalidCursor(ValueError):
+    """Raised for cursor tokens that weren't issued by encode_cursor"""
+
+
+def encode_cursor(message_id):
+    """Opaque token for a position in a room's history"""
+    return base64.urlsafe_b64encode(f'm:{message_id}'.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('ascii')
+        prefix, message_id = raw.split(':', 1)
+        message_id = int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(f"Invalid cursor '{token}'")
+    if prefix != 'm' or message_id < 0:
+        raise InvalidCursor(f"Invalid cursor '{token}'")
+    return message_id
+
+
+def page_size(value):
+    """Requested page size, clamped to CHAT_MESSAGE_PAGE_MAX"""
+    default = getattr(settings, 'CHAT_MESSAGE_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'CHAT_MESSAGE_PAGE_MAX', 200)
+    try:
+        size = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+def message_page(room_id, before=None, after=None, limit=50):
+    """
+    One page of a room's messages in ascending id order.
+
+    With no cursor this is the latest page. `before` pages towards older
+    messages, `after` towards newer ones. Each page is a range scan on the
+    (room, id) index that reads at most limit + 1 rows, so its cost doesn't
+    depend on the size of the room.
+
+    Returns (messages, older_cursor, newer_cursor). The older cursor is None
+    when there is nothing older; pages fetched with `after` always carry
+    one, since the rows before them aren't counted. The newer cursor is
+    always set, anchored at the newest row returned (or at the requested
+    position when the page is empty), so a client on the latest page can
+    poll ?after= for messages that arrive later.
+    """
+    messages = Message.objects.filter(room_id=room_id).select_related('sender')
+
+    if after is not None:
+        rows = list(messages.filter(id__gt=after).order_by('id')[:limit])
+        has_older = True
+    else:
+        if before is not None:
+            messages = messages.filter(id__lt=before)
+        rows = list(messages.order_by('-id')[:limit + 1])
+        has_older = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    if not rows:
+        # An empty page keeps the caller's position so it can poll again
+        if after is not None:
+            position = after
+        elif before is not None:
+            position = max(before - 1, 0)
+        else:
+            position = 0
+        return rows, None, encode_cursor(position)
+
+    older = encode_cursor(rows[0].id) if has_older else None
+    return rows, older, encode_cursor(rows[-1].id)
@@ -0,0 +1,231 @@
+# chat/persistence.py - Message persistence for the WebSocket layer
+import asyncio
+import atexit
+import logging
+import threading
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+
+from .inbox import record_messages
+from .models import Message
+from .recent import recent_messages
+
+logger = logging.getLogger(__name__)
+
+STRICT = 'strict'
+BATCHED = 'batched'
+
+
+def persistence_mode():
+    """Return the configured commit mode for WebSocket messages"""
+    mode = getattr(settings, 'CHAT_MESSAGE_PERSISTENCE', STRICT)
+    if mode not in (STRICT, BATCHED):
+        logger.warning(f"Unknown CHAT_MESSAGE_PERSISTENCE '{mode}', using '{STRICT}'")
+        return STRICT
+    return mode
+
+
+def persist_messages(entries):
+    """
+    Write (room_id, sender, encrypted_content) entries in one transaction.
+
+    Returns the saved Message objects in input order, with primary keys set.
+    Every message creation path goes through here so the recent-message
+    ring buffer used for reconnect replay stays complete.
+    """
+    messages = [
+        Message(room_id=room_id, sender=sender, encrypted_content=encrypted_content)
+        for room_id, sender, encrypted_content in entries
+    ]
+    if not messages:
+        return messages
+
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Message.objects.bulk_create(messages)
+        else:
+            # Backends such as MySQL don't report ids from bulk inserts, and
+            # fan-out needs them, so fall back to row inserts in one commit
+            for message in messages:
+                message.save(force_insert=True)
+
+        # Last message, activity time and unread counters for the room list
+        record_messages(messages)
+
+        transaction.on_commit(lambda: recent_messages.record(messages))
+
+    return messages
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind buffer that groups messages into bulk inserts.
+
+    Callers await submit() and get the saved Message back once its batch has
+    been committed, so fan-out still happens only after ids are assigned.
+    The queue is bounded: when it is full, submit() waits for space.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.01, max_pending=5000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._loop = asyncio.get_running_loop()
+        self._worker = None
+        # Batches handed to a database thread but not yet committed, by id;
+        # the lock is held for the whole write so drain_sync can wait on it
+        self._inflight = {}
+        self._write_lock = threading.Lock()
+        self.batches_written = 0
+        self.messages_written = 0
+        self.failed_batches = 0
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    async def submit(self, room_id, sender, encrypted_content):
+        """Queue a message and wait until it has been written"""
+        future = self._loop.create_future()
+        await self._queue.put((room_id, sender, encrypted_content, future))
+        self._ensure_worker()
+        return await future
+
+    async def flush(self):
+        """Write everything queued right now, without waiting for the timer"""
+        while not self._queue.empty():
+            await self._write(self._take(self.batch_size))
+
+    def drain_sync(self):
+        """
+        Write leftover messages synchronously (used at interpreter exit).
+
+        Waits for a batch that is being written right now, and also writes
+        batches the stopped event loop had taken but never handed over.
+        """
+        with self._write_lock:
+            batch = [item for inflight in list(self._inflight.values()) for item in inflight]
+            self._inflight.clear()
+            batch.extend(self._take(self._queue.qsize()))
+            if not batch:
+                return
+            try:
+                persist_messages([item[:3] for item in batch])
+                logger.info(f"Flushed {len(batch)} buffered messages on shutdown")
+            except Exception as e:
+                logger.error(f"Error flushing buffered messages on shutdown: {e}")
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'batches_written': self.batches_written,
+            'messages_written': self.messages_written,
+            'failed_batches': self.failed_batches,
+        }
+
+    def _take(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._worker = self._loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.flush_interval
+
+            # Keep collecting until the batch is full or the interval expires
+            while len(batch) < self.batch_size:
+                batch.extend(self._take(self.batch_size - len(batch)))
+                remaining = deadline - self._loop.time()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._write(batch)
+
+    def _write_inflight(self, key):
+        with self._write_lock:
+            batch = self._inflight.get(key)
+            if batch is None:
+                # Already written by drain_sync
+                return []
+            try:
+                return persist_messages([item[:3] for item in batch])
+            finally:
+                del self._inflight[key]
+
+    async def _write(self, batch):
+        if not batch:
+            return
+        key = id(batch)
+        self._inflight[key] = batch
+        try:
+            messages = await database_sync_to_async(self._write_inflight)(key)
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"Error writing batch of {len(batch)} messages: {e}")
+            messages = [None] * len(batch)
+        else:
+            self.batches_written += 1
+            self.messages_written += len(messages)
+
+        for item, message in zip(batch, messages):
+            future = item[3]
+            if not future.done():
+                future.set_result(message)
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_message_buffer():
+    """Return the write buffer bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _buffers_lock:
+        buffer = _buffers.get(loop)
+        if buffer is None:
+            buffer = MessageWriteBuffer(
+                batch_size=getattr(settings, 'CHAT_MESSAGE_BATCH_SIZE', 100),
+                flush_interval=getattr(settings, 'CHAT_MESSAGE_FLUSH_INTERVAL_MS', 10) / 1000,
+                max_pending=getattr(settings, 'CHAT_MESSAGE_BUFFER_MAX', 5000),
+            )
+            _buffers[loop] = buffer
+        return buffer
+
+
+def buffer_stats():
+    """Aggregate stats over all write buffers in this process"""
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    totals = {'pending': 0, 'batches_written': 0, 'messages_written': 0, 'failed_batches': 0}
+    for buffer in buffers:
+        for key, value in buffer.stats().items():
+            totals[key] += value
+    totals['mode'] = persistence_mode()
+    return totals
+
+
+@atexit.register
+def _flush_buffers_on_exit():
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    for buffer in buffers:
+        buffer.drain_sync()
@@ -0,0 +1,336 @@
+# chat/presence.py - Ref-counted user presence with batched persistence
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .fanout import wire_event
+from .versions import bump_users
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+
+class PresenceBackend:
+    """
+    Storage for live connection counts and heartbeats.
+
+    A user is online while they have an entry. Entries are removed when the
+    connection count drops to zero or when no heartbeat arrives within the
+    TTL (e.g. the process holding the connections died). Backends shared
+    between processes can implement the same interface.
+    """
+
+    def incr(self, user_id, now):
+        raise NotImplementedError
+
+    def decr(self, user_id, now):
+        raise NotImplementedError
+
+    def heartbeat(self, user_ids, now):
+        raise NotImplementedError
+
+    def expire(self, cutoff):
+        """Remove entries whose last heartbeat is older than cutoff; return their user ids"""
+        raise NotImplementedError
+
+    def clear(self, user_id):
+        raise NotImplementedError
+
+    def is_online(self, user_id):
+        raise NotImplementedError
+
+    def online_count(self):
+        raise NotImplementedError
+
+
+class InMemoryPresenceBackend(PresenceBackend):
+    """Process-local backend, suitable for development and tests"""
+
+    def __init__(self):
+        self._entries = {}  # user_id -> [connections, last_heartbeat]
+
+    def incr(self, user_id, now):
+        entry = self._entries.setdefault(user_id, [0, now])
+        entry[0] += 1
+        entry[1] = now
+        return entry[0]
+
+    def decr(self, user_id, now):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return 0
+        entry[0] -= 1
+        entry[1] = now
+        if entry[0] <= 0:
+            del self._entries[user_id]
+            return 0
+        return entry[0]
+
+    def heartbeat(self, user_ids, now):
+        for user_id in user_ids:
+            self._entries.setdefault(user_id, [0, now])[1] = now
+
+    def expire(self, cutoff):
+        expired = [user_id for user_id, (_, seen) in self._entries.items() if seen < cutoff]
+        for user_id in expired:
+            del self._entries[user_id]
+        return expired
+
+    def clear(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def is_online(self, user_id):
+        return user_id in self._entries
+
+    def online_count(self):
+        return len(self._entries)
+
+
+def persist_presence(online_ids, offline_ids, now):
+    """Write is_online/last_seen for many users with at most two UPDATEs"""
+    if online_ids:
+        User.objects.filter(id__in=online_ids).update(is_online=True, last_seen=now)
+    if offline_ids:
+        User.objects.filter(id__in=offline_ids).update(is_online=False, last_seen=now)
+    bump_users(list(online_ids) + list(offline_ids))
+
+
+class PresenceService:
+    """
+    Tracks live connections per user across all consumers in this process.
+
+    Connects and disconnects only touch memory. A periodic flush heartbeats
+    the users connected here, expires stale entries, broadcasts coalesced
+    online/offline transitions to the user's rooms and persists the new
+    state with batched UPDATEs. A user flapping between tabs within one
+    flush interval produces no broadcast and no row write.
+    """
+
+    def __init__(self, backend, flush_interval=2.0, ttl=60.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._local = Counter()               # user_id -> connections in this process
+        self._rooms = defaultdict(Counter)    # user_id -> room_id -> connections
+        self._usernames = {}
+        self._announced = set()               # users last broadcast as online
+        self._last_rooms = {}                 # rooms to notify when a user goes offline
+        self._dirty = set()
+        self._joined = set()                  # (user_id, room_id) since last flush
+        self._flusher = None
+        self.flushes = 0
+        self.broadcasts = 0
+        self.rows_written = 0
+
+    async def connect(self, user, room_ids=()):
+        with self._lock:
+            self._local[user.id] += 1
+            self._usernames[user.id] = user.username
+            if self.backend.incr(user.id, time.time()) == 1:
+                self._dirty.add(user.id)
+            for room_id in room_ids:
+                self._join(user.id, room_id)
+        self._ensure_flusher()
+
+    async def disconnect(self, user, room_ids=()):
+        with self._lock:
+            for room_id in room_ids:
+                self._leave(user.id, room_id)
+            self._local[user.id] -= 1
+            if self._local[user.id] <= 0:
+                del self._local[user.id]
+                self._last_rooms[user.id] = set(self._rooms.pop(user.id, ())) | set(room_ids)
+            if self.backend.decr(user.id, time.time()) == 0:
+                self._dirty.add(user.id)
+
+    async def join_room(self, user, room_id):
+        with self._lock:
+            self._join(user.id, room_id)
+
+    async def leave_room(self, user, room_id):
+        with self._lock:
+            self._leave(user.id, room_id)
+
+    def note_login(self, user):
+        """Mark a user online without a socket; expires after the TTL"""
+        with self._lock:
+            self._usernames[user.id] = user.username
+            self.backend.heartbeat([user.id], time.time())
+            self._dirty.add(user.id)
+        self._persist_if_idle()
+
+    def note_logout(self, user):
+        with self._lock:
+            self.backend.clear(user.id)
+            self._dirty.add(user.id)
+        self._persist_if_idle()
+
+    def is_online(self, user_id):
+        with self._lock:
+            return self.backend.is_online(user_id)
+
+    async def flush(self):
+        online_ids, offline_ids, events = self._collect()
+        now = timezone.now()
+
+        if online_ids or offline_ids:
+            try:
+                await database_sync_to_async(persist_presence)(online_ids, offline_ids, now)
+                self.rows_written += len(online_ids) + len(offline_ids)
+            except Exception as e:
+                logger.error(f"Error persisting presence for {len(online_ids) + len(offline_ids)} users: {e}")
+
+        channel_layer = get_channel_layer()
+        for room_id, user_id, username, is_online in events:
+            await channel_layer.group_send(
+                f'chat_{room_id}',
+                wire_event(
+                    'user_status_update',
+                    room_id=room_id,
+                    user_id=user_id,
+                    username=username,
+                    is_online=is_online,
+                )
+            )
+        self.broadcasts += len(events)
+        self.flushes += 1
+
+    def drain_sync(self):
+        """Persist pending state without broadcasting (used at interpreter exit)"""
+        online_ids, offline_ids, _ = self._collect()
+        if online_ids or offline_ids:
+            try:
+                persist_presence(online_ids, offline_ids, timezone.now())
+            except Exception as e:
+                logger.error(f"Error persisting presence on shutdown: {e}")
+
+    async def shutdown(self):
+        """Stop the flusher and persist pending state (ASGI lifespan shutdown)"""
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        self._flusher = None
+        await database_sync_to_async(self.drain_sync)()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'online_users': self.backend.online_count(),
+                'local_users': len(self._local),
+                'local_connections': sum(self._local.values()),
+                'pending_changes': len(self._dirty),
+                'flushes': self.flushes,
+                'broadcasts': self.broadcasts,
+                'rows_written': self.rows_written,
+            }
+
+    def _join(self, user_id, room_id):
+        rooms = self._rooms[user_id]
+        rooms[room_id] += 1
+        if rooms[room_id] == 1:
+            self._joined.add((user_id, room_id))
+
+    def _leave(self, user_id, room_id):
+        rooms = self._rooms.get(user_id)
+        if rooms is None or room_id not in rooms:
+            return
+        rooms[room_id] -= 1
+        if rooms[room_id] <= 0:
+            del rooms[room_id]
+            self._joined.discard((user_id, room_id))
+
+    def _collect(self):
+        """Work out what changed since the last flush"""
+        with self._lock:
+            now = time.time()
+            self.backend.heartbeat(list(self._local), now)
+            self._dirty.update(self.backend.expire(now - self.ttl))
+
+            online_ids, offline_ids, events = [], [], []
+            newly_announced = set()
+            for user_id in self._dirty:
+                username = self._usernames.get(user_id, '')
+                if self.backend.is_online(user_id):
+                    self._last_rooms.pop(user_id, None)
+                    if user_id not in self._announced:
+                        online_ids.append(user_id)
+                        self._announced.add(user_id)
+                        newly_announced.add(user_id)
+                        events.extend((room_id, user_id, username, True) for room_id in self._rooms.get(user_id, ()))
+                else:
+                    offline_ids.append(user_id)
+                    rooms = self._last_rooms.pop(user_id, ())
+                    if user_id in self._announced:
+                        self._announced.discard(user_id)
+                        events.extend((room_id, user_id, username, False) for room_id in rooms)
+                    if user_id not in self._local:
+                        self._usernames.pop(user_id, None)
+
+            # Rooms opened by users who were already announced as online
+            for user_id, room_id in self._joined:
+                if user_id in self._announced and user_id not in newly_announced:
+                    events.append((room_id, user_id, self._usernames.get(user_id, ''), True))
+
+            self._dirty.clear()
+            self._joined.clear()
+            return online_ids, offline_ids, events
+
+    def _flusher_running(self):
+        flusher = self._flusher
+        return flusher is not None and not flusher.done() and not flusher.get_loop().is_closed()
+
+    def _persist_if_idle(self):
+        # REST views run outside the event loop; with no flusher to pick the
+        # change up (no sockets open here yet), write it straight away
+        if not self._flusher_running():
+            self.drain_sync()
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not loop:
+            self._flusher = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing presence: {e}")
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_presence_service():
+    """Return the process-wide presence service"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            backend_class = import_string(
+                getattr(settings, 'CHAT_PRESENCE_BACKEND', 'chat.presence.InMemoryPresenceBackend')
+            )
+            _service = PresenceService(
+                backend_class(),
+                flush_interval=getattr(settings, 'CHAT_PRESENCE_FLUSH_INTERVAL', 2.0),
+                ttl=getattr(settings, 'CHAT_PRESENCE_TTL', 60.0),
+            )
+        return _service
+
+
+@atexit.register
+def _flush_presence_on_exit():
+    # Fallback for servers without lifespan events (daphne)
+    if _service is not None:
+        _service.drain_sync()
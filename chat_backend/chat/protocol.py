@@ -0,0 +1,191 @@
+# chat/protocol.py - Compact binary WebSocket protocol (opt-in via subprotocol)
+"""
+When CHAT_BINARY_PROTOCOL is on, clients that offer the BINARY_SUBPROTOCOL
+subprotocol may send and receive chat, typing and read events as binary frames carrying raw ciphertext
+instead of base64 inside JSON. Control frames (subscribe, errors, acks)
+stay JSON text frames on both protocols.
+
+Frame layout, network byte order:
+
+    u8 version | u8 frame type | body
+
+Client -> server bodies:
+    CHAT_MESSAGE   u64 room_id | ciphertext (rest of frame, at most MAX_CIPHERTEXT bytes)
+    TYPING         u64 room_id | u8 is_typing
+    READ           u64 room_id | u64 message_id
+
+Server -> client bodies:
+    CHAT_MESSAGE   u64 room_id | u64 message_id | u64 sender_id | i64 timestamp_ms
+                   | u16 name_len | name | ciphertext (rest of frame)
+    TYPING         u64 room_id | u64 user_id | u8 is_typing | u16 name_len | name
+    USER_STATUS    u64 room_id | u64 user_id | u8 is_online | u16 name_len | name
+"""
+import base64
+import binascii
+import struct
+from datetime import datetime, timezone
+
+BINARY_SUBPROTOCOL = 'securechat.bin.v1'
+VERSION = 1
+MAX_CIPHERTEXT = 7500  # Same limit as the 10000 base64 characters allowed in JSON frames
+
+CHAT_MESSAGE = 0x01
+TYPING = 0x02
+READ = 0x03
+USER_STATUS = 0x04
+
+_HEADER = struct.Struct('!BB')
+_ROOM = struct.Struct('!Q')
+_TYPING = struct.Struct('!QB')
+_READ = struct.Struct('!QQ')
+_CHAT_OUT = struct.Struct('!QQQqH')
+_FLAG_OUT = struct.Struct('!QQBH')
+
+_EVENT_TYPES = {
+    'chat_message': CHAT_MESSAGE,
+    'typing_indicator': TYPING,
+    'user_status_update': USER_STATUS,
+}
+
+
+class ProtocolError(ValueError):
+    """Raised for malformed binary frames"""
+
+
+def parse_client_frame(data):
+    """
+    Decode a client binary frame into the same dict a JSON frame produces.
+
+    Works on memoryview slices, so the ciphertext is not copied before it
+    is base64-encoded for storage.
+    """
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise ProtocolError("Frame too short")
+    version, frame_type = _HEADER.unpack_from(view)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    body = view[_HEADER.size:]
+
+    try:
+        if frame_type == CHAT_MESSAGE:
+            room_id, = _ROOM.unpack_from(body)
+            ciphertext = body[_ROOM.size:]
+            if len(ciphertext) > MAX_CIPHERTEXT:
+                raise ProtocolError(f"Ciphertext too long: {len(ciphertext)} bytes")
+            return {
+                'type': 'chat_message',
+                'room_id': room_id,
+                'content': base64.b64encode(ciphertext).decode('ascii'),
+            }
+        if frame_type == TYPING:
+            room_id, is_typing = _TYPING.unpack_from(body)
+            return {'type': 'typing', 'room_id': room_id, 'is_typing': bool(is_typing)}
+        if frame_type == READ:
+            room_id, message_id = _READ.unpack_from(body)
+            return {'type': 'read_message', 'room_id': room_id, 'message_id': message_id}
+    except struct.error as e:
+        raise ProtocolError(f"Truncated frame: {e}")
+
+    raise ProtocolError(f"Unknown frame type {frame_type:#x}")
+
+
+def encode_server_frame(event_type, fields):
+    """
+    Encode an outgoing event as a binary frame.
+
+    Returns None when the event has no binary form, its content isn't
+    valid base64 or a field doesn't fit its slot; binary clients then
+    receive the JSON text frame instead.
+    """
+    try:
+        return _encode_server_frame(event_type, fields)
+    except struct.error:
+        return None
+
+
+def _encode_server_frame(event_type, fields):
+    frame_type = _EVENT_TYPES.get(event_type)
+    if frame_type is None:
+        return None
+    header = _HEADER.pack(VERSION, frame_type)
+
+    if frame_type == CHAT_MESSAGE:
+        try:
+            ciphertext = base64.b64decode(fields['content'], validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        name = fields['sender_username'].encode('utf-8')
+        timestamp = datetime.fromisoformat(fields['timestamp'])
+        return b''.join((
+            header,
+            _CHAT_OUT.pack(
+                fields['room_id'],
+                fields['message_id'],
+                fields['sender_id'],
+                int(timestamp.timestamp() * 1000),
+                len(name),
+            ),
+            name,
+            ciphertext,
+        ))
+
+    flag = fields['is_typing'] if frame_type == TYPING else fields['is_online']
+    name = fields['username'].encode('utf-8')
+    return b''.join((
+        header,
+        _FLAG_OUT.pack(fields['room_id'], fields['user_id'], int(bool(flag)), len(name)),
+        name,
+    ))
+
+
+def parse_server_frame(data):
+    """Decode a server binary frame (for Python clients and tests)"""
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise ProtocolError("Frame too short")
+    version, frame_type = _HEADER.unpack_from(view)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    body = view[_HEADER.size:]
+
+    if frame_type == CHAT_MESSAGE:
+        room_id, message_id, sender_id, timestamp_ms, name_len = _unpack(_CHAT_OUT, body)
+        offset = _CHAT_OUT.size
+        _check_name(body, offset, name_len)
+        return {
+            'type': 'chat_message',
+            'room_id': room_id,
+            'message_id': message_id,
+            'sender_id': sender_id,
+            'sender_username': str(body[offset:offset + name_len], 'utf-8'),
+            'timestamp': datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc),
+            'ciphertext': body[offset + name_len:],
+        }
+
+    if frame_type in (TYPING, USER_STATUS):
+        room_id, user_id, flag, name_len = _unpack(_FLAG_OUT, body)
+        offset = _FLAG_OUT.size
+        _check_name(body, offset, name_len)
+        key = 'is_typing' if frame_type == TYPING else 'is_online'
+        return {
+            'type': 'typing_indicator' if frame_type == TYPING else 'user_status_update',
+            'room_id': room_id,
+            'user_id': user_id,
+            key: bool(flag),
+            'username': str(body[offset:offset + name_len], 'utf-8'),
+        }
+
+    raise ProtocolError(f"Unknown frame type {frame_type:#x}")
+
+
+def _unpack(layout, body):
+    try:
+        return layout.unpack_from(body)
+    except struct.error as e:
+        raise ProtocolError(f"Truncated frame: {e}")
+
+
+def _check_name(body, offset, name_len):
+    if offset + name_len > len(body):
+        raise ProtocolError(f"Name length {name_len} runs past the end of the frame")
@@ -0,0 +1,179 @@
+# chat/read_state.py - Per-participant read watermarks
+import asyncio
+import atexit
+import logging
+import threading
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .fanout import wire_event
+from .inbox import record_read
+from .models import Message, RoomReadState
+
+logger = logging.getLogger(__name__)
+
+
+def get_read_watermark(room_id, user_id):
+    """Highest message id the user has read in the room (0 if none)"""
+    watermark = RoomReadState.objects.filter(
+        room_id=room_id, user_id=user_id
+    ).values_list('last_read_message_id', flat=True).first()
+    return watermark or 0
+
+
+def get_room_watermarks(room_id):
+    """Map of user_id -> watermark for every participant with read state"""
+    return dict(
+        RoomReadState.objects.filter(room_id=room_id).values_list('user_id', 'last_read_message_id')
+    )
+
+
+def unread_count(room_id, user_id, watermark=None):
+    """Messages from other participants above the user's watermark"""
+    if watermark is None:
+        watermark = get_read_watermark(room_id, user_id)
+    return Message.objects.filter(
+        room_id=room_id, id__gt=watermark
+    ).exclude(sender_id=user_id).count()
+
+
+def advance_read_watermark(room_id, user_id, message_id=None):
+    """
+    Move a participant's watermark forward to message_id (default: latest message).
+
+    The watermark never moves backwards and is clamped to a message that
+    exists in the room. Returns the new watermark, or None if it didn't move.
+    """
+    messages = Message.objects.filter(room_id=room_id)
+    if message_id is not None:
+        messages = messages.filter(id__lte=message_id)
+    target = messages.aggregate(last=Max('id'))['last']
+    if not target:
+        return None
+
+    with transaction.atomic():
+        updated = RoomReadState.objects.filter(
+            room_id=room_id, user_id=user_id, last_read_message_id__lt=target
+        ).update(last_read_message_id=target, updated_at=timezone.now())
+        if not updated:
+            state, created = RoomReadState.objects.get_or_create(
+                room_id=room_id, user_id=user_id,
+                defaults={'last_read_message_id': target},
+            )
+            if not created:
+                return None
+
+        record_read(room_id, user_id, target)
+        return target
+
+
+def apply_read_watermarks(pending):
+    """Apply {(room_id, user_id): message_id}; return the watermarks that moved"""
+    advanced = {}
+    for (room_id, user_id), message_id in pending.items():
+        try:
+            watermark = advance_read_watermark(room_id, user_id, message_id)
+        except Exception as e:
+            logger.error(f"Error advancing read watermark for user {user_id} in room {room_id}: {e}")
+            continue
+        if watermark is not None:
+            advanced[(room_id, user_id)] = watermark
+    return advanced
+
+
+class ReadWatermarkCoalescer:
+    """
+    Collects "read up to X" reports from WebSocket clients.
+
+    Reports for the same (room, user) within flush_delay collapse into one
+    monotonic UPDATE, after which a read_receipt event goes to the room.
+    """
+
+    def __init__(self, flush_delay=0.5):
+        self.flush_delay = flush_delay
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+        self.reports = 0
+        self.writes = 0
+
+    async def report(self, room_id, user_id, message_id):
+        with self._lock:
+            self.reports += 1
+            key = (room_id, user_id)
+            if message_id > self._pending.get(key, 0):
+                self._pending[key] = message_id
+
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._flush_later())
+
+    async def flush(self):
+        pending = self._take()
+        if not pending:
+            return
+        advanced = await database_sync_to_async(apply_read_watermarks)(pending)
+        self.writes += len(pending)
+
+        channel_layer = get_channel_layer()
+        for (room_id, user_id), watermark in advanced.items():
+            await channel_layer.group_send(
+                f'chat_{room_id}',
+                wire_event(
+                    'read_receipt',
+                    room_id=room_id,
+                    user_id=user_id,
+                    last_read_message_id=watermark,
+                )
+            )
+
+    def drain_sync(self):
+        pending = self._take()
+        if pending:
+            apply_read_watermarks(pending)
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'reports': self.reports, 'writes': self.writes}
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            return pending
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.flush_delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing read watermarks: {e}")
+            with self._lock:
+                if not self._pending:
+                    return
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_read_coalescer():
+    """Return the process-wide read watermark coalescer"""
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = ReadWatermarkCoalescer(
+                flush_delay=getattr(settings, 'CHAT_READ_FLUSH_DELAY', 0.5),
+            )
+        return _coalescer
+
+
+@atexit.register
+def _flush_reads_on_exit():
+    if _coalescer is not None:
+        _coalescer.drain_sync()
@@ -0,0 +1,102 @@
+# chat/recent.py - Per-room ring buffer of recent messages for reconnect replay
+import bisect
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def message_fields(message):
+    """Wire fields for a chat_message event (sender should be loaded)"""
+    return {
+        'room_id': message.room_id,
+        'message_id': message.id,
+        'content': message.encrypted_content,
+        'sender_id': message.sender_id,
+        'sender_username': message.sender.username,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+class _Ring:
+    __slots__ = ('floor', 'ids', 'messages')
+
+    def __init__(self, floor):
+        self.floor = floor      # every message in the room with id > floor is held
+        self.ids = []
+        self.messages = []
+
+
+class RecentMessageBuffer:
+    """
+    Keeps the last few messages of each active room in memory.
+
+    A room's ring starts when its first message is saved in this process
+    and records every later one, so it can answer "everything after id X"
+    exactly as long as X is at or above the ring's floor. Older cursors,
+    and rooms without a ring, fall back to the database. Messages saved by
+    other processes never reach the ring, so it is off (per_room=0) unless
+    a single process writes messages.
+    """
+
+    def __init__(self, per_room=0, max_rooms=5000):
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, messages):
+        if self.per_room <= 0:
+            return
+        with self._lock:
+            for message in messages:
+                fields = message_fields(message)
+                room_id = fields['room_id']
+                ring = self._rooms.get(room_id)
+                if ring is None:
+                    ring = self._rooms[room_id] = _Ring(fields['message_id'] - 1)
+                    while len(self._rooms) > self.max_rooms:
+                        self._rooms.popitem(last=False)
+                self._rooms.move_to_end(room_id)
+
+                if fields['message_id'] <= ring.floor:
+                    continue
+                # Concurrent writers can commit out of id order
+                index = bisect.bisect(ring.ids, fields['message_id'])
+                ring.ids.insert(index, fields['message_id'])
+                ring.messages.insert(index, fields)
+                if len(ring.ids) > self.per_room:
+                    ring.floor = ring.ids.pop(0)
+                    ring.messages.pop(0)
+
+    def since(self, room_id, since_id, limit):
+        """Up to limit messages after since_id, or None if the ring can't prove completeness"""
+        with self._lock:
+            ring = self._rooms.get(room_id)
+            if ring is None or since_id < ring.floor:
+                self.misses += 1
+                return None
+            self.hits += 1
+            start = bisect.bisect(ring.ids, since_id)
+            return list(ring.messages[start:start + limit])
+
+    def forget_room(self, room_id):
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'messages': sum(len(ring.ids) for ring in self._rooms.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+recent_messages = RecentMessageBuffer(
+    per_room=getattr(settings, 'CHAT_RECENT_MESSAGES_PER_ROOM', 0),
+    max_rooms=getattr(settings, 'CHAT_RECENT_ROOMS_MAX', 5000),
+)
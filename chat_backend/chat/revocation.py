@@ -0,0 +1,224 @@
+# chat/revocation.py - In-memory index of revoked JWTs for WebSocket handshakes
+import hashlib
+import logging
+import math
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size bit array sized for a capacity and a target false-positive rate"""
+
+    def __init__(self, capacity, fp_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def expected_fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class RevocationIndex:
+    """
+    Revoked token ids (jti) mirrored from simplejwt's blacklist.
+
+    A bloom filter answers the common "not revoked" case without touching
+    the exact map; only filter positives consult it. Loaded from the
+    database at startup (see asgi.py), updated in-process when a token is
+    blacklisted (see chat/signals.py), and topped up with rows blacklisted
+    by other processes from a background thread every sync interval, so
+    handshakes never wait on a sync. Expired entries are dropped when the
+    filter is rebuilt.
+
+    Row ids are assigned before commit, so a row can become visible after
+    one with a higher id was synced. Ids skipped below the watermark are
+    kept as gaps and queried again on every sync until the row shows up
+    or gap_timeout passes (the transaction rolled back).
+    """
+
+    max_gaps = 1000  # Only ids this close below the newest synced id are tracked
+
+    def __init__(self, capacity=100000, fp_rate=0.01, sync_interval=5, gap_timeout=60):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.sync_interval = sync_interval
+        self.gap_timeout = gap_timeout
+        self._lock = threading.Lock()
+        self._revoked = {}      # jti -> expiry (epoch seconds)
+        self._filter = BloomFilter(capacity, fp_rate)
+        self._last_id = 0
+        self._gaps = {}         # skipped row id -> monotonic time first seen missing
+        self._syncer = None
+        self._stopped = threading.Event()
+        self.loaded = False
+        self.checks = 0
+        self.filter_positives = 0
+        self.false_positives = 0
+        self.syncs = 0
+
+    def start_background_sync(self):
+        """Load the index now and keep pulling new revocations from a daemon thread"""
+        with self._lock:
+            if self._syncer is not None:
+                return
+            self._stopped.clear()
+            self._syncer = threading.Thread(target=self._run, name='revocation-sync', daemon=True)
+        try:
+            self.sync()
+        except Exception as e:
+            # Handshakes load the index themselves until a sync succeeds
+            logger.error(f"Error loading the revocation index: {e}")
+        self._syncer.start()
+
+    def stop_background_sync(self):
+        with self._lock:
+            syncer, self._syncer = self._syncer, None
+        if syncer is not None:
+            self._stopped.set()
+            syncer.join()
+
+    def sync(self):
+        """Pull blacklist rows added since the last sync (everything on first load), and late gaps"""
+        with self._lock:
+            last_id = self._last_id
+            gaps = list(self._gaps)
+        rows = BlacklistedToken.objects.filter(Q(id__gt=last_id) | Q(id__in=gaps))
+        if not self.loaded:
+            # Skip the backlog of expired tokens the blacklist may still hold
+            rows = rows.filter(token__expires_at__gt=timezone.now())
+        rows = list(rows.order_by('id').values_list('id', 'token__jti', 'token__expires_at'))
+
+        with self._lock:
+            seen = set()
+            for row_id, jti, expires_at in rows:
+                self._add(jti, expires_at.timestamp())
+                self._gaps.pop(row_id, None)
+                seen.add(row_id)
+            now = time.monotonic()
+            newest = max(seen, default=last_id)
+            for missing in range(max(last_id, newest - self.max_gaps) + 1, newest):
+                if missing not in seen:
+                    self._gaps.setdefault(missing, now)
+            self._gaps = {row_id: since for row_id, since in self._gaps.items() if now - since < self.gap_timeout}
+            self._last_id = max(self._last_id, newest)
+            self.syncs += 1
+            if not self.loaded:
+                self.loaded = True
+                logger.info(f"Loaded {len(self._revoked)} revoked tokens into the revocation index")
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._add(jti, expires_at)
+
+    def is_revoked(self, jti):
+        with self._lock:
+            self.checks += 1
+            if jti not in self._filter:
+                return False
+            self.filter_positives += 1
+            if jti in self._revoked:
+                return True
+            self.false_positives += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'revoked': len(self._revoked),
+                'filter_bits': self._filter.size,
+                'filter_hashes': self._filter.hashes,
+                'memory_bytes': sys.getsizeof(self._filter.bits) + sys.getsizeof(self._revoked)
+                                + sum(sys.getsizeof(jti) for jti in self._revoked),
+                'expected_fp_rate': round(self._filter.expected_fp_rate(), 6),
+                'observed_fp_rate': round(self.false_positives / self.checks, 6) if self.checks else 0.0,
+                'checks': self.checks,
+                'filter_positives': self.filter_positives,
+                'syncs': self.syncs,
+                'pending_gaps': len(self._gaps),
+            }
+
+    def _run(self):
+        while not self._stopped.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing the revocation index: {e}")
+            finally:
+                close_old_connections()
+
+    def _add(self, jti, expires_at):
+        if jti in self._revoked or expires_at <= time.time():
+            return
+        if self._filter.count >= self.capacity:
+            self._rebuild()
+        self._revoked[jti] = expires_at
+        self._filter.add(jti)
+
+    def _rebuild(self):
+        now = time.time()
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        # Grow instead of thrashing when most entries are still live
+        self.capacity = max(self.capacity, 2 * len(self._revoked))
+        self._filter = BloomFilter(self.capacity, self.fp_rate)
+        for jti in self._revoked:
+            self._filter.add(jti)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_revocation_index():
+    """Return the process-wide revocation index"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RevocationIndex(
+                capacity=getattr(settings, 'CHAT_REVOCATION_CAPACITY', 100000),
+                fp_rate=getattr(settings, 'CHAT_REVOCATION_FP_RATE', 0.01),
+                sync_interval=getattr(settings, 'CHAT_REVOCATION_SYNC_INTERVAL', 5),
+                gap_timeout=getattr(settings, 'CHAT_REVOCATION_GAP_TIMEOUT', 60),
+            )
+        return _index
+
+
+def revoke_token(token, user=None):
+    """Blacklist any simplejwt token (access or refresh) by its jti"""
+    jti = token[api_settings.JTI_CLAIM]
+    outstanding, _ = OutstandingToken.objects.get_or_create(
+        jti=jti,
+        defaults={
+            'user': user,
+            'token': str(token),
+            'created_at': token.current_time,
+            'expires_at': datetime_from_epoch(token['exp']),
+        },
+    )
+    return BlacklistedToken.objects.get_or_create(token=outstanding)[0]
@@ -0,0 +1,32 @@
+# chat/rooms.py - Direct (1:1) room lookup
+from django.db import IntegrityError, transaction
+
+from .models import ChatRoom
+
+
+def direct_pair(user_id, other_id):
+    """Canonical (low, high) key for a pair of users"""
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+
+def get_or_create_direct_room(user, other):
+    """
+    Return (room, created) for the 1:1 room between two users.
+
+    One lookup on the unique pair key. Under concurrent requests the
+    unique constraint lets exactly one insert win; the others catch the
+    IntegrityError and read the winner's room, which already has both
+    participants because it was committed in the same transaction.
+    """
+    low, high = direct_pair(user.id, other.id)
+    room = ChatRoom.objects.filter(direct_user_low=low, direct_user_high=high).first()
+    if room is not None:
+        return room, False
+
+    try:
+        with transaction.atomic():
+            room = ChatRoom.objects.create(direct_user_low=low, direct_user_high=high)
+            room.participants.add(user, other)
+        return room, True
+    except IntegrityError:
+        return ChatRoom.objects.get(direct_user_low=low, direct_user_high=high), False
@@ -3,5 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/multiplex/$', consumers.MultiplexChatConsumer.as_asgi()),
     re_path(r'ws/status/$', consumers.UserStatusConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,26 +1,44 @@
 # chat/serializers.py - Serializers for Client-Side Encryption
 from rest_framework import serializers
-from .models import ChatRoom, Message
+from .membership import is_room_member
+from .models import ChatRoom, InboxSummary, Message
+from .read_state import unread_count
 from accounts.serializers import UserSerializer
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
+    is_read = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ('id', 'sender', 'encrypted_content', 'timestamp', 'is_read')
         read_only_fields = ('id', 'sender', 'timestamp')
     
-    def to_representation(self, instance):
-        """
-        Return the encrypted content directly - client will decrypt it
-        """
-        data = super().to_representation(instance)
-        # Log for debugging (don't log full encrypted content for security)
-        if instance.encrypted_content:
-            content_preview = instance.encrypted_content[:50] + "..." if len(instance.encrypted_content) > 50 else instance.encrypted_content
-            print(f"API serving encrypted message {instance.id}: {content_preview}")
-        return data
+    def get_is_read(self, obj):
+        """Read by at least one participant other than the sender"""
+        watermarks = self.context.get('read_watermarks')
+        if watermarks is None:
+            return obj.is_read
+        return any(
+            watermark >= obj.id
+            for user_id, watermark in watermarks.items()
+            if user_id != obj.sender_id
+        )
+
+class CompactMessageSerializer(MessageSerializer):
+    """Message that references its sender by id; pair with users_table()"""
+    sender_id = serializers.IntegerField(read_only=True)
+    
+    class Meta(MessageSerializer.Meta):
+        fields = ('id', 'sender_id', 'encrypted_content', 'timestamp', 'is_read')
+
+def users_table(messages, context=None):
+    """Each distinct sender of the messages once, keyed by id"""
+    senders = {message.sender_id: message.sender for message in messages}
+    return {
+        str(user_id): UserSerializer(user, context=context).data
+        for user_id, user in senders.items()
+    }
 
 class ChatRoomSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
@@ -33,9 +51,38 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         fields = ('id', 'participants', 'last_message', 'unread_count', 'encryption_info', 'created_at', 'updated_at')
         read_only_fields = ('id', 'created_at', 'updated_at')
     
+    @staticmethod
+    def load_inbox(user):
+        """
+        Rooms for the user's room list, newest activity first.
+
+        Reads the user's InboxSummary rows in one indexed scan, then loads
+        participants and last messages with one query each, so the number
+        of queries doesn't grow with the number of rooms.
+        """
+        summaries = list(
+            InboxSummary.objects.filter(user=user)
+            .select_related('room')
+            .prefetch_related('room__participants')
+            .order_by('-last_activity_at')
+        )
+        last_messages = Message.objects.select_related('sender').in_bulk(
+            [summary.last_message_id for summary in summaries if summary.last_message_id]
+        )
+        rooms = []
+        for summary in summaries:
+            room = summary.room
+            room.unread_count = summary.unread_count
+            room.latest_message = last_messages.get(summary.last_message_id)
+            rooms.append(room)
+        return rooms
+    
     def get_last_message(self, obj):
         """Get the last message (encrypted) for the room"""
-        last_message = obj.messages.last()
+        if hasattr(obj, 'latest_message'):
+            last_message = obj.latest_message
+        else:
+            last_message = obj.messages.order_by('id').select_related('sender').last()
         if last_message:
             return {
                 'id': last_message.id,
@@ -49,9 +96,11 @@ class ChatRoomSerializer(serializers.ModelSerializer):
     
     def get_unread_count(self, obj):
         """Get count of unread messages for the current user"""
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+            return unread_count(obj.id, request.user.id)
         return 0
     
     def get_encryption_info(self, obj):
@@ -65,20 +114,10 @@ class ChatRoomSerializer(serializers.ModelSerializer):
             'note': 'Messages encrypted in browser before transmission'
         }
 
-class SendMessageSerializer(serializers.Serializer):
+class EncryptedContentSerializer(serializers.Serializer):
     room_id = serializers.IntegerField()
     encrypted_content = serializers.CharField(max_length=10000)  # Allow larger encrypted content
     
-    def validate_room_id(self, value):
-        """Validate that the room exists and user has access"""
-        try:
-            room = ChatRoom.objects.get(id=value)
-            if not room.participants.filter(id=self.context['request'].user.id).exists():
-                raise serializers.ValidationError("You are not a participant in this chat room")
-            return value
-        except ChatRoom.DoesNotExist:
-            raise serializers.ValidationError("Chat room does not exist")
-    
     def validate_encrypted_content(self, value):
         """Basic validation of encrypted content"""
         if not value or not value.strip():
@@ -91,6 +130,19 @@ class SendMessageSerializer(serializers.Serializer):
         
         return value.strip()
 
+class SendMessageSerializer(EncryptedContentSerializer):
+    def validate_room_id(self, value):
+        """Validate that the room exists and user has access"""
+        if is_room_member(value, self.context['request'].user.id):
+            return value
+        if ChatRoom.objects.filter(id=value).exists():
+            raise serializers.ValidationError("You are not a participant in this chat room")
+        raise serializers.ValidationError("Chat room does not exist")
+
+class BatchMessageItemSerializer(EncryptedContentSerializer):
+    """One message of a batch; membership is checked by the view, once per room"""
+    client_id = serializers.CharField(max_length=64, required=False)  # echoed back for outbox matching
+
 class CreateRoomSerializer(serializers.Serializer):
     participant_id = serializers.IntegerField()
     
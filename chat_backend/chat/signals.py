@@ -0,0 +1,133 @@
+# chat/signals.py - Keep in-process chat caches in sync with the database
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import Friendship, UserKeys
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .inbox import add_participants, add_rooms
+from .membership import membership_cache
+from .middleware import user_cache
+from .models import ChatRoom, InboxSummary
+from .recent import recent_messages
+from .revocation import get_revocation_index
+from .versions import FRIENDS, INBOX, PROFILE, bump, bump_rooms, bump_users
+
+User = get_user_model()
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def invalidate_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop cached membership answers when participants are added or removed.
+
+    Entries are dropped right away and again once the change commits: a
+    reader in another thread can cache the old answer in between.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if action == 'post_clear':
+        if reverse:
+            def invalidate():
+                membership_cache.invalidate_user(instance.pk)
+        else:
+            def invalidate():
+                membership_cache.invalidate_room(instance.pk)
+    else:
+        # user.chat_rooms.add(room): instance is the user, pk_set holds rooms
+        keys = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set or ()]
+
+        def invalidate():
+            for room_id, user_id in keys:
+                membership_cache.invalidate(room_id, user_id)
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def sync_inbox_summaries(sender, instance, action, reverse, pk_set, **kwargs):
+    """Give joining participants an inbox row and drop the rows of those who leave"""
+    if action == 'post_add' and pk_set:
+        if reverse:
+            add_rooms(instance.pk, pk_set)
+        else:
+            add_participants(instance.pk, pk_set)
+    elif action == 'post_remove' and pk_set:
+        if reverse:
+            InboxSummary.objects.filter(user_id=instance.pk, room_id__in=pk_set).delete()
+        else:
+            InboxSummary.objects.filter(room_id=instance.pk, user_id__in=pk_set).delete()
+    elif action == 'post_clear':
+        if reverse:
+            InboxSummary.objects.filter(user_id=instance.pk).delete()
+        else:
+            InboxSummary.objects.filter(room_id=instance.pk).delete()
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def invalidate_room_versions(sender, instance, action, reverse, pk_set, **kwargs):
+    """Membership changes alter the room lists and pages of everyone involved"""
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+
+    if reverse:
+        user_ids = {instance.pk}
+        room_ids = set(pk_set or ()) or set(instance.chat_rooms.values_list('pk', flat=True))
+    else:
+        room_ids = {instance.pk}
+        user_ids = set(pk_set or ()) or set(instance.participants.values_list('pk', flat=True))
+
+    def invalidate():
+        bump(INBOX, user_ids)  # members who just left are no longer found by bump_rooms
+        bump_rooms(room_ids)
+    transaction.on_commit(invalidate)
+
+
+# Fields of a user that room lists, message pages and friends lists show
+PUBLIC_USER_FIELDS = frozenset({'username', 'email', 'is_online', 'last_seen'})
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_versions(sender, instance, created, update_fields, **kwargs):
+    # Saves that only touch private fields (last_login on every login, password) change nothing shown
+    if created or (update_fields is not None and not PUBLIC_USER_FIELDS & set(update_fields)):
+        return
+    transaction.on_commit(lambda: bump_users([instance.pk]))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_snapshot(sender, instance, **kwargs):
+    """WebSocket handshakes must not authenticate as a stale or deleted user"""
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def index_revoked_token(sender, instance, created, **kwargs):
+    """Reject a blacklisted token on this process's next handshake, not the next sync"""
+    if created:
+        token = instance.token
+        transaction.on_commit(lambda: get_revocation_index().add(token.jti, token.expires_at.timestamp()))
+
+
+@receiver(post_save, sender=UserKeys)
+def invalidate_public_key(sender, instance, **kwargs):
+    """Public keys appear only on profiles and the public-key endpoint"""
+    transaction.on_commit(lambda: bump(PROFILE, [instance.user_id]))
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def invalidate_friends_version(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump(FRIENDS, [instance.user_id]))
+
+
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_deleted_room(sender, instance, **kwargs):
+    membership_cache.invalidate_room(instance.pk)
+    transaction.on_commit(lambda: membership_cache.invalidate_room(instance.pk))
+    recent_messages.forget_room(instance.pk)
@@ -1,3 +1,1282 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from accounts.serializers import UserSerializer
+
+from .consumers import ChatConsumer, room_group_name
+from .export import export_room, export_rows
+from .fanout import wire_event
+from .inbox import record_messages, verify_summaries
+from .middleware import JwtAuthMiddleware, token_cache, user_cache
+from .membership import is_room_member, membership_cache
+from .models import ChatRoom, Message
+from .outbound import SLOW_CONSUMER_CLOSE_CODE, BoundedSendMixin
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, message_page, page_size
+from .persistence import MessageWriteBuffer, persist_messages
+from .presence import InMemoryPresenceBackend, PresenceService, persist_presence
+from .protocol import (
+    BINARY_SUBPROTOCOL, CHAT_MESSAGE, MAX_CIPHERTEXT, TYPING, VERSION, ProtocolError, encode_server_frame, parse_client_frame,
+    parse_server_frame,
+)
+from .read_state import (
+    ReadWatermarkCoalescer, advance_read_watermark, apply_read_watermarks, get_read_watermark, unread_count,
+)
+from .recent import RecentMessageBuffer, message_fields
+from .revocation import RevocationIndex, get_revocation_index
+from .routing import websocket_urlpatterns
+from .rooms import get_or_create_direct_room
+from .serializers import ChatRoomSerializer, CompactMessageSerializer, users_table
+from .typing_indicators import TypingTracker
+
+User = get_user_model()
+
+
+class BinaryProtocolTests(SimpleTestCase):
+    """Binary frames round-trip and malformed ones are rejected, never half-parsed"""
+
+    message = {
+        'room_id': 2 ** 40,
+        'message_id': 2 ** 33 + 7,
+        'sender_id': 42,
+        'sender_username': 'zoë',
+        'content': 'AAEC/w==',
+        'timestamp': '2026-01-02T03:04:05.678000+00:00',
+    }
+
+    def test_chat_message_round_trip(self):
+        frame = parse_server_frame(encode_server_frame('chat_message', self.message))
+        self.assertEqual(frame['room_id'], 2 ** 40)
+        self.assertEqual(frame['message_id'], 2 ** 33 + 7)
+        self.assertEqual(frame['sender_username'], 'zoë')
+        self.assertEqual(bytes(frame['ciphertext']), b'\x00\x01\x02\xff')
+        self.assertEqual(frame['timestamp'].isoformat(), self.message['timestamp'])
+
+    def test_typing_round_trip(self):
+        fields = {'room_id': 9, 'user_id': 3, 'username': 'bob', 'is_typing': True}
+        frame = parse_server_frame(encode_server_frame('typing_indicator', fields))
+        self.assertEqual(frame, {'type': 'typing_indicator', **fields})
+
+    def test_client_frames(self):
+        header = bytes([VERSION, CHAT_MESSAGE])
+        data = parse_client_frame(header + (2 ** 40).to_bytes(8, 'big') + b'\x00\xff')
+        self.assertEqual(data, {'type': 'chat_message', 'room_id': 2 ** 40, 'content': 'AP8='})
+        typing = parse_client_frame(bytes([VERSION, TYPING]) + (5).to_bytes(8, 'big') + b'\x01')
+        self.assertEqual(typing, {'type': 'typing', 'room_id': 5, 'is_typing': True})
+
+    def test_malformed_client_frames(self):
+        room = (1).to_bytes(8, 'big')
+        for frame in (
+            b'\x01',                                           # truncated header
+            bytes([VERSION, TYPING]) + room[:5],               # truncated body
+            bytes([VERSION, 0x7f]) + room,                     # unknown opcode
+            bytes([VERSION + 1, CHAT_MESSAGE]) + room,         # unknown version
+            bytes([VERSION, CHAT_MESSAGE]) + room + bytes(MAX_CIPHERTEXT + 1),  # oversized
+        ):
+            with self.subTest(frame=frame[:12]):
+                with self.assertRaises(ProtocolError):
+                    parse_client_frame(frame)
+
+    def test_malformed_server_frames(self):
+        frame = encode_server_frame('chat_message', self.message)
+        with self.assertRaises(ProtocolError):
+            parse_server_frame(frame[:10])
+        # A name length that runs past the end of the frame
+        header_size = 2 + 8 + 8 + 8 + 8
+        oversized = frame[:header_size] + (1000).to_bytes(2, 'big') + frame[header_size + 2:]
+        with self.assertRaises(ProtocolError):
+            parse_server_frame(oversized)
+
+    def test_fields_that_do_not_fit_fall_back_to_text(self):
+        self.assertIsNone(encode_server_frame('chat_message', dict(self.message, room_id=2 ** 64)))
+        with override_settings(CHAT_BINARY_PROTOCOL=True):
+            event = wire_event('chat_message', **dict(self.message, room_id=2 ** 64))
+        self.assertNotIn('bytes', event)
+        self.assertIn('text', event)
+
+    def test_binary_frames_are_only_encoded_when_enabled(self):
+        self.assertNotIn('bytes', wire_event('chat_message', **self.message))
+        with override_settings(CHAT_BINARY_PROTOCOL=True):
+            self.assertIn('bytes', wire_event('chat_message', **self.message))
+
+
+class RecordingSocket:
+    """Stands in for the consumer base class: records writes and the close code"""
+
+    channel_name = 'test.recording'
+
+    def __init__(self):
+        self.written = []
+        self.close_code = None
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        self.written.append(text_data)
+
+    async def close(self, code=None):
+        self.close_code = code
+
+
+class RecordingConnection(BoundedSendMixin, RecordingSocket):
+    pass
+
+
+@override_settings(CHAT_SEND_QUEUE_DROP_THRESHOLD=3, CHAT_SEND_QUEUE_MAX=5)
+class SlowReaderTests(SimpleTestCase):
+    """Frames the client hasn't acknowledged count towards its backlog"""
+
+    def run_connection(self, steps):
+        async def run():
+            connection = RecordingConnection()
+            for step in steps:
+                await step(connection)
+                await asyncio.sleep(0)  # let the writer task drain the queue
+            return connection
+
+        return async_to_sync(run)()
+
+    @staticmethod
+    def chat(message_id):
+        async def step(connection):
+            await connection.enqueue_frame(text_data=f'chat {message_id}', message_id=message_id)
+        return step
+
+    @staticmethod
+    def typing(connection):
+        return connection.enqueue_frame(text_data='typing', droppable=True)
+
+    @staticmethod
+    def ack(message_id):
+        async def step(connection):
+            connection.record_ack(message_id)
+        return step
+
+    def test_unacknowledged_frames_drop_typing_then_evict(self):
+        connection = self.run_connection([
+            self.chat(1), self.ack(1),
+            self.chat(2), self.chat(3), self.chat(4),
+            self.typing,
+            self.chat(5), self.chat(6),
+            self.chat(7),
+        ])
+        self.assertNotIn('typing', connection.written)
+        self.assertEqual(connection.written, [f'chat {i}' for i in range(1, 7)])
+        self.assertEqual(connection.close_code, SLOW_CONSUMER_CLOSE_CODE)
+        self.assertTrue(connection.evicted)
+
+    def test_acks_keep_a_reader_connected(self):
+        steps = [self.chat(1), self.ack(1)]
+        for message_id in range(2, 20):
+            steps += [self.chat(message_id), self.ack(message_id), self.typing]
+        connection = self.run_connection(steps)
+        self.assertIsNone(connection.close_code)
+        self.assertEqual(connection.frames_dropped, 0)
+        self.assertEqual(connection.send_backlog, 0)
+
+    def test_clients_that_never_ack_are_bounded_by_the_queue_only(self):
+        connection = self.run_connection([self.chat(i) for i in range(1, 20)] + [self.typing])
+        self.assertIsNone(connection.close_code)
+        self.assertEqual(len(connection.written), 20)
+
+
+class TypingTrackerTests(SimpleTestCase):
+    """Only typing transitions go out, counted per connection"""
+
+    def run_tracker(self, scenario, **options):
+        async def run():
+            tracker = TypingTracker(**options)
+            idle = []
+            result = await scenario(tracker, lambda channel: idle.append(channel))
+            return tracker, idle, result
+
+        return async_to_sync(run)()
+
+    def test_repeats_inside_the_window_are_suppressed(self):
+        async def scenario(tracker, on_idle):
+            sent = [tracker.start('key', 'tab', on_idle), tracker.start('key', 'tab', on_idle)]
+            await asyncio.sleep(0.06)
+            sent.append(tracker.start('key', 'tab', on_idle))  # refresh after the window
+            sent.append(tracker.stop('key', 'tab'))
+            sent.append(tracker.stop('key', 'tab'))
+            return sent
+
+        tracker, _, sent = self.run_tracker(scenario, repeat_window=0.05, idle_timeout=5)
+        self.assertEqual(sent, [True, False, True, True, False])
+        self.assertEqual(tracker.stats()['suppressed'], 2)
+
+    def test_idle_connection_is_stopped_automatically(self):
+        async def scenario(tracker, on_idle):
+            tracker.start('key', 'tab', on_idle)
+            await asyncio.sleep(0.1)
+
+        tracker, idle, _ = self.run_tracker(scenario, idle_timeout=0.03)
+        self.assertEqual(idle, ['tab'])
+        self.assertEqual(tracker.stats()['auto_stops'], 1)
+        self.assertEqual(tracker.stats()['typing_now'], 0)
+
+    def test_user_keeps_typing_while_another_tab_does(self):
+        async def scenario(tracker, on_idle):
+            return [
+                tracker.start('key', 'tab-a', on_idle),
+                tracker.start('key', 'tab-b', on_idle),
+                tracker.clear('key', 'tab-a'),   # tab A closes mid-sentence
+                tracker.stop('key', 'tab-b'),
+            ]
+
+        _, _, sent = self.run_tracker(scenario, idle_timeout=5)
+        self.assertEqual(sent, [True, False, False, True])
+
+    def test_idle_tab_does_not_stop_a_typing_tab(self):
+        async def scenario(tracker, on_idle):
+            tracker.start('key', 'tab-a', on_idle)
+            await asyncio.sleep(0.02)
+            tracker.start('key', 'tab-b', on_idle)
+            await asyncio.sleep(0.04)   # tab A has gone idle, tab B hasn't
+            typing_now = tracker.stats()['typing_now']
+            await asyncio.sleep(0.05)
+            return typing_now
+
+        _, idle, typing_now = self.run_tracker(scenario, idle_timeout=0.05)
+        self.assertEqual(typing_now, 1)
+        self.assertEqual(idle, ['tab-b'])
+
+
+class ConsumerTestCase(TransactionTestCase):
+    """Drives the WebSocket routes with an already authenticated scope"""
+
+    application = URLRouter(websocket_urlpatterns)
+
+    def setUp(self):
+        cache.clear()  # membership answers from a previous test's room ids
+        # Private presence and typing state; the long interval keeps status frames out
+        self.presence = PresenceService(InMemoryPresenceBackend(), flush_interval=3600, ttl=60)
+        self.typing = TypingTracker()
+        for target, service in (
+            ('chat.consumers.get_presence_service', self.presence),
+            ('chat.consumers.get_typing_tracker', self.typing),
+        ):
+            patcher = mock.patch(target, return_value=service)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def open(self, path, user, subprotocols=None):
+        communicator = WebsocketCommunicator(self.application, path, subprotocols=subprotocols)
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def close(self, *communicators):
+        for communicator in communicators:
+            await communicator.disconnect()
+        await self.presence.shutdown()
+
+    async def assertNoFrame(self, communicator, timeout=0.2):
+        # receive_nothing() leaves the application running; a timed out receive cancels it
+        self.assertTrue(await communicator.receive_nothing(timeout))
+
+
+class TypingFanoutTests(ConsumerTestCase):
+    """Typing reaches the other participants, never the connection that typed"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(email='alice@example.com', username='alice', password='pw')
+        self.bob = User.objects.create_user(email='bob@example.com', username='bob', password='pw')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.alice, self.bob)
+        self.path = f'/ws/chat/{self.room.id}/'
+
+    async def test_sender_gets_no_echo_and_other_tab_keeps_typing(self):
+        tab_a, tab_b = await self.open(self.path, self.alice), await self.open(self.path, self.alice)
+        bob = await self.open(self.path, self.bob)
+
+        await tab_a.send_json_to({'type': 'typing', 'is_typing': True})
+        frame = await bob.receive_json_from()
+        self.assertEqual((frame['type'], frame['user_id'], frame['is_typing']), ('typing_indicator', self.alice.id, True))
+        await self.assertNoFrame(tab_a)
+
+        await tab_b.send_json_to({'type': 'typing', 'is_typing': True})
+        await tab_a.disconnect()
+        await self.assertNoFrame(bob)  # tab B is still typing
+
+        await tab_b.send_json_to({'type': 'typing', 'is_typing': False})
+        frame = await bob.receive_json_from()
+        self.assertEqual((frame['type'], frame['is_typing']), ('typing_indicator', False))
+        await self.close(tab_b, bob)
+
+
+class BinaryFrameConsumerTests(ConsumerTestCase):
+    """Binary frames are only parsed on connections that negotiated them"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='bin@example.com', username='bin', password='pw')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.user)
+        self.path = f'/ws/chat/{self.room.id}/'
+        self.frame = bytes([VERSION, CHAT_MESSAGE]) + self.room.id.to_bytes(8, 'big') + b'\x00\xff'
+
+    async def saved(self):
+        return await database_sync_to_async(list)(Message.objects.values_list('encrypted_content', flat=True))
+
+    async def test_binary_frame_on_json_connection_is_ignored(self):
+        with self.settings(CHAT_BINARY_PROTOCOL=True):
+            communicator = await self.open(self.path, self.user)  # no subprotocol offered
+            await communicator.send_to(bytes_data=self.frame)
+            await self.assertNoFrame(communicator)
+        self.assertEqual(await self.saved(), [])
+        await self.close(communicator)
+
+    async def test_binary_frame_on_negotiated_connection_is_saved(self):
+        with self.settings(CHAT_BINARY_PROTOCOL=True):
+            communicator = await self.open(self.path, self.user, [BINARY_SUBPROTOCOL])
+            await communicator.send_to(bytes_data=self.frame)
+            self.assertEqual(bytes(parse_server_frame(await communicator.receive_from())['ciphertext']), b'\x00\xff')
+        self.assertEqual(await self.saved(), ['AP8='])
+        await self.close(communicator)
+
+
+class MultiplexConsumerTests(ConsumerTestCase):
+    """Room subscriptions over one multiplexed connection"""
+
+    path = '/ws/multiplex/'
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(email='alice@example.com', username='alice', password='pw')
+        self.bob = User.objects.create_user(email='bob@example.com', username='bob', password='pw')
+        self.carol = User.objects.create_user(email='carol@example.com', username='carol', password='pw')
+        self.shared = ChatRoom.objects.create()
+        self.shared.participants.add(self.alice, self.bob)
+        self.other = ChatRoom.objects.create()
+        self.other.participants.add(self.alice, self.bob)
+        self.private = ChatRoom.objects.create()
+        self.private.participants.add(self.bob, self.carol)
+
+    async def subscribe(self, communicator, room):
+        await communicator.send_json_to({'type': 'subscribe', 'room_id': room.id})
+        return await communicator.receive_json_from()
+
+    async def test_non_member_cannot_subscribe(self):
+        alice = await self.open(self.path, self.alice)
+
+        frame = await self.subscribe(alice, self.private)
+        self.assertEqual(frame, {'type': 'error', 'room_id': self.private.id, 'error': 'Chat room not found or access denied'})
+
+        await alice.send_json_to({'type': 'chat_message', 'room_id': self.private.id, 'content': 'ciphertext'})
+        frame = await alice.receive_json_from()
+        self.assertEqual(frame['error'], 'Not subscribed to this room')
+        self.assertFalse(await database_sync_to_async(Message.objects.exists)())
+        await self.close(alice)
+
+    async def test_subscription_limit(self):
+        alice = await self.open(self.path, self.alice)
+
+        with self.settings(CHAT_MULTIPLEX_MAX_ROOMS=1):
+            self.assertEqual(await self.subscribe(alice, self.shared), {'type': 'subscribed', 'room_id': self.shared.id})
+            self.assertEqual(await self.subscribe(alice, self.shared), {'type': 'subscribed', 'room_id': self.shared.id})
+            frame = await self.subscribe(alice, self.other)
+        self.assertEqual(frame, {'type': 'error', 'room_id': self.other.id, 'error': 'Subscription limit of 1 rooms reached'})
+        await self.close(alice)
+
+    async def test_unsubscribe_and_frames_for_unsubscribed_rooms(self):
+        alice = await self.open(self.path, self.alice)
+        await self.subscribe(alice, self.shared)
+
+        await alice.send_json_to({'type': 'unsubscribe', 'room_id': self.shared.id})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'unsubscribed', 'room_id': self.shared.id})
+        self.assertEqual(self.presence._rooms[self.alice.id], {})
+
+        for frame in (
+            {'type': 'typing', 'room_id': self.shared.id, 'is_typing': True},
+            {'type': 'read_message', 'room_id': self.other.id, 'message_id': 1},
+        ):
+            await alice.send_json_to(frame)
+            error = await alice.receive_json_from()
+            self.assertEqual(error, {'type': 'error', 'room_id': frame['room_id'], 'error': 'Not subscribed to this room'})
+
+        await alice.send_json_to({'type': 'typing', 'room_id': 'lobby'})
+        self.assertEqual((await alice.receive_json_from())['error'], 'A valid room_id is required')
+        await self.close(alice)
+
+    async def test_messages_reach_subscribed_rooms_only(self):
+        alice = await self.open(self.path, self.alice)
+        bob = await self.open(self.path, self.bob)
+        await self.subscribe(alice, self.shared)
+        await self.subscribe(alice, self.other)
+        await self.subscribe(bob, self.shared)
+
+        for room in (self.other, self.shared):
+            await alice.send_json_to({'type': 'chat_message', 'room_id': room.id, 'content': f'ciphertext {room.id}'})
+
+        frame = await bob.receive_json_from()
+        self.assertEqual((frame['type'], frame['room_id'], frame['content']), ('chat_message', self.shared.id, f'ciphertext {self.shared.id}'))
+        await self.assertNoFrame(bob)
+
+        received = {(await alice.receive_json_from())['room_id'] for _ in range(2)}
+        self.assertEqual(received, {self.shared.id, self.other.id})
+        await self.close(alice, bob)
+
+    async def test_disconnect_clears_presence_and_typing(self):
+        alice = await self.open(self.path, self.alice)
+        bob = await self.open(self.path, self.bob)
+        await self.subscribe(alice, self.shared)
+        await self.subscribe(alice, self.other)
+        await self.subscribe(bob, self.shared)
+
+        await alice.send_json_to({'type': 'typing', 'room_id': self.shared.id, 'is_typing': True})
+        self.assertTrue((await bob.receive_json_from())['is_typing'])
+
+        await alice.disconnect()
+        frame = await bob.receive_json_from()
+        self.assertEqual((frame['type'], frame['user_id'], frame['is_typing']), ('typing_indicator', self.alice.id, False))
+        self.assertEqual(self.typing.stats()['typing_now'], 0)
+        self.assertNotIn(self.alice.id, self.presence._local)
+        self.assertNotIn(self.alice.id, self.presence._rooms)
+        self.assertEqual(self.presence._last_rooms[self.alice.id], {self.shared.id, self.other.id})
+        await self.close(bob)
+
+
+class RecentMessageBufferTests(TestCase):
+    """The ring only answers for cursors it can prove complete"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='ring@example.com', username='ring', password='pw')
+        self.room = ChatRoom.objects.create()
+        self.messages = persist_messages([(self.room.id, self.user, f'ciphertext {i}') for i in range(5)])
+        self.ids = [message.id for message in self.messages]
+
+    def test_floor_starts_below_the_first_recorded_message(self):
+        ring = RecentMessageBuffer(per_room=10)
+        ring.record(self.messages[2:])
+
+        replay = ring.since(self.room.id, self.ids[1], 10)
+        self.assertEqual([fields['message_id'] for fields in replay], self.ids[2:])
+        self.assertEqual(ring.since(self.room.id, self.ids[3], 1)[0]['message_id'], self.ids[4])
+        self.assertIsNone(ring.since(self.room.id, self.ids[0], 10))   # before the ring started
+        self.assertIsNone(ring.since(self.room.id + 1, self.ids[0], 10))
+        self.assertEqual((ring.stats()['hits'], ring.stats()['misses']), (2, 2))
+
+    def test_floor_rises_as_old_messages_fall_out(self):
+        ring = RecentMessageBuffer(per_room=2)
+        ring.record([self.messages[0], self.messages[2], self.messages[1]])  # committed out of order
+
+        self.assertIsNone(ring.since(self.room.id, self.ids[0] - 1, 10))
+        replay = ring.since(self.room.id, self.ids[0], 10)
+        self.assertEqual([fields['message_id'] for fields in replay], self.ids[1:3])
+
+    def test_disabled_by_default(self):
+        ring = RecentMessageBuffer()
+        ring.record(self.messages)
+        self.assertIsNone(ring.since(self.room.id, self.ids[0], 10))
+        self.assertEqual(ring.stats()['messages'], 0)
+
+
+class ReplayTests(ConsumerTestCase):
+    """Reconnect replay hands over to live delivery without gaps or duplicates"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(email='alice@example.com', username='alice', password='pw')
+        self.bob = User.objects.create_user(email='bob@example.com', username='bob', password='pw')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.alice, self.bob)
+        self.ids = [self.save(self.alice, f'before {i}') for i in range(4)]
+        self.path = f'/ws/chat/{self.room.id}/?since={self.ids[0]}'
+
+    def save(self, user, content):
+        message, = persist_messages([(self.room.id, user, content)])
+        return message.id
+
+    async def publish(self, user, content):
+        """Save and fan out a message the way ChatConsumer does"""
+        message, = await database_sync_to_async(persist_messages)([(self.room.id, user, content)])
+        event = wire_event('chat_message', **message_fields(message))
+        event['message_id'] = message.id
+        await get_channel_layer().group_send(room_group_name(self.room.id), event)
+        return message.id
+
+    async def received_ids(self, communicator):
+        ids = []
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] == 'replay_complete':
+                return ids, frame
+            ids.append(frame['message_id'])
+
+    async def test_replay_falls_back_to_the_database(self):
+        ring = RecentMessageBuffer(per_room=10)
+        # The ring starts after the client's cursor, so it can't answer for it
+        ring.record(await database_sync_to_async(list)(Message.objects.filter(id__gt=self.ids[1]).select_related('sender')))
+
+        with mock.patch('chat.consumers.recent_messages', ring):
+            alice = await self.open(self.path, self.alice)
+            replayed, complete = await self.received_ids(alice)
+
+        self.assertEqual(replayed, self.ids[1:])
+        self.assertEqual((complete['last_message_id'], complete['truncated']), (self.ids[-1], False))
+        self.assertEqual(ring.stats()['misses'], 1)
+        await self.close(alice)
+
+    async def test_message_committed_during_replay_is_sent_once(self):
+        original = vars(ChatConsumer)['load_missed_messages']
+        raced = []
+
+        async def load_while_bob_sends(consumer, room_id, since, limit):
+            raced.append(await self.publish(self.bob, 'during replay'))
+            return await original.__get__(consumer, ChatConsumer)(room_id, since, limit)
+
+        with mock.patch.object(ChatConsumer, 'load_missed_messages', load_while_bob_sends):
+            alice = await self.open(self.path, self.alice)
+            replayed, _ = await self.received_ids(alice)
+        self.assertEqual(replayed, self.ids[1:] + raced)
+
+        after = await self.publish(self.bob, 'after replay')
+        self.assertEqual((await alice.receive_json_from())['message_id'], after)
+        await self.assertNoFrame(alice)
+        await self.close(alice)
+
+    def test_live_messages_prune_replayed_ids(self):
+        consumer = ChatConsumer()
+        consumer.replayed_ids = {5, 7, 9}
+        consumer.send_event = mock.AsyncMock()
+
+        async_to_sync(consumer.chat_message)({'type': 'chat_message', 'text': '{}', 'message_id': 7})
+        self.assertEqual(consumer.replayed_ids, {9})
+        consumer.send_event.assert_not_awaited()
+
+        async_to_sync(consumer.chat_message)({'type': 'chat_message', 'text': '{}', 'message_id': 10})
+        self.assertEqual(consumer.replayed_ids, set())
+        consumer.send_event.assert_awaited_once()
+
+
+class ChatRoomListQueryTests(TestCase):
+    """The room list must load in a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='owner@example.com', username='owner', password='pw')
+        cls.others = [
+            User.objects.create_user(email=f'friend{i}@example.com', username=f'friend{i}', password='pw')
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_rooms(self, count):
+        for i in range(count):
+            room = ChatRoom.objects.create()
+            other = self.others[i % len(self.others)]
+            room.participants.add(self.user, other)
+            first, _, _ = persist_messages([
+                (room.id, other, 'QUJD'),
+                (room.id, other, 'REVG'),
+                (room.id, self.user, 'R0hJ'),
+            ])
+            advance_read_watermark(room.id, self.user.id, first.id)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/chat/rooms/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_query_count_does_not_grow_with_rooms(self):
+        self.add_rooms(2)
+        few, rooms = self.count_queries()
+        self.assertEqual(len(rooms), 2)
+
+        self.add_rooms(10)
+        many, rooms = self.count_queries()
+        self.assertEqual(len(rooms), 12)
+        self.assertEqual(few, many)
+
+    def test_last_message_and_unread_count(self):
+        self.add_rooms(1)
+        _, rooms = self.count_queries()
+        room = rooms[0]
+        self.assertEqual(room['unread_count'], 1)
+        self.assertEqual(room['last_message']['encrypted_content'], 'R0hJ')
+        self.assertEqual(room['last_message']['sender_username'], 'owner')
+        self.assertEqual(len(room['participants']), 2)
+
+    def test_new_message_moves_room_to_front(self):
+        self.add_rooms(2)
+        older = ChatRoom.objects.last()
+        updated_at = older.updated_at
+        persist_messages([(older.id, self.others[0], 'SktM')])
+        older.refresh_from_db()
+        self.assertGreater(older.updated_at, updated_at)
+        self.assertEqual(ChatRoom.objects.first(), older)
+        _, rooms = self.count_queries()
+        self.assertEqual(rooms[0]['id'], older.id)
+
+    def test_inbox_summaries_match_recomputed_values(self):
+        self.add_rooms(3)
+        room = ChatRoom.objects.filter(participants=self.user).first()
+        advance_read_watermark(room.id, self.user.id)
+        room.participants.remove(self.others[0])
+        self.assertEqual(verify_summaries(), [])
+
+        _, rooms = self.count_queries()
+        self.assertEqual([r['unread_count'] for r in rooms if r['id'] == room.id], [0])
+
+
+class MembershipCacheTests(TestCase):
+    """Participant changes must not leave a stale cached answer behind"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='member@example.com', username='member', password='pw')
+        cls.room = ChatRoom.objects.create()
+
+    def setUp(self):
+        membership_cache.clear()
+
+    def test_answer_cached_before_commit_is_dropped_on_commit(self):
+        self.assertFalse(is_room_member(self.room.id, self.user.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.participants.add(self.user)
+            # A concurrent reader that still sees the old rows caches "not a member"
+            membership_cache.set(self.room.id, self.user.id, False)
+        self.assertTrue(is_room_member(self.room.id, self.user.id))
+
+    def test_removal_from_either_side_invalidates(self):
+        self.room.participants.add(self.user)
+        self.assertTrue(is_room_member(self.room.id, self.user.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.chat_rooms.remove(self.room)
+        self.assertFalse(is_room_member(self.room.id, self.user.id))
+
+
+class PresenceServiceTests(TransactionTestCase):
+    """Presence changes reach the user rows in batched, coalesced writes"""
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(email=f'tab{i}@example.com', username=f'tab{i}', password='pw')
+            for i in range(3)
+        ]
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(*self.users)
+        # Long interval: the tests flush by hand
+        self.service = PresenceService(InMemoryPresenceBackend(), flush_interval=3600, ttl=60)
+
+    def flush(self):
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(self.service.flush)()
+        return [q['sql'] for q in queries if q['sql'].lstrip().upper().startswith('UPDATE')]
+
+    def online_ids(self):
+        return set(User.objects.filter(is_online=True).values_list('id', flat=True))
+
+    def test_flush_writes_each_transition_in_one_update(self):
+        async def connect_all():
+            for user in self.users:
+                await self.service.connect(user, [self.room.id])
+        async_to_sync(connect_all)()
+        self.assertEqual(len(self.flush()), 1)
+        self.assertEqual(self.online_ids(), {user.id for user in self.users})
+
+        async def disconnect_all():
+            for user in self.users:
+                await self.service.disconnect(user, [self.room.id])
+        async_to_sync(disconnect_all)()
+        self.assertEqual(len(self.flush()), 1)
+        self.assertEqual(self.online_ids(), set())
+
+    def test_switching_tabs_does_not_flap(self):
+        user = self.users[0]
+
+        async def open_tabs(count):
+            for _ in range(count):
+                await self.service.connect(user, [self.room.id])
+        async_to_sync(open_tabs)(2)
+        self.flush()
+        broadcasts = self.service.broadcasts
+
+        async def reload_tab():
+            await self.service.disconnect(user, [self.room.id])
+            await self.service.connect(user, [self.room.id])
+        async_to_sync(reload_tab)()
+        self.assertEqual(self.flush(), [])
+        self.assertEqual(self.service.broadcasts, broadcasts)
+        self.assertTrue(self.service.is_online(user.id))
+
+    def test_login_is_persisted_and_expires_after_ttl(self):
+        user = self.users[1]
+        self.service.note_login(user)
+        # No socket, so no flusher: the login is written straight away
+        self.assertEqual(self.online_ids(), {user.id})
+
+        self.service.backend.heartbeat([user.id], time.time() - 120)
+        self.assertEqual(len(self.flush()), 1)
+        self.assertFalse(self.service.is_online(user.id))
+        self.assertEqual(self.online_ids(), set())
+
+
+class MessageWriteBufferTests(TransactionTestCase):
+    """Batched mode groups concurrent sends and answers every caller"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='buffer@example.com', username='buffer', password='pw')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.user)
+
+    def submit_all(self, count, **options):
+        async def run():
+            buffer = MessageWriteBuffer(**options)
+            results = await asyncio.gather(*(
+                buffer.submit(self.room.id, self.user, f'bXNn{i}') for i in range(count)
+            ))
+            return buffer, results
+
+        return async_to_sync(run)()
+
+    def test_concurrent_submits_share_batches(self):
+        buffer, messages = self.submit_all(7, batch_size=3, flush_interval=0.05)
+        self.assertEqual(buffer.stats()['batches_written'], 3)
+        self.assertEqual(buffer.stats()['messages_written'], 7)
+        # Each caller gets its own saved message back, in submit order
+        self.assertEqual([m.encrypted_content for m in messages], [f'bXNn{i}' for i in range(7)])
+        self.assertEqual(
+            [m.id for m in messages],
+            list(Message.objects.filter(room=self.room).order_by('id').values_list('id', flat=True)),
+        )
+
+    def test_failed_batch_resolves_callers_with_none(self):
+        with mock.patch('chat.persistence.persist_messages', side_effect=RuntimeError('db down')):
+            buffer, messages = self.submit_all(4, batch_size=10, flush_interval=0.05)
+        self.assertEqual(messages, [None] * 4)
+        self.assertEqual(buffer.stats()['failed_batches'], 1)
+        self.assertFalse(Message.objects.exists())
+
+    def test_drain_writes_batch_taken_by_stopped_loop(self):
+        async def take_batch():
+            buffer = MessageWriteBuffer()
+            future = buffer.loop.create_future()
+            await buffer._queue.put((self.room.id, self.user, 'UVVF', future))
+            # The worker took this batch but the loop stopped before it was written
+            batch = buffer._take(1)
+            buffer._inflight[id(batch)] = batch
+            await buffer._queue.put((self.room.id, self.user, 'TEFURQ', buffer.loop.create_future()))
+            return buffer
+
+        buffer = async_to_sync(take_batch)()
+        buffer.drain_sync()
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('encrypted_content', flat=True)),
+            ['UVVF', 'TEFURQ'],
+        )
+        self.assertEqual(buffer._inflight, {})
+
+
+class ReadWatermarkTests(TransactionTestCase):
+    """Watermarks only move forward and bursts of read reports become one write"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(email='alice@example.com', username='alice', password='pw')
+        self.bob = User.objects.create_user(email='bob@example.com', username='bob', password='pw')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.alice, self.bob)
+        self.ids = [message.id for message in persist_messages([(self.room.id, self.alice, f'c{i}') for i in range(5)])]
+
+    def test_watermark_only_moves_forward(self):
+        room_id, user_id = self.room.id, self.bob.id
+        self.assertEqual(advance_read_watermark(room_id, user_id, self.ids[3]), self.ids[3])
+        self.assertIsNone(advance_read_watermark(room_id, user_id, self.ids[1]))
+        self.assertIsNone(advance_read_watermark(room_id, user_id, self.ids[3]))
+        self.assertEqual(get_read_watermark(room_id, user_id), self.ids[3])
+        self.assertEqual(unread_count(room_id, user_id), 1)
+
+        # Ids past the newest message are clamped to it
+        self.assertEqual(advance_read_watermark(room_id, user_id, self.ids[-1] + 100), self.ids[-1])
+        self.assertEqual(unread_count(room_id, user_id), 0)
+
+    def test_burst_of_reports_is_one_write(self):
+        coalescer = ReadWatermarkCoalescer(flush_delay=0.05)
+        room_id = self.room.id
+
+        async def burst():
+            for message_id in (self.ids[1], self.ids[4], self.ids[2]):
+                await coalescer.report(room_id, self.bob.id, message_id)
+            await coalescer.report(room_id, self.alice.id, self.ids[0])
+            pending = coalescer.stats()['pending']
+            await asyncio.sleep(0.2)
+            return pending
+
+        with mock.patch('chat.read_state.apply_read_watermarks', wraps=apply_read_watermarks) as apply:
+            pending = async_to_sync(burst)()
+
+        self.assertEqual(pending, 2)
+        apply.assert_called_once_with({(room_id, self.bob.id): self.ids[4], (room_id, self.alice.id): self.ids[0]})
+        self.assertEqual(coalescer.stats(), {'pending': 0, 'reports': 4, 'writes': 2})
+        self.assertEqual(get_read_watermark(room_id, self.bob.id), self.ids[4])
+
+
+class CompactMessageSerializerTests(TestCase):
+    """Message pages name senders by id and list each sender once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(email='alice@example.com', username='alice', password='pw')
+        cls.bob = User.objects.create_user(email='bob@example.com', username='bob', password='pw')
+        cls.room = ChatRoom.objects.create()
+        cls.room.participants.add(cls.alice, cls.bob)
+        persist_messages([(cls.room.id, sender, 'ciphertext') for sender in (cls.alice, cls.bob, cls.alice, cls.alice)])
+
+    def test_payload_shape_and_sender_table(self):
+        messages = list(Message.objects.filter(room=self.room).select_related('sender').order_by('id'))
+        watermarks = {self.bob.id: messages[0].id}
+
+        with CaptureQueriesContext(connection) as queries:
+            data = CompactMessageSerializer(messages, many=True, context={'read_watermarks': watermarks}).data
+            users = users_table(messages)
+        self.assertEqual(len(queries), 0)
+
+        self.assertEqual(list(data[0]), ['id', 'sender_id', 'encrypted_content', 'timestamp', 'is_read'])
+        self.assertEqual([m['sender_id'] for m in data], [self.alice.id, self.bob.id, self.alice.id, self.alice.id])
+        self.assertEqual([m['is_read'] for m in data], [True, False, False, False])
+
+        self.assertEqual(users, {
+            str(self.alice.id): UserSerializer(self.alice).data,
+            str(self.bob.id): UserSerializer(self.bob).data,
+        })
+        self.assertEqual(users_table([]), {})
+
+
+class MessagePaginationTests(TestCase):
+    """Keyset pages meet at their boundaries and always give a cursor to poll from"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='pages@example.com', username='pages', password='pw')
+        cls.room = ChatRoom.objects.create()
+        cls.room.participants.add(cls.user)
+        cls.ids = [message.id for message in persist_messages([(cls.room.id, cls.user, f'c{i}') for i in range(7)])]
+
+    def page(self, before=None, after=None, limit=3):
+        messages, older, newer = message_page(self.room.id, before, after, limit)
+        return (
+            [message.id for message in messages],
+            decode_cursor(older) if older else None,
+            decode_cursor(newer) if newer else None,
+        )
+
+    def test_cursor_round_trip_and_invalid_tokens(self):
+        self.assertEqual(decode_cursor(encode_cursor(12345)), 12345)
+        for token in ('', 'not a cursor', encode_cursor(-1), 'eDo1', 'bTphYmM'):  # 'x:5', 'm:abc'
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(token)
+
+    @override_settings(CHAT_MESSAGE_PAGE_SIZE=50, CHAT_MESSAGE_PAGE_MAX=200)
+    def test_page_size_is_clamped(self):
+        self.assertEqual([page_size(v) for v in (None, 'ten', '0', '20', '5000')], [50, 50, 1, 20, 200])
+
+    def test_before_pages_meet_without_overlap(self):
+        ids = self.ids
+        self.assertEqual(self.page(), (ids[4:], ids[4], ids[6]))
+        self.assertEqual(self.page(before=ids[4]), (ids[1:4], ids[1], ids[3]))
+        self.assertEqual(self.page(before=ids[1]), (ids[:1], None, ids[0]))
+        self.assertEqual(self.page(before=ids[0]), ([], None, ids[0] - 1))
+
+    def test_after_pages_meet_without_overlap(self):
+        ids = self.ids
+        self.assertEqual(self.page(after=ids[0]), (ids[1:4], ids[1], ids[3]))
+        self.assertEqual(self.page(after=ids[3]), (ids[4:], ids[4], ids[6]))
+        self.assertEqual(self.page(after=ids[6]), ([], None, ids[6]))
+
+    def test_latest_page_can_poll_for_new_messages(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/api/chat/rooms/{self.room.id}/messages/'
+
+        latest = client.get(url, {'limit': 3}).json()
+        self.assertEqual([m['id'] for m in latest['messages']], self.ids[4:])
+        newer = latest['newer_cursor']
+        self.assertEqual(client.get(url, {'after': newer}).json()['messages'], [])
+
+        message, = persist_messages([(self.room.id, self.user, 'later')])
+        polled = client.get(url, {'after': newer}).json()
+        self.assertEqual([m['id'] for m in polled['messages']], [message.id])
+        self.assertEqual(decode_cursor(polled['newer_cursor']), message.id)
+
+        self.assertEqual(client.get(url, {'after': 'garbage'}).status_code, 400)
+        self.assertEqual(client.get(url, {'after': newer, 'before': newer}).status_code, 400)
+
+    def test_empty_room_still_has_a_cursor(self):
+        room = ChatRoom.objects.create()
+        self.assertEqual(message_page(room.id), ([], None, encode_cursor(0)))
+
+
+@override_settings(CHAT_ETAGS_WITH_LOCAL_CACHE=True)
+class ConditionalGetTests(TestCase):
+    """Room lists answer 304 until something they show changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='etag@example.com', username='etag', password='pw')
+        cls.other = User.objects.create_user(email='peer@example.com', username='peer', password='pw')
+        cls.room = ChatRoom.objects.create()
+        cls.room.participants.add(cls.user, cls.other)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_rooms(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/api/chat/rooms/', **headers)
+
+    def assertInvalidates(self, change):
+        etag = self.get_rooms()['ETag']
+        self.assertEqual(self.get_rooms(etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.get_rooms(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_match_answers_304_without_a_body(self):
+        etag = self.get_rooms()['ETag']
+        response = self.get_rooms(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_new_message_invalidates(self):
+        self.assertInvalidates(lambda: persist_messages([(self.room.id, self.other, 'TkVX')]))
+
+    def test_presence_flush_invalidates(self):
+        self.assertInvalidates(lambda: persist_presence([self.other.id], [], timezone.now()))
+
+    def test_profile_save_invalidates(self):
+        def rename():
+            self.other.username = 'renamed-peer'
+            self.other.save()
+        self.assertInvalidates(rename)
+
+    def test_private_field_save_keeps_etag(self):
+        etag = self.get_rooms()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.last_login = timezone.now()
+            self.other.save(update_fields=['last_login'])
+        self.assertEqual(self.get_rooms(etag).status_code, 304)
+
+    @override_settings(CHAT_ETAGS_WITH_LOCAL_CACHE=False)
+    def test_no_etags_on_a_per_process_cache(self):
+        response = self.get_rooms()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class BatchSendTests(TestCase):
+    """The batch status says whether all, some or none of the messages were saved"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='outbox@example.com', username='outbox', password='pw')
+        cls.room = ChatRoom.objects.create()
+        cls.room.participants.add(cls.user)
+        cls.foreign_room = ChatRoom.objects.create()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, *room_ids):
+        messages = [
+            {'room_id': room_id, 'encrypted_content': 'T1VU', 'client_id': f'c{i}'}
+            for i, room_id in enumerate(room_ids)
+        ]
+        return self.client.post('/api/chat/messages/send-batch/', {'messages': messages}, format='json')
+
+    def test_all_saved(self):
+        response = self.send(self.room.id, self.room.id)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([r['status'] for r in response.json()['results']], ['created', 'created'])
+
+    def test_some_saved(self):
+        response = self.send(self.room.id, self.foreign_room.id)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['client_id'] for r in response.json()['results']], ['c0', 'c1'])
+
+    def test_none_saved(self):
+        response = self.send(self.foreign_room.id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'][0]['status'], 'error')
+        self.assertFalse(Message.objects.exists())
+
+
+class DirectRoomTests(TestCase):
+    """Two requests creating the same 1:1 room end up in one room"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(email='alice@example.com', username='alice', password='pw')
+        cls.bob = User.objects.create_user(email='bob@example.com', username='bob', password='pw')
+
+    def test_losing_concurrent_create_returns_the_winners_room(self):
+        room, created = get_or_create_direct_room(self.bob, self.alice)
+        self.assertTrue(created)
+
+        # The second request looked the pair up before the first one committed
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            same, created = get_or_create_direct_room(self.alice, self.bob)
+
+        self.assertFalse(created)
+        self.assertEqual(same.pk, room.pk)
+        self.assertEqual(ChatRoom.objects.count(), 1)
+        self.assertEqual(set(same.participants.values_list('id', flat=True)), {self.alice.id, self.bob.id})
+
+
+class RoomExportTests(TestCase):
+    """Room exports stream every message once, in id order"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='owner@example.com', username='owner', password='pw')
+        cls.other = User.objects.create_user(email='friend@example.com', username='friend', password='pw')
+        cls.room = ChatRoom.objects.create()
+        cls.room.participants.add(cls.user, cls.other)
+        cls.messages = persist_messages([(cls.room.id, cls.other, f'bXNn{i}') for i in range(7)])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/chat/rooms/{self.room.id}/export/{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_streams_all_messages_across_chunks(self):
+        rows = [json.loads(line) for line in export_room(self.room.id, chunk_size=3)]
+        self.assertEqual([row['id'] for row in rows], [m.id for m in self.messages])
+        self.assertEqual(rows[0]['sender_username'], 'friend')
+
+    def test_since_id_and_gzip(self):
+        since_id = self.messages[4].id
+        body = gzip.decompress(self.export(f'?since_id={since_id}&gzip=1'))
+        ids = [json.loads(line)['id'] for line in body.splitlines()]
+        self.assertEqual(ids, [m.id for m in self.messages[5:]])
+
+    def test_non_member_is_denied(self):
+        outsider = User.objects.create_user(email='out@example.com', username='outsider', password='pw')
+        self.client.force_authenticate(outsider)
+        response = self.client.get(f'/api/chat/rooms/{self.room.id}/export/')
+        self.assertEqual(response.status_code, 404)
+
+
+def full_scans(sql):
+    """EXPLAIN a captured statement and return the plan lines that scan a whole table"""
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            lines = [row[-1] for row in cursor.fetchall()]
+            # "SCAN chat_message" reads every row; "SCAN ... USING INDEX" walks an index
+            return [line for line in lines if line.startswith('SCAN ') and ' USING ' not in line]
+        if vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall() if 'Seq Scan' in row[0]]
+        if vendor == 'mysql':
+            cursor.execute(f'EXPLAIN {sql}')
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [f"{row['table']}: {row['type']}" for row in rows if row['type'] == 'ALL']
+    raise unittest.SkipTest(f'No plan check for {vendor}')
+
+
+class HotQueryPlanTests(TestCase):
+    """
+    EXPLAIN every statement issued by the hot chat paths on a seeded dataset.
+
+    A statement whose plan reads a whole table fails the test, so a dropped
+    index or a rewritten query that can't use one shows up here.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email=f'user{i}@example.com', username=f'user{i}', password='pw')
+            for i in range(6)
+        ]
+        cls.rooms = []
+        for i, other in enumerate(cls.users[1:]):
+            room, _ = get_or_create_direct_room(cls.users[0], other)
+            cls.rooms.append(room)
+            persist_messages([(room.id, (cls.users[0], other)[n % 2], 'QUJD') for n in range(40)])
+            advance_read_watermark(room.id, cls.users[0].id)
+        cls.room = cls.rooms[0]
+        cls.user = cls.users[0]
+        cls.last_id = Message.objects.filter(room=cls.room).order_by('-id').values_list('id', flat=True)[0]
+
+    def assertIndexed(self, run):
+        membership_cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            run()
+        statements = [
+            query['sql'] for query in captured
+            if query['sql'].lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE'))
+        ]
+        self.assertTrue(statements)
+        for sql in statements:
+            self.assertEqual(full_scans(sql), [], f'Full table scan in:\n{sql}')
+
+    def test_message_pages(self):
+        self.assertIndexed(lambda: message_page(self.room.id, None, None, 20))
+        self.assertIndexed(lambda: message_page(self.room.id, self.last_id - 10, None, 20))
+        self.assertIndexed(lambda: message_page(self.room.id, None, self.last_id - 30, 20))
+
+    def test_reconnect_replay_range(self):
+        self.assertIndexed(lambda: list(
+            Message.objects.filter(room_id=self.room.id, id__gt=self.last_id - 5)
+            .select_related('sender').order_by('id')[:100]
+        ))
+
+    def test_unread_counts_and_read_watermarks(self):
+        self.assertIndexed(lambda: unread_count(self.room.id, self.user.id))
+        self.assertIndexed(lambda: advance_read_watermark(self.room.id, self.users[1].id, self.last_id))
+
+    def test_room_list(self):
+        self.assertIndexed(lambda: ChatRoomSerializer.load_inbox(self.user))
+
+    def test_membership_and_direct_rooms(self):
+        self.assertIndexed(lambda: is_room_member(self.room.id, self.user.id))
+        self.assertIndexed(lambda: get_or_create_direct_room(self.user, self.users[1]))
+
+    def test_message_write_updates_summaries(self):
+        self.assertIndexed(lambda: record_messages(list(Message.objects.filter(room=self.room).order_by('-id')[:2])))
+
+    def test_export_ranges(self):
+        since = Message.objects.get(id=self.last_id - 10).timestamp
+        self.assertIndexed(lambda: list(export_rows(self.room.id, since_id=self.last_id - 10, chunk_size=5)))
+        self.assertIndexed(lambda: list(export_rows(self.room.id, since=since, chunk_size=5)))
+
+    def test_default_orderings(self):
+        self.assertIndexed(lambda: list(self.room.messages.all()[:20]))
+
+
+class WebSocketAuthCacheTests(TransactionTestCase):
+    """Handshakes decode a token once and reuse the user row until it changes"""
+
+    def setUp(self):
+        token_cache.clear()
+        user_cache.clear()
+        self.user = User.objects.create_user(email='ws@example.com', username='ws', password='pw')
+        self.token = str(AccessToken.for_user(self.user))
+
+    def handshake(self, token):
+        seen = {}
+
+        async def inner(scope, receive, send):
+            seen['user'] = scope['user']
+
+        async_to_sync(JwtAuthMiddleware(inner))({'query_string': f'token={token}'.encode()}, None, None)
+        return seen['user']
+
+    def test_repeat_handshakes_hit_the_caches(self):
+        self.assertEqual(self.handshake(self.token).pk, self.user.pk)
+        hits = token_cache.stats()['hits']
+        with CaptureQueriesContext(connection) as queries:
+            user = self.handshake(self.token)
+        self.assertEqual(user.username, 'ws')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(token_cache.stats()['hits'], hits + 1)
+
+    def test_user_save_invalidates_snapshot(self):
+        self.handshake(self.token)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.handshake(self.token).username, 'renamed')
+
+    def test_tampered_token_is_rejected(self):
+        self.handshake(self.token)
+        header, payload, signature = self.token.split('.')
+        tampered = f'{header}.{payload}x.{signature}'
+        self.assertFalse(self.handshake(tampered).is_authenticated)
+
+    def test_logout_revokes_token_for_handshakes(self):
+        self.handshake(self.token)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        presence = PresenceService(InMemoryPresenceBackend())  # keep the process-wide service unset
+        with mock.patch('accounts.views.get_presence_service', return_value=presence):
+            self.assertEqual(client.post('/api/auth/logout/').status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(self.handshake(self.token).is_authenticated)
+        self.assertEqual(len(queries), 0)
+        self.assertTrue(get_revocation_index().is_revoked(AccessToken(self.token)['jti']))
+
+
+class RevocationIndexTests(TransactionTestCase):
+    """Syncs pick up blacklist rows that commit after a higher id was synced"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='revoked@example.com', username='revoked', password='pw')
+
+    def blacklist(self, row_id):
+        token = AccessToken.for_user(self.user)
+        outstanding = OutstandingToken.objects.create(
+            jti=token['jti'], user=self.user, token=str(token),
+            created_at=token.current_time, expires_at=datetime_from_epoch(token['exp']),
+        )
+        BlacklistedToken.objects.create(id=row_id, token=outstanding)
+        return token['jti']
+
+    def test_late_commit_below_the_watermark_is_synced(self):
+        index = RevocationIndex()
+        first, last = self.blacklist(10), self.blacklist(12)
+        index.sync()
+        self.assertTrue(index.is_revoked(first) and index.is_revoked(last))
+
+        # Row 11 was allocated before row 12 but committed after the sync
+        late = self.blacklist(11)
+        index.sync()
+        self.assertTrue(index.is_revoked(late))
+        self.assertNotIn(11, index._gaps)
+
+    def test_gaps_are_given_up_after_the_timeout(self):
+        index = RevocationIndex(gap_timeout=0)
+        self.blacklist(5)
+        index.sync()
+        self.assertEqual(index.stats()['pending_gaps'], 0)
+
+    def test_background_thread_loads_and_syncs(self):
+        first = self.blacklist(1)
+        index = RevocationIndex(sync_interval=0.01)
+        index.start_background_sync()
+        self.addCleanup(index.stop_background_sync)
+        self.assertTrue(index.loaded and index.is_revoked(first))
+
+        later = self.blacklist(2)
+        deadline = time.monotonic() + 5
+        while not index.is_revoked(later) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(index.is_revoked(later))
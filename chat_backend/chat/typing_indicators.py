@@ -0,0 +1,121 @@
+# chat/typing_indicators.py - Server-side typing indicator coalescing
+import asyncio
+import threading
+
+from django.conf import settings
+
+
+class _TypingState:
+    __slots__ = ('last_sent', 'timers')
+
+    def __init__(self, last_sent):
+        self.last_sent = last_sent
+        self.timers = {}  # channel_name -> idle timer of each connection typing
+
+
+class TypingTracker:
+    """
+    Tracks typing state per (user_id, room_id) and filters client events.
+
+    Only transitions are broadcast: the first "typing" event, and the
+    "stopped" event. Repeated "typing" events inside repeat_window are
+    suppressed; after the window one refresh goes out so remote indicators
+    stay alive. If nothing arrives for idle_timeout seconds the on_idle
+    callback fires so the caller can broadcast an automatic stop.
+
+    Each connection (tab) typing in the room is counted, like presence:
+    the user stops typing only when the last of them stops, goes idle or
+    disconnects.
+    """
+
+    def __init__(self, repeat_window=3.0, idle_timeout=6.0):
+        self.repeat_window = repeat_window
+        self.idle_timeout = idle_timeout
+        self._states = {}
+        self.received = 0
+        self.broadcast = 0
+        self.suppressed = 0
+        self.auto_stops = 0
+
+    def start(self, key, channel_name, on_idle):
+        """Record a "typing" event; return True if it should be broadcast"""
+        self.received += 1
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _TypingState(now)
+            fresh = True
+        else:
+            fresh = False
+
+        timer = state.timers.pop(channel_name, None)
+        if timer is not None:
+            timer.cancel()
+        state.timers[channel_name] = loop.call_later(self.idle_timeout, self._expire, key, channel_name, on_idle)
+
+        if not fresh and now - state.last_sent < self.repeat_window:
+            self.suppressed += 1
+            return False
+        state.last_sent = now
+        self.broadcast += 1
+        return True
+
+    def stop(self, key, channel_name):
+        """Record a "stopped typing" event; return True if it should be broadcast"""
+        self.received += 1
+        if self._remove(key, channel_name):
+            self.broadcast += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def clear(self, key, channel_name):
+        """Forget a connection (e.g. on disconnect); return True if the user just stopped typing"""
+        return self._remove(key, channel_name)
+
+    def stats(self):
+        return {
+            'typing_now': len(self._states),
+            'received': self.received,
+            'broadcast': self.broadcast,
+            'suppressed': self.suppressed,
+            'auto_stops': self.auto_stops,
+        }
+
+    def _remove(self, key, channel_name):
+        """Drop one connection; True when it was the last one typing"""
+        state = self._states.get(key)
+        if state is None or channel_name not in state.timers:
+            return False
+        state.timers.pop(channel_name).cancel()
+        if state.timers:
+            return False
+        del self._states[key]
+        return True
+
+    def _expire(self, key, channel_name, on_idle):
+        state = self._states.get(key)
+        if state is None or state.timers.pop(channel_name, None) is None:
+            return
+        if state.timers:
+            return
+        del self._states[key]
+        self.auto_stops += 1
+        on_idle(channel_name)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_typing_tracker():
+    """Return the process-wide typing tracker"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = TypingTracker(
+                repeat_window=getattr(settings, 'CHAT_TYPING_REPEAT_WINDOW', 3.0),
+                idle_timeout=getattr(settings, 'CHAT_TYPING_IDLE_TIMEOUT', 6.0),
+            )
+        return _tracker
@@ -7,6 +7,9 @@ urlpatterns = [
     path('rooms/create/', views.create_or_get_room, name='create_room'),
     path('rooms/<int:room_id>/', views.room_info, name='room_info'),
     path('rooms/<int:room_id>/messages/', views.room_messages, name='room_messages'),
+    path('rooms/<int:room_id>/export/', views.export_room_messages, name='export_room_messages'),
     path('rooms/<int:room_id>/mark-read/', views.mark_messages_read, name='mark_messages_read'),
     path('messages/send/', views.send_message, name='send_message'),
+    path('messages/send-batch/', views.send_message_batch, name='send_message_batch'),
+    path('metrics/', views.chat_metrics, name='chat_metrics'),
 ]
\ No newline at end of file
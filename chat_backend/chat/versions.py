@@ -0,0 +1,159 @@
+# chat/versions.py - Version counters and conditional GET for read endpoints
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import ChatRoom
+
+# Counter scopes; each is keyed by a user or room id
+INBOX = 'inbox'        # a user's room list
+FRIENDS = 'friends'    # a user's friends list
+PROFILE = 'profile'    # a user's own public fields
+ROOM = 'room'          # a room's message history
+
+Participant = ChatRoom.participants.through
+_ROOM_FIELD = ChatRoom.participants.field.m2m_field_name()
+_USER_FIELD = ChatRoom.participants.field.m2m_reverse_field_name()
+
+
+def etags_enabled():
+    """
+    Whether conditional GETs are answered.
+
+    Every worker must see the same counters, or one could answer 304 for a
+    change another recorded. A process-local default cache therefore turns
+    ETags off unless CHAT_ETAGS_WITH_LOCAL_CACHE says one process serves
+    all requests. Counters aren't maintained while ETags are off.
+    """
+    if getattr(settings, 'CHAT_ETAGS_WITH_LOCAL_CACHE', False):
+        return True
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _key(scope, object_id):
+    return f'version:{scope}:{object_id}'
+
+
+def get_versions(scope, object_ids):
+    """
+    Current counters for many ids of one scope.
+
+    Counters live in the default cache. A missing counter starts from the
+    current time in nanoseconds rather than zero, so a restart or eviction
+    can never reissue an ETag a client saw before.
+    """
+    keys = {_key(scope, object_id): object_id for object_id in object_ids}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, object_id in keys.items():
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+        versions[object_id] = found[key]
+    return versions
+
+
+def bump(scope, object_ids):
+    """Invalidate the validators of every id in the scope"""
+    if not etags_enabled():
+        return
+    for object_id in set(object_ids):
+        key = _key(scope, object_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_rooms(room_ids):
+    """Messages, reads or membership changed: the rooms' pages and members' inboxes are stale"""
+    room_ids = set(room_ids)
+    if not room_ids or not etags_enabled():
+        return
+    bump(ROOM, room_ids)
+    bump(INBOX, Participant.objects.filter(
+        **{f'{_ROOM_FIELD}_id__in': room_ids}
+    ).values_list(f'{_USER_FIELD}_id', flat=True))
+
+
+def bump_users(user_ids):
+    """
+    Public user fields changed (profile, presence).
+
+    Those fields are embedded in room lists, message pages and friends
+    lists, so every view that shows one of these users is invalidated.
+    """
+    from accounts.models import Friendship
+
+    user_ids = set(user_ids)
+    if not user_ids or not etags_enabled():
+        return
+    bump(PROFILE, user_ids)
+    links = Participant.objects.filter(**{
+        f'{_ROOM_FIELD}_id__in': Participant.objects.filter(
+            **{f'{_USER_FIELD}_id__in': user_ids}
+        ).values(f'{_ROOM_FIELD}_id'),
+    }).values_list(f'{_ROOM_FIELD}_id', f'{_USER_FIELD}_id')
+    room_ids, member_ids = set(), set()
+    for room_id, member_id in links:
+        room_ids.add(room_id)
+        member_ids.add(member_id)
+    bump(ROOM, room_ids)
+    bump(INBOX, member_ids)
+    bump(FRIENDS, Friendship.objects.filter(friend_id__in=user_ids).values_list('user_id', flat=True))
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode(), usedforsecurity=False)
+    return f'"{digest.hexdigest()}"'
+
+
+def conditional_get(etag_func):
+    """
+    Answer GETs with 304 when If-None-Match matches etag_func's validator.
+
+    etag_func(request, *args, **kwargs) must only read counters (and
+    cheap checks such as membership), because it runs before the view.
+    Returning None skips the check. The ETag is computed before the body,
+    so a change racing with the request can only make the next request
+    miss, never serve a stale 304.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not etags_enabled():
+                return view(request, *args, **kwargs)
+
+            etag = etag_func(request, *args, **kwargs)
+            if etag is None:
+                return view(request, *args, **kwargs)
+
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Authorization',))
+            return response
+        return wrapper
+    return decorator
+
+
+def user_etag(scope):
+    """ETag func for views that depend on one counter of the requesting user"""
+    def etag_func(request, *args, **kwargs):
+        user_id = request.user.id
+        return make_etag(scope, user_id, get_versions(scope, [user_id])[user_id])
+    return etag_func
@@ -1,22 +1,46 @@
 # chat/views.py - Views for Client-Side Encryption
-from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
-from .models import ChatRoom, Message
-from .serializers import ChatRoomSerializer, MessageSerializer, SendMessageSerializer, CreateRoomSerializer
+from django.http import StreamingHttpResponse
+from accounts.keypool import get_key_pool
+from .export import export_room, parse_since
+from .middleware import auth_stats
+from .membership import get_member_room, is_room_member, membership_cache
+from .models import ChatRoom
+from .outbound import send_queue_stats
+from .pagination import InvalidCursor, decode_cursor, message_page, page_size
+from .persistence import buffer_stats, persist_messages
+from .presence import get_presence_service
+from .read_state import advance_read_watermark, get_read_coalescer, get_room_watermarks, unread_count
+from .recent import recent_messages
+from .rooms import get_or_create_direct_room
+from .typing_indicators import get_typing_tracker
+from .versions import INBOX, ROOM, conditional_get, get_versions, make_etag, user_etag
+from .serializers import (
+    BatchMessageItemSerializer, ChatRoomSerializer, CompactMessageSerializer, CreateRoomSerializer,
+    MessageSerializer, SendMessageSerializer, users_table,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+def room_messages_etag(request, room_id):
+    """Validator for one page of a room: the room's counter plus the page parameters"""
+    if not is_room_member(room_id, request.user.id):
+        return None  # let the view answer 404
+    return make_etag(ROOM, room_id, get_versions(ROOM, [room_id])[room_id], request.query_params.urlencode())
+
 @api_view(['GET'])
+@conditional_get(user_etag(INBOX))
 def chat_rooms(request):
     """Get all chat rooms for the current user"""
     try:
-        rooms = ChatRoom.objects.filter(participants=request.user).order_by('-updated_at')
-        logger.info(f"User {request.user.username} has {rooms.count()} chat rooms")
+        rooms = ChatRoomSerializer.load_inbox(request.user)
+        logger.info(f"User {request.user.username} has {len(rooms)} chat rooms")
         serializer = ChatRoomSerializer(rooms, many=True, context={'request': request})
         return Response(serializer.data)
     except Exception as e:
@@ -37,29 +61,14 @@ def create_or_get_room(request):
         participant = User.objects.get(id=participant_id)
         logger.info(f"Creating/getting room between {request.user.username} and {participant.username}")
         
-        # Find existing room between these two users (and only these two users)
-        existing_room = ChatRoom.objects.filter(
-            participants=request.user
-        ).filter(
-            participants=participant
-        ).annotate(
-            participant_count=Count('participants')
-        ).filter(
-            participant_count=2
-        ).first()
-        
-        if existing_room:
-            logger.info(f"Found existing room {existing_room.id} between {request.user.username} and {participant.username}")
-            serializer = ChatRoomSerializer(existing_room, context={'request': request})
-            return Response(serializer.data)
-        
-        # Create new room with exactly 2 participants
-        room = ChatRoom.objects.create()
-        room.participants.add(request.user, participant)
-        logger.info(f"Created new room {room.id} between {request.user.username} and {participant.username}")
+        room, created = get_or_create_direct_room(request.user, participant)
+        if created:
+            logger.info(f"Created new room {room.id} between {request.user.username} and {participant.username}")
+        else:
+            logger.info(f"Found existing room {room.id} between {request.user.username} and {participant.username}")
         
         serializer = ChatRoomSerializer(room, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         
     except User.DoesNotExist:
         logger.warning(f"User {participant_id} not found")
@@ -69,34 +78,51 @@ def create_or_get_room(request):
         return Response({'error': 'Failed to create room'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
+@conditional_get(room_messages_etag)
 def room_messages(request, room_id):
-    """Get all encrypted messages for a room"""
+    """
+    Get one page of encrypted messages for a room.
+
+    Query parameters: `before` or `after` (cursor tokens from a previous
+    response) and `limit`. Without a cursor the latest page is returned.
+    """
     try:
         # Verify user has access to this room
-        room = ChatRoom.objects.get(id=room_id, participants=request.user)
-        messages = room.messages.all()
+        if not is_room_member(room_id, request.user.id):
+            raise ChatRoom.DoesNotExist
         
-        logger.info(f"Room {room_id} has {messages.count()} encrypted messages for {request.user.username}")
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        if before and after:
+            return Response({'error': 'Use either before or after, not both'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            messages, older, newer = message_page(
+                room_id,
+                before=decode_cursor(before) if before else None,
+                after=decode_cursor(after) if after else None,
+                limit=page_size(request.query_params.get('limit')),
+            )
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Mark messages as read (except user's own messages)
-        unread_count = Message.objects.filter(
-            room=room, is_read=False
-        ).exclude(sender=request.user).count()
+        # Mark messages as read by moving the user's watermark up to this page
+        if messages and advance_read_watermark(room_id, request.user.id, messages[-1].id):
+            logger.info(f"Marked messages up to {messages[-1].id} as read in room {room_id} for {request.user.username}")
         
-        if unread_count > 0:
-            Message.objects.filter(
-                room=room, is_read=False
-            ).exclude(sender=request.user).update(is_read=True)
-            logger.info(f"Marked {unread_count} messages as read in room {room_id}")
+        # Return encrypted messages - client will decrypt them. Senders are
+        # listed once in `users` instead of being nested in every message
+        serializer = CompactMessageSerializer(messages, many=True, context={
+            'request': request,
+            'read_watermarks': get_room_watermarks(room_id),
+        })
+        logger.info(f"Serving {len(messages)} encrypted messages in room {room_id} to {request.user.username}")
         
-        # Return encrypted messages - client will decrypt them
-        serializer = MessageSerializer(messages, many=True, context={'request': request})
-        
-        # Log encryption info for debugging
-        encrypted_messages = [msg for msg in messages if msg.encrypted_content]
-        logger.info(f"Serving {len(encrypted_messages)} encrypted messages to client for decryption")
-        
-        return Response(serializer.data)
+        return Response({
+            'messages': serializer.data,
+            'users': users_table(messages, context={'request': request}),
+            'older_cursor': older,  # pass as ?before= for the previous page
+            'newer_cursor': newer,  # pass as ?after= for the next page, or to poll for new messages
+        })
         
     except ChatRoom.DoesNotExist:
         logger.warning(f"Room {room_id} not found or access denied for user {request.user.username}")
@@ -119,24 +145,18 @@ def send_message(request):
     
     try:
         # Verify user has access to this room
-        room = ChatRoom.objects.get(id=room_id, participants=request.user)
+        if not is_room_member(room_id, request.user.id):
+            raise ChatRoom.DoesNotExist
         
-        # Create message with encrypted content (no server-side encryption/decryption)
-        message = Message.objects.create(
-            room=room,
-            sender=request.user,
-            encrypted_content=encrypted_content  # Store client-encrypted content directly
-        )
+        # Store client-encrypted content directly and bump the room's updated_at for sorting
+        message, = persist_messages([(room_id, request.user, encrypted_content)])
         
         # Log for debugging (don't log full encrypted content)
         content_preview = encrypted_content[:50] + "..." if len(encrypted_content) > 50 else encrypted_content
         logger.info(f"Encrypted message saved to room {room_id} by {request.user.username}: {content_preview}")
         
-        # Update room's updated_at timestamp for sorting
-        room.save()
-        
         # Return the saved message
-        response_serializer = MessageSerializer(message, context={'request': request})
+        response_serializer = MessageSerializer(message, context={'request': request, 'read_watermarks': {}})
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
         
     except ChatRoom.DoesNotExist:
@@ -146,16 +166,109 @@ def send_message(request):
         logger.error(f"Error sending encrypted message to room {room_id}: {e}")
         return Response({'error': 'Failed to send message'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+def send_message_batch(request):
+    """
+    Save up to CHAT_SEND_BATCH_MAX client-encrypted messages in one request.
+
+    Body: {"messages": [{"room_id", "encrypted_content", "client_id"?}, ...]}.
+    Membership is checked with one query for all rooms in the batch and the
+    valid messages are written in one transaction. Each item gets its own
+    result, in request order. Returns 201 when every message was saved, 207
+    when only some were, and 400 when none were.
+    """
+    items = request.data.get('messages') if isinstance(request.data, dict) else None
+    max_items = getattr(settings, 'CHAT_SEND_BATCH_MAX', 100)
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'messages must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > max_items:
+        return Response({'error': f'At most {max_items} messages per batch'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        serializer = BatchMessageItemSerializer(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {'status': 'error', 'errors': serializer.errors}
+    
+    room_ids = {data['room_id'] for _, data in valid}
+    member_rooms = set(
+        ChatRoom.objects.filter(id__in=room_ids, participants=request.user).values_list('id', flat=True)
+    )
+    
+    accepted = []
+    for index, data in valid:
+        if data['room_id'] in member_rooms:
+            accepted.append((index, data))
+        else:
+            results[index] = {'status': 'error', 'errors': {'room_id': ['Chat room not found or access denied']}}
+    
+    try:
+        messages = persist_messages([
+            (data['room_id'], request.user, data['encrypted_content']) for _, data in accepted
+        ])
+    except Exception as e:
+        logger.error(f"Error saving batch of {len(accepted)} messages for {request.user.username}: {e}")
+        return Response({'error': 'Failed to send messages'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    serialized = CompactMessageSerializer(messages, many=True, context={'request': request, 'read_watermarks': {}}).data
+    for (index, data), message in zip(accepted, serialized):
+        results[index] = {'status': 'created', 'message': message}
+    for index, item in enumerate(items):
+        if isinstance(item, dict) and 'client_id' in item:
+            results[index]['client_id'] = item['client_id']
+    
+    logger.info(f"Batch from {request.user.username}: {len(messages)} of {len(items)} messages saved in {len(member_rooms)} rooms")
+    
+    if not messages:
+        response_status = status.HTTP_400_BAD_REQUEST
+    elif len(messages) == len(items):
+        response_status = status.HTTP_201_CREATED
+    else:
+        response_status = status.HTTP_207_MULTI_STATUS
+    return Response({'results': results}, status=response_status)
+
+@api_view(['GET'])
+def export_room_messages(request, room_id):
+    """
+    Stream a room's encrypted history as NDJSON, one message per line.
+
+    Query parameters: since_id, since (ISO timestamp) and gzip=1. Room
+    participants and staff may export.
+    """
+    if not request.user.is_staff and not is_room_member(room_id, request.user.id):
+        return Response({'error': 'Chat room not found or access denied'}, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        since_id, since = parse_since(request.query_params.get('since_id'), request.query_params.get('since'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    compress = request.query_params.get('gzip') in ('1', 'true')
+    filename = f'room-{room_id}.ndjson' + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        export_room(
+            room_id, since_id, since, compress=compress,
+            chunk_size=getattr(settings, 'CHAT_EXPORT_CHUNK_SIZE', 2000),
+        ),
+        content_type='application/gzip' if compress else 'application/x-ndjson',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    logger.info(f"Exporting room {room_id} for {request.user.username} (since_id={since_id}, since={since}, gzip={compress})")
+    return response
+
 @api_view(['POST'])
 def mark_messages_read(request, room_id):
     """Mark messages as read in a room"""
     try:
-        room = ChatRoom.objects.get(id=room_id, participants=request.user)
+        if not is_room_member(room_id, request.user.id):
+            raise ChatRoom.DoesNotExist
         
-        updated_count = Message.objects.filter(
-            room=room,
-            is_read=False
-        ).exclude(sender=request.user).update(is_read=True)
+        updated_count = unread_count(room_id, request.user.id)
+        if updated_count > 0:
+            advance_read_watermark(room_id, request.user.id)
         
         logger.info(f"Marked {updated_count} messages as read in room {room_id} for {request.user.username}")
         
@@ -171,7 +284,7 @@ def mark_messages_read(request, room_id):
 def room_info(request, room_id):
     """Get detailed information about a chat room"""
     try:
-        room = ChatRoom.objects.get(id=room_id, participants=request.user)
+        room = get_member_room(room_id, request.user)
         serializer = ChatRoomSerializer(room, context={'request': request})
         
         # Add additional encryption info
@@ -190,4 +303,20 @@ def room_info(request, room_id):
         return Response({'error': 'Chat room not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         logger.error(f"Error getting room info for {room_id}: {e}")
-        return Response({'error': 'Failed to get room info'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return Response({'error': 'Failed to get room info'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def chat_metrics(request):
+    """Expose in-process cache and buffer counters for operators"""
+    return Response({
+        'membership_cache': membership_cache.stats(),
+        'message_buffer': buffer_stats(),
+        'presence': get_presence_service().stats(),
+        'typing': get_typing_tracker().stats(),
+        'send_queues': send_queue_stats(),
+        'read_watermarks': get_read_coalescer().stats(),
+        'recent_messages': recent_messages.stats(),
+        'websocket_auth': auth_stats(),
+        'key_pool': get_key_pool().stats(),
+    })
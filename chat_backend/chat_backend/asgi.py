@@ -10,6 +10,15 @@ django_asgi_app = get_asgi_application()
 
 from chat.routing import websocket_urlpatterns
 from chat.middleware import JwtAuthMiddlewareStack
+from chat.lifespan import lifespan_app
+from chat.revocation import get_revocation_index
+from accounts.keypool import get_key_pool
+
+# Start generating key pairs before the first registration asks for one
+get_key_pool().refill()
+
+# Load revoked tokens before the first handshake; later syncs run in the background
+get_revocation_index().start_background_sync()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -18,4 +27,6 @@ application = ProtocolTypeRouter({
             URLRouter(websocket_urlpatterns)
         )
     ),
+    # Daphne sends no lifespan events; presence then falls back to an atexit flush
+    "lifespan": lifespan_app,
 })
\ No newline at end of file
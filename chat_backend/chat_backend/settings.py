@@ -18,6 +18,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'channels',  # Add this
     'accounts',
@@ -57,6 +58,95 @@ CHANNEL_LAYERS = {
 #     },
 # }
 
+# Chat message persistence for WebSocket frames
+# 'strict'  - every message is committed on its own before fan-out
+# 'batched' - messages are buffered in-process and written with bulk_create
+CHAT_MESSAGE_PERSISTENCE = os.environ.get('CHAT_MESSAGE_PERSISTENCE', 'strict')
+CHAT_MESSAGE_BATCH_SIZE = 100           # Flush once this many messages are queued
+CHAT_MESSAGE_FLUSH_INTERVAL_MS = 10     # ...or after this many milliseconds
+CHAT_MESSAGE_BUFFER_MAX = 5000          # Senders wait when this many are pending
+
+# Room membership cache shared by WebSocket connects and REST access checks
+CHAT_MEMBERSHIP_CACHE_SIZE = 50000      # Max cached (room, user) answers (LRU)
+CHAT_MEMBERSHIP_CACHE_TTL = 60          # Seconds before an answer is re-checked
+
+# WebSocket handshake authentication (chat/middleware.py)
+CHAT_WS_TOKEN_CACHE_SIZE = 10000        # Verified tokens kept until their exp (LRU)
+CHAT_WS_USER_CACHE_SIZE = 10000         # Cached user rows for handshakes (LRU)
+CHAT_WS_USER_CACHE_TTL = 60             # Seconds before a cached user is reloaded
+
+# Revoked-token index for WebSocket handshakes (chat/revocation.py)
+CHAT_REVOCATION_CAPACITY = 100000       # Revoked tokens the bloom filter is sized for
+CHAT_REVOCATION_FP_RATE = 0.01          # Target bloom filter false-positive rate
+CHAT_REVOCATION_SYNC_INTERVAL = 5       # Seconds between background pulls of other processes' revocations
+CHAT_REVOCATION_GAP_TIMEOUT = 60        # Seconds an id skipped by a sync is re-checked (late commits)
+
+# Multiplexed WebSocket endpoint (ws/multiplex/)
+CHAT_MULTIPLEX_MAX_ROOMS = 200          # Max room subscriptions per connection
+
+# Presence: connections are ref-counted in memory and flushed periodically
+CHAT_PRESENCE_BACKEND = 'chat.presence.InMemoryPresenceBackend'
+CHAT_PRESENCE_FLUSH_INTERVAL = 2.0      # Seconds between broadcast/persist flushes
+CHAT_PRESENCE_TTL = 60.0                # Entries without a heartbeat expire after this
+
+# Typing indicators: only start/stop transitions are broadcast
+CHAT_TYPING_REPEAT_WINDOW = 3.0         # Repeated "typing" events inside this window are dropped
+CHAT_TYPING_IDLE_TIMEOUT = 6.0          # Automatic stop after this many quiet seconds
+
+# Binary WebSocket protocol, negotiated with the 'securechat.bin.v1' subprotocol
+CHAT_BINARY_PROTOCOL = False            # When on, every published event is also encoded as a binary frame
+
+# Per-connection outbound queues; the backlog is queued frames plus chat frames
+# written but not yet acknowledged by clients that send {"type": "ack"} frames
+CHAT_SEND_QUEUE_DROP_THRESHOLD = 64     # Typing/presence frames are dropped beyond this backlog
+CHAT_SEND_QUEUE_MAX = 256               # Connections are closed (code 4008) beyond this backlog
+
+# Read watermarks: WebSocket "read up to X" reports are coalesced per room/user
+CHAT_READ_FLUSH_DELAY = 0.5             # Seconds to collect reports before writing
+
+# Reconnect replay (?since=<message_id>); the recent-message buffer only sees messages
+# saved by its own process, so enable it (e.g. 200) only when a single worker writes messages
+CHAT_RECENT_MESSAGES_PER_ROOM = 0       # Messages kept in memory per active room (0 = off)
+CHAT_RECENT_ROOMS_MAX = 5000            # Least recently active rooms are evicted beyond this
+CHAT_REPLAY_MAX_MESSAGES = 100          # Per replay; keep well below CHAT_SEND_QUEUE_MAX
+
+# Message history pagination (room_messages ?before=/?after= cursors)
+CHAT_MESSAGE_PAGE_SIZE = 50             # Messages per page when no limit is given
+CHAT_MESSAGE_PAGE_MAX = 200             # Upper bound for ?limit=
+
+# Conditional GETs (chat/versions.py): version counters live in the default cache,
+# which must be shared by every worker (e.g. Redis or Memcached) for ETags to be sent.
+# With the per-process cache below, ETags are OFF and every GET returns a full body.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+# Shared cache that turns ETags on:
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379/1',
+#     },
+# }
+CHAT_ETAGS_WITH_LOCAL_CACHE = False     # Also send ETags on a per-process cache (single-process deployments only)
+
+# Batch send endpoint (offline outbox flush)
+CHAT_SEND_BATCH_MAX = 100               # Messages per send-batch request
+
+# Room history export (chat/export.py)
+CHAT_EXPORT_CHUNK_SIZE = 2000           # Rows fetched per keyset query while streaming
+
+# User search (accounts/search.py)
+USER_SEARCH_MIN_LENGTH = 2              # Shorter queries return nothing
+USER_SEARCH_RESULTS = 10                # Results per query
+USER_SEARCH_CACHE_TTL = 30              # Seconds a popular query's ranking is cached
+
+# RSA key pre-generation for registration (accounts/keypool.py)
+USER_KEY_POOL_LOW = 8                   # Refill when this many pairs or fewer are ready or in flight
+USER_KEY_POOL_HIGH = 32                 # Fill up to this many pairs (0 disables the pool)
+USER_KEY_POOL_WORKERS = 2               # Background generator processes
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -26,7 +26,7 @@ def cleanup_test_data():
         print("No test users found")
     
     # Also clean up users with broken keys (optional)
-    broken_users = CustomUser.objects.filter(public_key_pem__contains="[Key generation error]")
+    broken_users = CustomUser.objects.filter(keys__public_key_pem__contains="[Key generation error]")
     broken_count = broken_users.count()
     
     if broken_count > 0:
@@ -34,10 +34,7 @@ def cleanup_test_data():
         
         # Fix their keys instead of deleting them
         for user in broken_users:
-            user.public_key_pem = None
-            user.private_key_encrypted = None
-            user.symmetric_key = None
-            user.save()  # This will trigger key regeneration
+            user.issue_keys()  # Replaces the broken keys with new unique ones
             print(f"Fixed keys for user: {user.username}")
     
     print("✅ Cleanup completed")
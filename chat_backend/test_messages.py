@@ -23,12 +23,13 @@ if created2:
     user2.set_password('testpass123')
     user2.save()
 
-print(f"User1: {user1.username} - Has Key: {bool(user1.public_key_pem)}")
-print(f"User2: {user2.username} - Has Key: {bool(user2.public_key_pem)}")
+keys1, keys2 = user1.get_keys(), user2.get_keys()
+print(f"User1: {user1.username} - Has Key: {bool(keys1 and keys1.public_key_pem)}")
+print(f"User2: {user2.username} - Has Key: {bool(keys2 and keys2.public_key_pem)}")
 
 # Show first 100 chars of public key
-if user1.public_key_pem:
-    print(f"User1 Key Preview: {user1.public_key_pem[:100]}...")
+if keys1 and keys1.public_key_pem:
+    print(f"User1 Key Preview: {keys1.public_key_pem[:100]}...")
 
 # Create or get chat room
 room = ChatRoom.objects.create()
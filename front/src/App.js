@@ -133,6 +133,8 @@ const ChatProvider = ({ children }) => {
             timestamp: data.timestamp,
             is_read: false
           }]);
+          // Delivery ack: lets the server measure how far behind this tab is
+          newSocket.send(JSON.stringify({ type: 'ack', message_id: data.message_id }));
           break;
         
         case 'typing_indicator':